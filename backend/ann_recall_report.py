@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Recall-vs-exhaustive report for the approximate face search (IVF) index
+Use it to choose FACE_ANN_LISTS / FACE_ANN_PROBES for the current gallery, or with
+--prototypes to check the per-student prototype shortlist before enabling FACE_PROTOTYPES
+and to choose FACE_PROTOTYPE_SHORTLIST
+
+    python ann_recall_report.py                    # gallery from src/database/app.db
+    python ann_recall_report.py --synthetic 50000  # random gallery of that size
+    python ann_recall_report.py --prototypes       # prototype shortlist instead of the IVF index
+"""
+
+import argparse
+import os
+import sqlite3
+import numpy as np
+from src.utils.face_gallery import GallerySnapshot
+from src.utils.ann_index import recall_report
+from src.utils import face_prototypes
+
+def load_gallery(db_path):
+    """Load every stored face template from the SQLite database"""
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute("SELECT id, user_id, face_encoding FROM face_data").fetchall()
+    finally:
+        conn.close()
+    return GallerySnapshot.from_rows(rows)
+
+def synthetic_gallery(count, seed=0):
+    """Random 128-D encodings with roughly the spread of dlib face encodings, ~3 per identity"""
+    rng = np.random.default_rng(seed)
+    identities = rng.normal(0.0, 0.1, (max(1, count // 3), 128))
+    user_ids = rng.integers(0, len(identities), count)
+    encodings = identities[user_ids] + rng.normal(0.0, 0.03, (count, 128))
+    return GallerySnapshot(encodings, user_ids, np.arange(count))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=os.path.join(os.path.dirname(__file__), 'src', 'database', 'app.db'))
+    parser.add_argument('--synthetic', type=int, default=0, help='use a random gallery of this size')
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--noise', type=float, default=0.03, help='std of noise added to gallery rows to form queries')
+    parser.add_argument('--lists', type=int, nargs='*', default=[0], help='n_lists values (0 = sqrt(N))')
+    parser.add_argument('--probes', type=int, nargs='*', default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument('--prototypes', action='store_true', help='report the prototype shortlist instead')
+    parser.add_argument('--shortlists', type=int, nargs='*', default=[1, 2, 3, 5, 8],
+                        help='users re-ranked per probe (FACE_PROTOTYPE_SHORTLIST values)')
+    args = parser.parse_args()
+
+    gallery = synthetic_gallery(args.synthetic) if args.synthetic else load_gallery(args.db)
+    if len(gallery) == 0:
+        print("Gallery is empty, nothing to report")
+        return
+
+    rng = np.random.default_rng(1)
+    picks = rng.integers(0, len(gallery), args.queries)
+    queries = gallery.encodings[picks] + rng.normal(0.0, args.noise, (args.queries, gallery.encodings.shape[1]))
+
+    print(f"Gallery: {len(gallery)} templates, {args.queries} queries")
+    if args.prototypes:
+        print(f"{'protos':>8} {'n_users':>8} {'recall@1':>9} {'shortlist':>10} {'proto ms':>9} {'exact ms':>9}")
+        for row in face_prototypes.recall_report(gallery, queries, args.shortlists):
+            print(f"{row['prototypes']:>8} {row['n_users']:>8} {row['recall_at_1']:>9.3f} "
+                  f"{row['mean_shortlist']:>10.1f} {row['prototype_ms']:>9.3f} {row['exhaustive_ms']:>9.3f}")
+        return
+
+    print(f"{'n_lists':>8} {'n_probe':>8} {'recall@1':>9} {'shortlist':>10} {'ann ms':>8} {'exact ms':>9}")
+    for row in recall_report(gallery, queries, [n or None for n in args.lists], args.probes):
+        print(f"{row['n_lists']:>8} {row['n_probe']:>8} {row['recall_at_1']:>9.3f} "
+              f"{row['mean_shortlist']:>10.1f} {row['ann_ms']:>8.3f} {row['exhaustive_ms']:>9.3f}")
+
+if __name__ == "__main__":
+    main()
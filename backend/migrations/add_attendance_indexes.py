@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Migration script to add query indexes and the attendance_date day key
+Backfills attendance.attendance_date and creates the indexes declared on the models;
+the schema version is tracked in SQLite's user_version
+"""
+
+import sqlite3
+import os
+from datetime import datetime, timezone
+
+# Version 2 re-keys rows that version 1 dated by the UTC day of face check-ins
+SCHEMA_VERSION = 2
+BATCH_SIZE = 500
+
+INDEXES = [
+    ('ix_attendance_user_id_check_in_time', 'attendance', 'user_id, check_in_time', False),
+    ('ix_attendance_check_in_time', 'attendance', 'check_in_time', False),
+    ('ix_attendance_teacher_approval_user_id', 'attendance', 'teacher_approval, user_id', False),
+    ('uq_attendance_user_id_attendance_date', 'attendance', 'user_id, attendance_date', True),
+    ('ix_face_data_user_id', 'face_data', 'user_id', False),
+    ('ix_user_role_class_name', 'user', 'role, class_name', False),
+]
+
+def attendance_day(check_in_time, confidence_score):
+    """The day the app keys a row under, as an ISO date string
+
+    Face check-ins (the only rows with a confidence score) store a UTC
+    check_in_time and are keyed by the local day, like today_start(); rows
+    dated by the user (excuse forms, manual entries) by the day they name.
+    """
+    moment = datetime.fromisoformat(check_in_time)
+    if confidence_score is not None:
+        moment = moment.replace(tzinfo=timezone.utc).astimezone()
+    return moment.date().isoformat()
+
+def migrate_database():
+    """Backfill attendance_date (one row per student and day) and create the indexes"""
+
+    # Database path
+    db_path = os.path.join(os.path.dirname(__file__), '..', 'src', 'database', 'app.db')
+
+    if not os.path.exists(db_path):
+        print(f"Database file not found at {db_path}")
+        return False
+
+    conn = None
+    try:
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
+
+        cursor.execute("PRAGMA user_version")
+        version = cursor.fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            print(f"Schema version {version} is current, skipping index migration...")
+            return True
+
+        print("Starting index migration...")
+
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
+        tables = {row[0] for row in cursor.fetchall()}
+        if not {'user', 'face_data', 'attendance'} <= tables:
+            print("Tables do not exist yet, skipping (db.create_all() builds them with indexes)...")
+            return True
+
+        cursor.execute("PRAGMA table_info(attendance)")
+        columns = [column[1] for column in cursor.fetchall()]
+        if 'attendance_date' not in columns:
+            print("Adding column attendance_date...")
+            cursor.execute("ALTER TABLE attendance ADD COLUMN attendance_date DATE")
+
+        # Rows re-keyed below may pass through each other's day, so the unique index is rebuilt afterwards
+        cursor.execute("DROP INDEX IF EXISTS uq_attendance_user_id_attendance_date")
+
+        # The oldest row of each student and day gets the day key; later duplicates keep
+        # NULL (still listed by check_in_time) so the unique index can be built.
+        # Days are computed in Python: SQLite's date() would give face check-ins their UTC day
+        cursor.execute("""
+            SELECT id, user_id, check_in_time, confidence_score, attendance_date FROM attendance
+            WHERE check_in_time IS NOT NULL ORDER BY id
+        """)
+        seen = set()
+        updates = []
+        duplicates = []
+        while True:
+            rows = cursor.fetchmany(BATCH_SIZE)
+            if not rows:
+                break
+            for attendance_id, user_id, check_in_time, confidence_score, current_day in rows:
+                day = attendance_day(check_in_time, confidence_score)
+                if (user_id, day) in seen:
+                    duplicates.append(attendance_id)
+                    if current_day is not None:
+                        updates.append((None, attendance_id))
+                    continue
+                seen.add((user_id, day))
+                if current_day != day:
+                    updates.append((day, attendance_id))
+
+        for start in range(0, len(updates), BATCH_SIZE):
+            cursor.executemany(
+                "UPDATE attendance SET attendance_date = ? WHERE id = ?",
+                updates[start:start + BATCH_SIZE]
+            )
+        print(f"Backfilled attendance_date on {len(updates)} rows")
+        if duplicates:
+            print(f"{len(duplicates)} rows repeat a student's day and keep no day key: {duplicates[:20]}")
+
+        for name, table, columns, unique in INDEXES:
+            print(f"Creating index {name}...")
+            cursor.execute(
+                f'CREATE {"UNIQUE " if unique else ""}INDEX IF NOT EXISTS {name} ON "{table}" ({columns})'
+            )
+
+        cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
+
+        # Let the query planner use the new indexes right away
+        cursor.execute("ANALYZE")
+        conn.commit()
+        print(f"Migration completed successfully! Schema version {SCHEMA_VERSION}")
+        return True
+
+    except Exception as e:
+        print(f"Error during migration: {str(e)}")
+        if conn:
+            conn.rollback()
+        return False
+
+    finally:
+        if conn:
+            conn.close()
+
+if __name__ == "__main__":
+    success = migrate_database()
+    if success:
+        print("Index migration completed successfully!")
+    else:
+        print("Index migration failed!")
+        exit(1)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Migration script to convert stored face encodings to the binary template format
+Replaces pickled float64 arrays in face_data.face_encoding with float32 templates
+"""
+
+import sqlite3
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.utils.face_template import is_template, load_legacy_encoding, serialize_template
+
+BATCH_SIZE = 500
+
+def migrate_database():
+    """Backfill face_data rows that still hold legacy pickled encodings"""
+
+    # Database path
+    db_path = os.path.join(os.path.dirname(__file__), '..', 'src', 'database', 'app.db')
+
+    if not os.path.exists(db_path):
+        print(f"Database file not found at {db_path}")
+        return False
+
+    conn = None
+    try:
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
+
+        print("Starting face encoding migration...")
+
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='face_data'")
+        if cursor.fetchone() is None:
+            print("Table face_data does not exist, skipping...")
+            return True
+
+        cursor.execute("SELECT id, face_encoding FROM face_data")
+
+        updates = []
+        converted = 0
+        skipped = 0
+        failed = 0
+
+        while True:
+            rows = cursor.fetchmany(BATCH_SIZE)
+            if not rows:
+                break
+
+            for face_id, blob in rows:
+                if is_template(blob):
+                    skipped += 1
+                    continue
+                try:
+                    encoding = load_legacy_encoding(blob)
+                    updates.append((serialize_template(encoding), face_id))
+                except Exception as e:
+                    print(f"Cannot convert face_data {face_id}: {str(e)}")
+                    failed += 1
+
+        # Write all conversions in a single transaction
+        for start in range(0, len(updates), BATCH_SIZE):
+            cursor.executemany(
+                "UPDATE face_data SET face_encoding = ? WHERE id = ?",
+                updates[start:start + BATCH_SIZE]
+            )
+            converted += len(updates[start:start + BATCH_SIZE])
+
+        conn.commit()
+        print(f"Converted {converted} encodings, {skipped} already migrated, {failed} failed")
+
+        # Unreadable rows are left untouched; the gallery skips them at load time
+        return True
+
+    except Exception as e:
+        print(f"Error during migration: {str(e)}")
+        if conn:
+            conn.rollback()
+        return False
+
+    finally:
+        if conn:
+            conn.close()
+
+if __name__ == "__main__":
+    success = migrate_database()
+    if success:
+        print("Face encoding migration completed successfully!")
+    else:
+        print("Face encoding migration failed!")
+        exit(1)
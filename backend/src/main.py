@@ -11,8 +11,19 @@ from src.routes.admin import admin_bp
 from src.routes.student import student_bp
 from src.routes.face import face_bp
 from src.routes.teacher import teacher_bp
+from src.routes.health import health_bp
+from src.utils.face_gallery import face_gallery
+from src.utils.attendance_cache import checked_in_cache
+from src.utils.attendance_writer import attendance_writer
+from src.utils.face_recognition import WARMUP_ENABLED
+from src.utils.inference_executor import inference_executor
+import threading
 
 app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
+
+# `python main.py` runs the debug reloader: this process then only watches the files and
+# restarts a child (WERKZEUG_RUN_MAIN=true) that serves requests, loads models and writes
+RELOADER_WATCHER = __name__ == '__main__' and os.environ.get('WERKZEUG_RUN_MAIN') != 'true'
 app.config['SECRET_KEY'] = 'student_attendance_secret_key_2024'
 
 # Enable CORS for all routes
@@ -24,10 +35,15 @@ app.register_blueprint(admin_bp, url_prefix='/api')
 app.register_blueprint(student_bp, url_prefix='/api')
 app.register_blueprint(face_bp, url_prefix='/api')
 app.register_blueprint(teacher_bp, url_prefix='/api')
+app.register_blueprint(health_bp, url_prefix='/api')
 # Database configuration
 app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(os.path.dirname(__file__), 'database', 'app.db')}"
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 db.init_app(app)
+# Queued check-ins are committed by a writer thread and drained on exit/SIGTERM. Spawned
+# inference workers re-import this file as __mp_main__; they never write and keep their own signals
+if not RELOADER_WATCHER and __name__ != '__mp_main__':
+    attendance_writer.init_app(app)
 
 def init_database():
     """Initialize database with default admin user"""
@@ -51,6 +67,12 @@ def init_database():
             db.session.add(admin_user)
             db.session.commit()
             print("Created default admin user: admin/123")
+        
+        # Publish a fresh gallery snapshot so workers never map one left over from a previous run
+        face_gallery.invalidate()
+        
+        # Today's check-ins, so duplicate attempts are answered from memory
+        checked_in_cache.warm()
 
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
@@ -68,7 +90,16 @@ def serve(path):
         else:
             return "index.html not found", 404
 
+def start_warm_up():
+    """Load face models in the background when FACE_WARMUP=1; /api/ready reports 503 until done"""
+    if WARMUP_ENABLED:
+        threading.Thread(target=inference_executor.warm_up, name='face-warm-up', daemon=True).start()
+
 if __name__ == '__main__':
-    init_database()
+    # The database, gallery and models are set up once, in the serving child. Its SIGTERM
+    # handler is the reloader's sys.exit, so queued check-ins are drained by the atexit hook
+    if not RELOADER_WATCHER:
+        init_database()
+        start_warm_up()
     app.run(host='0.0.0.0', port=5001, debug=True)
 
@@ -1,10 +1,36 @@
+import os
+import sqlite3
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, inspect
+from sqlalchemy.engine import Engine
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 
 db = SQLAlchemy()
 
+# Applied to every new SQLite connection; an empty value leaves SQLite's default
+SQLITE_PRAGMAS = (
+    ('journal_mode', os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')),
+    ('synchronous', os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')),
+    ('busy_timeout', os.environ.get('SQLITE_BUSY_TIMEOUT_MS', '5000')),
+    ('mmap_size', os.environ.get('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024))),
+)
+
+@event.listens_for(Engine, 'connect')
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS:
+        if value:
+            cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
 class User(db.Model):
+    __table_args__ = (
+        db.Index('ix_user_role_class_name', 'role', 'class_name'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     password_hash = db.Column(db.String(255), nullable=False)
@@ -48,7 +74,7 @@ class User(db.Model):
 
 class FaceData(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     face_encoding = db.Column(db.LargeBinary, nullable=False)  # Encoded face features
     image_path = db.Column(db.String(255), nullable=False)  # Path to face image
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -65,9 +91,17 @@ class FaceData(db.Model):
         }
 
 class Attendance(db.Model):
+    __table_args__ = (
+        db.Index('ix_attendance_user_id_check_in_time', 'user_id', 'check_in_time'),
+        db.Index('ix_attendance_teacher_approval_user_id', 'teacher_approval', 'user_id'),
+        # One row per student per day; see migrations/add_attendance_indexes.py for legacy duplicates
+        db.Index('uq_attendance_user_id_attendance_date', 'user_id', 'attendance_date', unique=True),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    check_in_time = db.Column(db.DateTime, default=datetime.utcnow)
+    check_in_time = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    attendance_date = db.Column(db.Date, nullable=True)  # local day of the check-in, set on flush if omitted
     status = db.Column(db.String(20), nullable=False, default='present')  # present, absent, pending
     confidence_score = db.Column(db.Float, nullable=True)  # Face recognition confidence
     note = db.Column(db.Text, nullable=True)  # Student's explanation text
@@ -102,3 +136,19 @@ class Attendance(db.Model):
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
+
+@event.listens_for(Attendance, 'before_insert')
+def _set_attendance_date(mapper, connection, target):
+    # check_in_time's column default is only applied after this hook, so resolve it here.
+    # Recognition check-ins pass the local day explicitly (check_in_time is UTC); rows dated
+    # by the user (excuse forms, manual entries) take the day of their check_in_time.
+    if target.check_in_time is None:
+        target.check_in_time = datetime.utcnow()
+    if target.attendance_date is None:
+        target.attendance_date = target.check_in_time.date()
+
+@event.listens_for(Attendance, 'before_update')
+def _update_attendance_date(mapper, connection, target):
+    # Only a moved row changes its day; legacy duplicates keep their NULL day through approvals
+    if inspect(target).attrs.check_in_time.history.has_changes() and target.check_in_time is not None:
+        target.attendance_date = target.check_in_time.date()
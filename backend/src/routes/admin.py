@@ -1,6 +1,7 @@
 from flask import Blueprint, request, jsonify, session
 from src.models.user import db, User, Attendance, FaceData
 from src.routes.auth import require_admin
+from src.utils.request_images import UPLOAD_DIR
 from datetime import datetime
 
 
@@ -103,19 +104,21 @@ def update_student(student_id):
             if avatar_file:
                 try:
                     # Import necessary modules
-                    from src.utils.face_recognition import face_recognizer
+                    from src.utils.inference_executor import inference_executor
+                    from src.utils.face_gallery import face_gallery
+                    from src.utils.frame_context import FrameContext
                     import os
                     import uuid
-                    import base64
-                    import pickle
+                    from src.utils.face_template import serialize_template
                     
-                    # Read and encode the image
+                    # Decode the uploaded bytes directly (no base64 round-trip)
                     image_bytes = avatar_file.read()
-                    base64_image = base64.b64encode(image_bytes).decode('utf-8')
-                    base64_image = f"data:image/jpeg;base64,{base64_image}"
                     
                     # Validate face in image
-                    face_encoding, face_coordinates = face_recognizer.encode_face_for_registration(base64_image)
+                    face_encoding, face_coordinates = inference_executor.recognizer.encode_face_for_registration(
+                        FrameContext(image_bytes=image_bytes)
+                    )
+                    face_gallery.check_template(face_encoding)
                     
                     # Delete old face data if exists
                     old_face_data = FaceData.query.filter_by(user_id=student_id).all()
@@ -125,7 +128,7 @@ def update_student(student_id):
                         db.session.delete(old_data)
                     
                     # Create uploads directory if it doesn't exist
-                    upload_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'uploads', 'faces')
+                    upload_dir = UPLOAD_DIR
                     os.makedirs(upload_dir, exist_ok=True)
                     
                     # Generate unique filename
@@ -137,7 +140,7 @@ def update_student(student_id):
                         f.write(image_bytes)
                     
                     # Serialize face encoding
-                    face_encoding_blob = pickle.dumps(face_encoding)
+                    face_encoding_blob = serialize_template(face_encoding)
                     
                     # Save new face data to database
                     face_data = FaceData(
@@ -471,6 +474,28 @@ def get_dashboard_stats():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@admin_bp.route('/admin/face-engine/stats', methods=['GET'])
+@require_admin
+def get_face_engine_stats():
+    """Thống kê bộ gom lô nhận diện, bộ đệm phát hiện, kho khuôn mặt, bộ đệm và bộ ghi điểm danh"""
+    try:
+        from src.utils.micro_batcher import face_batcher
+        from src.utils.detection_cache import detection_cache
+        from src.utils.face_gallery import face_gallery
+        from src.utils.attendance_cache import checked_in_cache
+        from src.utils.attendance_writer import attendance_writer
+        
+        return jsonify({
+            'micro_batching': face_batcher.stats(),
+            'detection_cache': detection_cache.stats(),
+            'gallery': face_gallery.stats(),
+            'checked_in_cache': checked_in_cache.stats(),
+            'attendance_writer': attendance_writer.stats()
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @admin_bp.route('/admin/students/<int:student_id>/upload-image', methods=['POST'])
 @require_admin
 def upload_student_image(student_id):
@@ -480,39 +505,35 @@ def upload_student_image(student_id):
         if not student:
             return jsonify({'error': 'Sinh viên không tồn tại'}), 404
         
-        data = request.get_json()
-        base64_image = data.get('image')
-        if not base64_image:
+        # JSON base64, multipart file hoặc bytes ảnh thô
+        from src.utils.request_images import request_payload, request_frame
+        frame = request_frame(request_payload())
+        if frame is None:
             return jsonify({'error': 'Thiếu dữ liệu ảnh'}), 400
         
-        # Import face recognizer
-        from src.utils.face_recognition import face_recognizer
+        # Import face recognizer (runs in the inference worker pool when enabled)
+        from src.utils.inference_executor import inference_executor
+        from src.utils.face_gallery import face_gallery
         from src.models.user import FaceData
         import os
         import uuid
-        import base64
-        import pickle
+        from src.utils.face_template import serialize_template
         
         # Use optimized encoding function
         try:
-            face_encoding, face_coordinates = face_recognizer.encode_face_for_registration(base64_image)
+            face_encoding, face_coordinates = inference_executor.recognizer.encode_face_for_registration(frame)
+            face_gallery.check_template(face_encoding)
         except ValueError as e:
             return jsonify({'error': str(e)}), 400
         
-        # Decode and save image file
+        # Raw image bytes for saving (already decoded by the frame)
         try:
-            # Remove data:image/jpeg;base64, prefix if present
-            if ',' in base64_image:
-                image_data_clean = base64_image.split(',')[1]
-            else:
-                image_data_clean = base64_image
-            
-            image_bytes = base64.b64decode(image_data_clean)
+            image_bytes = frame.image_bytes
         except Exception as e:
             return jsonify({'error': 'Dữ liệu ảnh không hợp lệ'}), 400
         
         # Create uploads directory if it doesn't exist
-        upload_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'uploads', 'faces')
+        upload_dir = UPLOAD_DIR
         os.makedirs(upload_dir, exist_ok=True)
         
         # Generate unique filename
@@ -524,7 +545,7 @@ def upload_student_image(student_id):
             f.write(image_bytes)
         
         # Serialize face encoding
-        face_encoding_blob = pickle.dumps(face_encoding)
+        face_encoding_blob = serialize_template(face_encoding)
         
         # Save face data to database
         face_data = FaceData(
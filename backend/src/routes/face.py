@@ -1,15 +1,26 @@
-from flask import Blueprint, request, jsonify, session
+from flask import Blueprint, Response, request, jsonify, session, stream_with_context
 from src.models.user import db, User, FaceData, Attendance
 from src.routes.auth import require_auth
-from src.utils.face_recognition import face_recognizer
+from src.utils.face_recognition import face_recognizer, ADAPTIVE_JITTER_ENABLED, ADAPTIVE_MAX_JITTERS
+from src.utils.face_gallery import face_gallery
+from src.utils.face_template import serialize_template
+from src.utils.frame_context import FrameContext
+from src.utils.request_images import request_payload, request_frame, request_frames, UPLOAD_DIR
+from src.utils.inference_executor import inference_executor, InferenceTimeoutError
+from src.utils.micro_batcher import face_batcher
+from src.utils.face_tracker import face_tracker
+from src.utils.detection_cache import detection_cache
+from src.utils.attendance_cache import checked_in_cache, today_start
+from src.utils.attendance_writer import attendance_writer
+from src.utils.frame_stream import frame_streams, STREAM_CONFIRM_FRAMES, STREAM_RETRY_FRAMES, STREAM_HEARTBEAT
+import json
 import os
 import uuid
-from datetime import datetime
-import base64
-import pickle
 
 face_bp = Blueprint('face', __name__)
 
+MAX_BATCH_IMAGES = 64
+
 @face_bp.route('/face/upload', methods=['POST'])
 @require_auth
 def upload_face():
@@ -21,15 +32,15 @@ def upload_face():
             return jsonify({'error': 'User không tồn tại'}), 404
         
         # Get image data from request
-        data = request.get_json()
-        image_data = data.get('image')
+        data = request_payload()
+        frame = request_frame(data)
         
-        if not image_data:
+        if frame is None:
             return jsonify({'error': 'Không có dữ liệu ảnh'}), 400
         
         try:
             # Extract face features using our face recognition service
-            result = face_recognizer.encode_face_advanced(image_data)
+            result = inference_executor.recognizer.encode_face_advanced(frame)
             
             if len(result) == 2:
                 # New version with coordinates
@@ -38,23 +49,18 @@ def upload_face():
                 # Fallback for older version
                 face_encoding = result
                 face_coordinates = None
+            face_gallery.check_template(face_encoding)
         except ValueError as e:
             return jsonify({'error': str(e)}), 400
         
-        # Decode base64 image for saving
+        # Raw image bytes for saving (already decoded by the frame)
         try:
-            # Remove data:image/jpeg;base64, prefix if present
-            if ',' in image_data:
-                image_data_clean = image_data.split(',')[1]
-            else:
-                image_data_clean = image_data
-            
-            image_bytes = base64.b64decode(image_data_clean)
+            image_bytes = frame.image_bytes
         except Exception as e:
             return jsonify({'error': 'Dữ liệu ảnh không hợp lệ'}), 400
         
         # Create uploads directory if it doesn't exist
-        upload_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'uploads', 'faces')
+        upload_dir = UPLOAD_DIR
         os.makedirs(upload_dir, exist_ok=True)
         
         # Generate unique filename
@@ -68,12 +74,12 @@ def upload_face():
         # Save face data to database
         face_data = FaceData(
             user_id=user_id,
-            face_encoding=face_encoding,
+            face_encoding=serialize_template(face_encoding),
             image_path=image_path
         )
         
         db.session.add(face_data)
-        db.session.commit()
+        db.session.flush()
         
         response_data = {
             'message': 'Upload khuôn mặt thành công',
@@ -82,76 +88,156 @@ def upload_face():
         
         if face_coordinates:
             response_data['face_coordinates'] = face_coordinates
-            
-        return jsonify(response_data), 201
+        
+        detection = face_recognizer.detection_report(frame)
+        if detection:
+            response_data['detection'] = detection
+        
+        # Serialize before committing: a response that cannot be built must not leave a saved template behind
+        response = jsonify(response_data)
+        db.session.commit()
+        return response, 201
         
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+def _detection_scope():
+    """The client a frame comes from: near-identical frames are only reused within one client"""
+    user_id = session.get('user_id')
+    return f'user:{user_id}' if user_id is not None else f'addr:{request.remote_addr}'
+
+def _cached_detection(detector, frame, scope=None, perceptual=True):
+    """Detector result for the frame, reused for identical (or, within scope, near-identical) frames"""
+    return detection_cache.detect(
+        detector, frame, lambda: getattr(inference_executor.recognizer, detector)(frame),
+        scope=scope, perceptual=perceptual
+    )
+
+def _realtime_detection(frame):
+    """Full detection forced by the tracker: the boxes re-seed its templates, so never a near match"""
+    return _cached_detection('detect_faces_realtime_optimized', frame, perceptual=False)
+
+def _resolve_recognition_scope(data):
+    """Return (user_ids or None, scope name) for the optional recognition scope in a request
+    
+    With exclude_present, students already checked in today are dropped from a scoped candidate set.
+    """
+    user_ids, scope_name = _scope_members(data)
+    if user_ids is not None and data.get('exclude_present'):
+        user_ids = user_ids - checked_in_cache.present_user_ids()
+    return user_ids, scope_name
+
+def _scope_members(data):
+    if data.get('user_ids') is not None:
+        try:
+            user_ids = {int(user_id) for user_id in data['user_ids']}
+        except (TypeError, ValueError):
+            raise ValueError('user_ids phải là danh sách số nguyên')
+        return user_ids, 'user_ids'
+    
+    if data.get('teacher_id') is not None:
+        teacher = User.query.filter_by(id=data['teacher_id'], role='teacher').first()
+        if not teacher:
+            raise ValueError('Giáo viên không tồn tại')
+        class_name = teacher.class_name
+        scope_name = f'teacher:{teacher.id}'
+    elif data.get('class_name'):
+        class_name = data['class_name']
+        scope_name = f'class:{class_name}'
+    else:
+        return None, 'global'
+    
+    # Học sinh cùng lớp, giống như cách teacher.py lọc danh sách lớp
+    rows = db.session.query(User.id).filter_by(role='student', class_name=class_name).all()
+    return {row[0] for row in rows}, scope_name
+
 @face_bp.route('/face/recognize', methods=['POST'])
 def recognize_face():
     try:
-        data = request.get_json()
-        image_data = data.get('image')
+        data = request_payload()
+        frame = request_frame(data)
         
-        if not image_data:
+        if frame is None:
             return jsonify({'error': 'Không có dữ liệu ảnh'}), 400
         
         # Validate image quality first
         try:
-            image = face_recognizer.decode_base64_image(image_data)
-            if not face_recognizer._validate_image_quality(image):
+            if not face_recognizer._validate_image_quality(frame):
                 return jsonify({
                     'error': 'Chất lượng ảnh không đủ tốt. Vui lòng chụp ảnh trong điều kiện ánh sáng tốt và giữ camera ổn định.'
                 }), 400
         except:
             pass
         
-        # Lấy TẤT CẢ dữ liệu khuôn mặt từ database
-        all_face_data = FaceData.query.all()
+        # Xác định phạm vi nhận diện (lớp, danh sách lớp của giáo viên, hoặc danh sách user_id)
+        try:
+            scope_user_ids, scope_name = _resolve_recognition_scope(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        fallback_to_global = bool(data.get('fallback_to_global', False))
         
-        if len(all_face_data) == 0:
+        # Lấy gallery khuôn mặt đã được nạp sẵn trong bộ nhớ
+        if scope_user_ids is None:
+            gallery = face_gallery.snapshot()
+        else:
+            gallery = face_gallery.scoped(scope_user_ids)
+            if len(gallery) == 0 and fallback_to_global:
+                gallery = face_gallery.snapshot()
+                scope_name = 'global'
+        
+        if len(gallery) == 0:
+            if scope_user_ids is not None and data.get('exclude_present'):
+                return jsonify({'error': 'Tất cả học sinh trong phạm vi đã điểm danh hôm nay.', 'scope': scope_name}), 400
             return jsonify({'error': 'Không có dữ liệu khuôn mặt nào trong hệ thống.'}), 400
         
         try:
-            # Tạo danh sách tất cả encodings và user_ids tương ứng
-            known_encodings = []
-            user_ids = []
-            
-            for face_data in all_face_data:
-                known_encodings.append(face_data.face_encoding)
-                user_ids.append(face_data.user_id)
-            
-            # Thực hiện nhận diện với tất cả khuôn mặt
-            match_result = face_recognizer.recognize_face_advanced(
-                image_data, known_encodings, threshold=0.65
-            )
-            
-            # Unpack results - now includes face coordinates
-            if len(match_result) == 3:
-                match_index, confidence_score, face_coordinates = match_result
-            else:
-                # Fallback for older version compatibility
-                match_index, confidence_score = match_result
-                face_coordinates = None
+            # Thực hiện nhận diện trong phạm vi đã chọn
+            try:
+                # 1 jitter trước, chỉ encode lại với nhiều jitter hơn khi điểm nằm sát ngưỡng
+                # Các yêu cầu đến cùng lúc được gom thành một lô encode + so khớp
+                (test_encoding, face_coordinates, frame,
+                 match_index, confidence_score, recognition_path) = face_recognizer.recognize_adaptive(
+                    frame, gallery, 0.65, engine=face_batcher
+                )
+                
+                # Không khớp trong phạm vi -> thử lại với toàn bộ gallery (không encode lại)
+                if match_index is None and fallback_to_global and scope_name != 'global':
+                    gallery = face_gallery.snapshot()
+                    scope_name = 'global'
+                    match_index, confidence_score = face_recognizer.match_encoding(
+                        test_encoding, gallery, 0.65, frame
+                    )
+            except InferenceTimeoutError:
+                raise
+            except Exception as e:
+                raise ValueError(f"Face recognition failed: {str(e)}")
             
             if match_index is not None:
                 # Lấy user_id của người được nhận diện
-                matched_user_id = user_ids[match_index]
+                matched_user_id = int(gallery.user_ids[match_index])
+                
+                # Đã điểm danh hôm nay theo bộ đệm -> trả lời ngay, không truy vấn DB
+                cached_name = checked_in_cache.lookup([matched_user_id]).get(matched_user_id)
+                if cached_name is not None:
+                    return jsonify({
+                        'error': f'{cached_name} đã điểm danh hôm nay rồi.',
+                        'user_name': cached_name
+                    }), 400
+                
                 user = User.query.get(matched_user_id)
                 
                 if not user:
                     return jsonify({'error': 'User không tồn tại'}), 404
                 
                 # Kiểm tra điểm danh trùng lặp (cùng ngày)
-                today = datetime.now().date()
-                existing_attendance = Attendance.query.filter(
-                    Attendance.user_id == matched_user_id,
-                    Attendance.check_in_time >= today
+                existing_attendance = Attendance.query.filter_by(
+                    user_id=matched_user_id,
+                    attendance_date=today_start().date()
                 ).first()
                 
                 if existing_attendance:
+                    checked_in_cache.mark_present(matched_user_id, user.full_name)
                     return jsonify({
                         'error': f'{user.full_name} đã điểm danh hôm nay rồi.',
                         'existing_attendance': existing_attendance.to_dict(),
@@ -162,47 +248,342 @@ def recognize_face():
                 attendance = Attendance(
                     user_id=matched_user_id,
                     status='present',
-                    confidence_score=confidence_score
+                    confidence_score=confidence_score,
+                    attendance_date=today_start().date()  # same local day as the duplicate check
                 )
                 
-                db.session.add(attendance)
-                db.session.commit()
+                attendance_dict = attendance_writer.submit([(attendance, user)])[0]
+                if attendance_dict is None:
+                    # Another request checked this student in first
+                    return jsonify({
+                        'error': f'{user.full_name} đã điểm danh hôm nay rồi.',
+                        'user_name': user.full_name
+                    }), 400
                 
                 return jsonify({
                     'message': 'Điểm danh thành công',
-                    'attendance': attendance.to_dict(),
+                    'attendance': attendance_dict,
                     'confidence_score': confidence_score,
                     'user_name': user.full_name,
                     'user_id': matched_user_id,
-                    'face_coordinates': face_coordinates
+                    'face_coordinates': face_coordinates,
+                    'scope': scope_name,
+                    'recognition_path': recognition_path
                 }), 201
             else:
                 return jsonify({
                     'error': f'Không nhận diện được khuôn mặt. Độ tin cậy: {confidence_score:.2f}. Người này có thể chưa đăng ký khuôn mặt.',
                     'suggestion': 'Hãy đảm bảo khuôn mặt được chiếu sáng đều và nhìn thẳng vào camera.',
-                    'face_coordinates': face_coordinates
+                    'face_coordinates': face_coordinates,
+                    'scope': scope_name,
+                    'recognition_path': recognition_path
                 }), 400
                 
         except ValueError as e:
             return jsonify({'error': str(e)}), 400
             
+    except InferenceTimeoutError as e:
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        return jsonify({'error': f'Lỗi hệ thống: {str(e)}'}), 500
+
+def _record_attendance(results):
+    """Create today's Attendance for every result with a user_id, written together by the attendance writer
+    
+    Results are updated in place with status recognized/duplicate/error; returns
+    the list of new Attendance rows.
+    """
+    matched_user_ids = {result['user_id'] for result in results if result.get('user_id') is not None}
+    if not matched_user_ids:
+        return []
+    
+    # Students the checked-in cache already knows need no query at all; the rest are
+    # loaded with two queries (users and today's attendance)
+    cached_names = {
+        user_id: name for user_id, name in checked_in_cache.lookup(matched_user_ids).items() if name is not None
+    }
+    pending_user_ids = matched_user_ids - cached_names.keys()
+    today = today_start().date()
+    users, already_checked_in = {}, {}
+    if pending_user_ids:
+        users = {user.id: user for user in User.query.filter(User.id.in_(pending_user_ids)).all()}
+        for record in Attendance.query.filter(
+            Attendance.user_id.in_(pending_user_ids),
+            Attendance.attendance_date == today
+        ).all():
+            already_checked_in.setdefault(record.user_id, record)
+            if record.user_id in users:
+                checked_in_cache.mark_present(record.user_id, users[record.user_id].full_name)
+    
+    new_attendance = []
+    for result in results:
+        user_id = result.get('user_id')
+        if user_id is None:
+            continue
+        
+        if user_id in cached_names:
+            result['user_name'] = cached_names[user_id]
+            result['status'] = 'duplicate'
+            result['error'] = f'{cached_names[user_id]} đã điểm danh hôm nay rồi.'
+            continue
+        
+        user = users.get(user_id)
+        if not user:
+            result['status'] = 'error'
+            result['error'] = 'User không tồn tại'
+            continue
+        
+        result['user_name'] = user.full_name
+        existing = already_checked_in.get(user_id)
+        if existing is not None:
+            result['status'] = 'duplicate'
+            result['error'] = f'{user.full_name} đã điểm danh hôm nay rồi.'
+            if existing.id is not None:
+                result['existing_attendance'] = existing.to_dict()
+            continue
+        
+        attendance = Attendance(
+            user_id=user_id,
+            status='present',
+            confidence_score=result['confidence_score'],
+            attendance_date=today  # same local day as the duplicate check
+        )
+        already_checked_in[user_id] = attendance
+        new_attendance.append((result, attendance, user))
+        result['status'] = 'recognized'
+    
+    # All check-ins go to the attendance writer together (one grouped commit)
+    if new_attendance:
+        written = attendance_writer.submit([(attendance, user) for _, attendance, user in new_attendance])
+        for (result, _, user), attendance_dict in zip(new_attendance, written):
+            if attendance_dict is None:
+                # Another request checked this student in first
+                result['status'] = 'duplicate'
+                result['error'] = f'{user.full_name} đã điểm danh hôm nay rồi.'
+            else:
+                result['attendance'] = attendance_dict
+        new_attendance = [
+            entry for entry, attendance_dict in zip(new_attendance, written) if attendance_dict is not None
+        ]
+    
+    return [attendance for _, attendance, _ in new_attendance]
+
+@face_bp.route('/face/recognize/batch', methods=['POST'])
+def recognize_face_batch():
+    """Recognize many images in one request: one gallery pass, one attendance commit"""
+    try:
+        data = request_payload()
+        images = request_frames(data)
+        
+        if images is None:
+            return jsonify({'error': 'Không có dữ liệu ảnh'}), 400
+        
+        if len(images) > MAX_BATCH_IMAGES:
+            return jsonify({'error': f'Tối đa {MAX_BATCH_IMAGES} ảnh mỗi yêu cầu'}), 400
+        
+        try:
+            scope_user_ids, scope_name = _resolve_recognition_scope(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        fallback_to_global = bool(data.get('fallback_to_global', False))
+        
+        if scope_user_ids is None:
+            gallery = face_gallery.snapshot()
+        else:
+            gallery = face_gallery.scoped(scope_user_ids)
+        
+        if len(gallery) == 0 and not fallback_to_global:
+            return jsonify({'error': 'Không có dữ liệu khuôn mặt nào trong hệ thống.'}), 400
+        
+        # Detect + encode every image; failures are reported per item
+        results = [{'index': i} for i in range(len(images))]
+        first_jitters = 1 if ADAPTIVE_JITTER_ENABLED else ADAPTIVE_MAX_JITTERS
+        encoded = []  # (result, encoding, frame)
+        outcomes = []  # (result, (encoding, coordinates, frame) or the exception it raised)
+        if inference_executor.workers > 1:
+            # Fan the images out across the worker pool and collect them in order
+            calls = []
+            for result, frame in zip(results, images):
+                try:
+                    calls.append((result, inference_executor.submit(
+                        'encode_probe_face', frame, num_jitters=first_jitters
+                    )))
+                except Exception as e:
+                    outcomes.append((result, e))
+            for result, call in calls:
+                try:
+                    outcomes.append((result, call.result()))
+                except Exception as e:
+                    outcomes.append((result, e))
+        else:
+            # One process: encode every face in one batched encoder call
+            try:
+                batch = inference_executor.submit(
+                    'encode_probe_faces', images, num_jitters=first_jitters
+                ).result()
+            except Exception as e:
+                batch = [e] * len(images)
+            outcomes = list(zip(results, batch))
+        
+        for result, outcome in outcomes:
+            if isinstance(outcome, Exception):
+                result['status'] = 'error'
+                result['error'] = str(outcome)
+                continue
+            test_encoding, face_coordinates, frame = outcome
+            result['recognition_path'] = {
+                'path': 'fast' if ADAPTIVE_JITTER_ENABLED else 'full', 'num_jitters': first_jitters
+            }
+            result['face_coordinates'] = face_coordinates
+            encoded.append((result, test_encoding, frame))
+        
+        # One matrix-level comparison for all encodings, then global fallback for the misses
+        matches = [(None, 0.0, None)] * len(encoded)
+        if len(gallery) > 0:
+            matched = face_recognizer.match_encodings(
+                [item[1] for item in encoded], gallery, 0.65, [item[2] for item in encoded]
+            )
+            matches = [(index, score, gallery) for index, score in matched]
+            
+            # Re-encode only the ambiguous items with more jitters and match them again
+            ambiguous = [i for i, (_, score, _) in enumerate(matches)
+                         if ADAPTIVE_JITTER_ENABLED and face_recognizer.is_ambiguous_score(score, encoded[i][2], 0.65)]
+            if ambiguous:
+                # A failed re-encode keeps that item's first-pass encoding and match
+                calls = []
+                for i in ambiguous:
+                    result, _, frame = encoded[i]
+                    try:
+                        calls.append((i, inference_executor.submit(
+                            'encode_probe_face', frame, num_jitters=ADAPTIVE_MAX_JITTERS
+                        )))
+                    except Exception as e:
+                        result['recognition_path']['escalation_error'] = str(e)
+                
+                succeeded = []
+                for i, call in calls:
+                    result, _, frame = encoded[i]
+                    try:
+                        test_encoding, _, _ = call.result()
+                    except Exception as e:
+                        result['recognition_path']['escalation_error'] = str(e)
+                        continue
+                    encoded[i] = (result, test_encoding, frame)
+                    result['recognition_path'] = {'path': 'escalated', 'num_jitters': ADAPTIVE_MAX_JITTERS}
+                    succeeded.append(i)
+                
+                if succeeded:
+                    matched = face_recognizer.match_encodings(
+                        [encoded[i][1] for i in succeeded], gallery, 0.65, [encoded[i][2] for i in succeeded]
+                    )
+                    for i, (index, score) in zip(succeeded, matched):
+                        matches[i] = (index, score, gallery)
+        
+        if fallback_to_global and scope_user_ids is not None:
+            global_gallery = face_gallery.snapshot()
+            misses = [i for i, match in enumerate(matches) if match[0] is None]
+            if misses and len(global_gallery) > 0:
+                matched = face_recognizer.match_encodings(
+                    [encoded[i][1] for i in misses], global_gallery, 0.65, [encoded[i][2] for i in misses]
+                )
+                for i, (index, score) in zip(misses, matched):
+                    matches[i] = (index, score, global_gallery)
+        
+        matched_user_ids = set()
+        for (result, _, _), (index, score, source) in zip(encoded, matches):
+            result['confidence_score'] = score
+            if index is None:
+                result['status'] = 'not_recognized'
+                result['error'] = f'Không nhận diện được khuôn mặt. Độ tin cậy: {score:.2f}.'
+            else:
+                result['user_id'] = int(source.user_ids[index])
+                result['scope'] = scope_name if source is gallery else 'global'
+                matched_user_ids.add(result['user_id'])
+        
+        new_attendance = _record_attendance(results)
+        
+        return jsonify({
+            'message': f'Đã xử lý {len(images)} ảnh, điểm danh thành công {len(new_attendance)}',
+            'results': results,
+            'recognized': len(new_attendance)
+        }), 200
+        
     except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'Lỗi hệ thống: {str(e)}'}), 500
+
+@face_bp.route('/face/recognize/group', methods=['POST'])
+@require_auth
+def recognize_face_group():
+    """Take attendance for every face in a single (classroom) photo"""
+    try:
+        data = request_payload()
+        frame = request_frame(data)
+        
+        if frame is None:
+            return jsonify({'error': 'Không có dữ liệu ảnh'}), 400
+        
+        try:
+            scope_user_ids, scope_name = _resolve_recognition_scope(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        # Giáo viên không chỉ định phạm vi -> mặc định là lớp của giáo viên
+        if scope_user_ids is None and session.get('user_role') == 'teacher':
+            scope_user_ids, scope_name = _resolve_recognition_scope({
+                'teacher_id': session.get('user_id'), 'exclude_present': data.get('exclude_present')
+            })
+        
+        gallery = face_gallery.snapshot() if scope_user_ids is None else face_gallery.scoped(scope_user_ids)
+        if len(gallery) == 0:
+            return jsonify({'error': 'Không có dữ liệu khuôn mặt nào trong hệ thống.'}), 400
+        
+        try:
+            encodings, coordinates, frame = inference_executor.recognizer.encode_all_faces(frame)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        except InferenceTimeoutError as e:
+            return jsonify({'error': str(e)}), 503
+        
+        # One vectorized pass + one-to-one assignment so no two faces map to the same student
+        threshold = face_recognizer._calculate_dynamic_threshold(frame, 0.65)
+        assignments = gallery.assign_unique(encodings, threshold)
+        
+        results = []
+        for i, (face_coordinates, (user_id, score)) in enumerate(zip(coordinates, assignments)):
+            result = {'index': i, 'face_coordinates': face_coordinates, 'confidence_score': score}
+            if user_id is None:
+                result['status'] = 'not_recognized'
+            else:
+                result['user_id'] = user_id
+            results.append(result)
+        
+        new_attendance = _record_attendance(results)
+        
+        return jsonify({
+            'message': f'Phát hiện {len(results)} khuôn mặt, điểm danh thành công {len(new_attendance)}',
+            'faces': results,
+            'recognized': len(new_attendance),
+            'scope': scope_name
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
         return jsonify({'error': f'Lỗi hệ thống: {str(e)}'}), 500
 
 @face_bp.route('/face/test-recognition', methods=['POST'])
 def test_recognition():
     """Test endpoint for face recognition without authentication (for testing purposes)"""
     try:
-        data = request.get_json()
-        image_data = data.get('image')
+        data = request_payload()
+        frame = request_frame(data)
         
-        if not image_data:
+        if frame is None:
             return jsonify({'error': 'Không có dữ liệu ảnh'}), 400
         
         try:
             # Test face detection
-            image = face_recognizer.decode_base64_image(image_data)
-            faces = face_recognizer.detect_faces(image)
+            faces = face_recognizer.detect_faces(frame.bgr)
             
             if len(faces) == 0:
                 return jsonify({
@@ -218,7 +599,7 @@ def test_recognition():
                 }), 200
             else:
                 # Try to extract features
-                features = face_recognizer.extract_face_features(image)
+                features = face_recognizer.extract_face_features_advanced(frame.bgr)
                 
                 return jsonify({
                     'message': 'Test nhận diện thành công',
@@ -238,10 +619,10 @@ def debug_recognition():
     """Debug endpoint for detailed face recognition analysis"""
     try:
         user_id = session.get('user_id')
-        data = request.get_json()
-        image_data = data.get('image')
+        data = request_payload()
+        frame = request_frame(data)
         
-        if not image_data:
+        if frame is None:
             return jsonify({'error': 'Không có dữ liệu ảnh'}), 400
         
         # Get user's face data
@@ -262,8 +643,9 @@ def debug_recognition():
             # Get known encodings
             known_encodings = [face.face_encoding for face in user_face_data]
             
-            # Extract features from test image
-            test_encoding = face_recognizer.encode_face_advanced(image_data)
+            # Encode the test image once and reuse it for scoring and the recognition result
+            test_encoding, face_coordinates, frame = inference_executor.recognizer.encode_probe_face(frame)
+            debug_info['face_coordinates'] = face_coordinates
             
             # Compare with each registered face
             for i, known_encoding in enumerate(known_encodings):
@@ -277,8 +659,8 @@ def debug_recognition():
                     debug_info['best_score'] = score
             
             # Recognition result
-            match_index, confidence = face_recognizer.recognize_face_advanced(
-                image_data, known_encodings, threshold=0.4
+            match_index, confidence = face_recognizer.match_encoding(
+                test_encoding, known_encodings, 0.4, frame
             )
             
             debug_info['recognition_result'] = {
@@ -301,15 +683,15 @@ def debug_recognition():
 def detect_face():
     """Detect faces in image and return coordinates for drawing rectangles"""
     try:
-        data = request.get_json()
-        image_data = data.get('image')
+        data = request_payload()
+        frame = request_frame(data)
         
-        if not image_data:
+        if frame is None:
             return jsonify({'error': 'Không có dữ liệu ảnh'}), 400
         
         try:
             # Detect faces and get coordinates
-            face_detection_result = face_recognizer.detect_faces_with_coordinates(image_data)
+            face_detection_result = _cached_detection('detect_faces_with_coordinates', frame, _detection_scope())
             
             return jsonify({
                 'message': f'Phát hiện {len(face_detection_result["faces"])} khuôn mặt',
@@ -326,24 +708,46 @@ def detect_face():
 
 @face_bp.route('/face/detect-realtime', methods=['POST'])
 def detect_face_realtime():
-    """Detect faces optimized for real-time processing"""
+    """Detect faces optimized for real-time processing
+    
+    Send 'track': true (first frame) or the returned 'session_id' to use a
+    tracking session: full detection only every few frames, template
+    tracking in between.
+    """
     try:
-        data = request.get_json()
-        image_data = data.get('image')
+        data = request_payload()
+        frame = request_frame(data)
         
-        if not image_data:
+        if frame is None:
             return jsonify({'error': 'Không có dữ liệu ảnh'}), 400
         
         try:
-            # Use optimized real-time detection
-            face_detection_result = face_recognizer.detect_faces_realtime_optimized(image_data)
+            session_id = data.get('session_id')
             
-            return jsonify({
+            if session_id or data.get('track'):
+                # Phiên theo dõi: chỉ phát hiện lại định kỳ hoặc khi mất dấu khuôn mặt
+                tracking_session = face_tracker.session(session_id)
+                face_detection_result = face_tracker.process(
+                    tracking_session, frame, _realtime_detection
+                )
+            else:
+                # Use optimized real-time detection
+                tracking_session = None
+                face_detection_result = _cached_detection(
+                    'detect_faces_realtime_optimized', frame, _detection_scope()
+                )
+            
+            response = {
                 'message': f'Phát hiện {len(face_detection_result["faces"])} khuôn mặt',
                 'faces': face_detection_result['faces'],
                 'image_width': face_detection_result['image_width'],
                 'image_height': face_detection_result['image_height']
-            }), 200
+            }
+            if tracking_session is not None:
+                response['session_id'] = tracking_session.session_id
+                response['tracking'] = face_detection_result['tracking']
+            
+            return jsonify(response), 200
             
         except ValueError as e:
             return jsonify({'error': str(e)}), 400
@@ -351,20 +755,193 @@ def detect_face_realtime():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@face_bp.route('/face/detect-realtime/<session_id>', methods=['DELETE'])
+def end_realtime_session(session_id):
+    """End a real-time tracking session (camera preview closed)"""
+    if not face_tracker.close(session_id):
+        return jsonify({'error': 'Phiên theo dõi không tồn tại hoặc đã hết hạn'}), 404
+    return jsonify({'message': 'Đã kết thúc phiên theo dõi'}), 200
+
+@face_bp.route('/face/stream', methods=['POST'])
+def open_face_stream():
+    """Open a live recognition stream
+    
+    Frames are POSTed as raw image bytes to /face/stream/<id>/frames and
+    results are pushed as Server-Sent Events from /face/stream/<id>/events.
+    Accepts the same scope fields as /face/recognize.
+    """
+    try:
+        data = request_payload()
+        
+        try:
+            scope_user_ids, scope_name = _resolve_recognition_scope(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        stream = frame_streams.open(scope_user_ids, scope_name)
+        return jsonify({
+            'stream_id': stream.stream_id,
+            'scope': scope_name,
+            'frames_url': f'/api/face/stream/{stream.stream_id}/frames',
+            'events_url': f'/api/face/stream/{stream.stream_id}/events'
+        }), 201
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@face_bp.route('/face/stream/<stream_id>/frames', methods=['POST'])
+def push_stream_frame(stream_id):
+    """Offer the newest camera frame (raw JPEG/PNG body or multipart 'image'); older unprocessed frames are dropped"""
+    stream = frame_streams.get(stream_id)
+    if stream is None or stream.closed:
+        return jsonify({'error': 'Luồng không tồn tại hoặc đã đóng'}), 404
+    
+    if request.mimetype == 'multipart/form-data':
+        upload = request.files.get('image')
+        image_bytes = upload.read() if upload else b''
+    else:
+        image_bytes = request.get_data(cache=False)
+    if not image_bytes:
+        return jsonify({'error': 'Không có dữ liệu ảnh'}), 400
+    
+    dropped = stream.push(image_bytes)
+    return jsonify({'accepted': True, 'dropped_previous': dropped, **stream.stats()}), 202
+
+@face_bp.route('/face/stream/<stream_id>/events', methods=['GET'])
+def stream_face_events(stream_id):
+    """Server-Sent Events: 'faces' for every processed frame, 'recognition' once a face is confirmed"""
+    stream = frame_streams.get(stream_id)
+    if stream is None or stream.closed:
+        return jsonify({'error': 'Luồng không tồn tại hoặc đã đóng'}), 404
+    if stream.consumer_attached:
+        return jsonify({'error': 'Luồng đã có kết nối nhận sự kiện'}), 409
+    stream.consumer_attached = True
+    
+    return Response(
+        stream_with_context(_stream_events(stream)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@face_bp.route('/face/stream/<stream_id>', methods=['DELETE'])
+def close_face_stream(stream_id):
+    """Close a live recognition stream"""
+    if not frame_streams.close(stream_id):
+        return jsonify({'error': 'Luồng không tồn tại hoặc đã đóng'}), 404
+    return jsonify({'message': 'Đã đóng luồng'}), 200
+
+def _sse(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+def _stream_events(stream):
+    """Process the newest frame whenever one arrives, with detection boxes kept alive by tracking"""
+    tracking_session = face_tracker.session()
+    yield _sse('ready', {'stream_id': stream.stream_id, 'scope': stream.scope_name})
+    
+    try:
+        while not stream.closed:
+            image_bytes = stream.take(STREAM_HEARTBEAT)
+            if image_bytes is None:
+                if stream.idle:
+                    yield _sse('end', {'reason': 'idle', **stream.stats()})
+                    break
+                yield ': keepalive\n\n'
+                continue
+            
+            try:
+                frame = FrameContext(image_bytes=image_bytes)
+                result = face_tracker.process(
+                    tracking_session, frame, _realtime_detection
+                )
+            except Exception as e:
+                yield _sse('error', {'error': str(e)})
+                continue
+            
+            stream.frame_number += 1
+            yield _sse('faces', {
+                'frame': stream.frame_number,
+                'faces': result['faces'],
+                'image_width': result['image_width'],
+                'image_height': result['image_height'],
+                'tracking': result['tracking'],
+                'frames_dropped': stream.frames_dropped
+            })
+            
+            recognition = _stream_recognition(stream, frame, result['faces'])
+            if recognition is not None:
+                yield _sse('recognition', recognition)
+    finally:
+        face_tracker.close(tracking_session.session_id)
+        frame_streams.close(stream.stream_id)
+
+def _stream_recognition(stream, frame, faces):
+    """Recognize (and check in) once a face has persisted for a few frames; None if nothing to report"""
+    if not faces:
+        # Khuôn mặt rời khỏi khung hình -> người tiếp theo được nhận diện lại từ đầu
+        stream.face_streak = 0
+        stream.recognized = False
+        stream.next_attempt = 0
+        return None
+    
+    stream.face_streak += 1
+    if (stream.recognized or stream.face_streak < STREAM_CONFIRM_FRAMES
+            or stream.frame_number < stream.next_attempt):
+        return None
+    stream.next_attempt = stream.frame_number + STREAM_RETRY_FRAMES
+    
+    if stream.scope_user_ids is None:
+        gallery = face_gallery.snapshot()
+    else:
+        gallery = face_gallery.scoped(stream.scope_user_ids)
+    if len(gallery) == 0:
+        return {'status': 'error', 'error': 'Không có dữ liệu khuôn mặt nào trong hệ thống.'}
+    
+    try:
+        (_, face_coordinates, _, match_index,
+         confidence_score, recognition_path) = face_recognizer.recognize_adaptive(
+            frame, gallery, 0.65, engine=face_batcher
+        )
+    except Exception as e:
+        return {'status': 'error', 'error': str(e)}
+    
+    result = {
+        'frame': stream.frame_number,
+        'face_coordinates': face_coordinates,
+        'confidence_score': confidence_score,
+        'scope': stream.scope_name,
+        'recognition_path': recognition_path
+    }
+    if match_index is None:
+        result['status'] = 'not_recognized'
+        result['error'] = f'Không nhận diện được khuôn mặt. Độ tin cậy: {confidence_score:.2f}.'
+        return result
+    
+    result['user_id'] = int(gallery.user_ids[match_index])
+    try:
+        _record_attendance([result])
+    except Exception as e:
+        db.session.rollback()
+        result['status'] = 'error'
+        result['error'] = str(e)
+        return result
+    
+    stream.recognized = True
+    return result
+
 @face_bp.route('/face/validate-image', methods=['POST'])
 @require_auth
 def validate_image():
     """Validate if image contains a detectable face"""
     try:
-        data = request.get_json()
-        image_data = data.get('image')
+        data = request_payload()
+        frame = request_frame(data)
         
-        if not image_data:
+        if frame is None:
             return jsonify({'error': 'Không có dữ liệu ảnh'}), 400
         
         try:
             # Try to encode face - if successful, face is detected
-            result = face_recognizer.encode_face_for_registration(image_data)
+            result = inference_executor.recognizer.encode_face_for_registration(frame)
             
             if len(result) == 2:
                 # New version with coordinates
@@ -395,10 +972,10 @@ def validate_image():
 def upload_face_for_registration():
     """Fast face upload for student registration"""
     try:
-        data = request.get_json()
-        base64_image = data.get('image')
+        data = request_payload()
+        frame = request_frame(data)
         
-        if not base64_image:
+        if frame is None:
             return jsonify({'error': 'Thiếu dữ liệu ảnh'}), 400
         
         user_id = session.get('user_id')
@@ -409,25 +986,20 @@ def upload_face_for_registration():
         
         # Use optimized encoding function
         try:
-            face_encoding, face_coordinates = face_recognizer.encode_face_for_registration(base64_image)
+            face_encoding, face_coordinates = inference_executor.recognizer.encode_face_for_registration(frame)
+            face_gallery.check_template(face_encoding)
         except ValueError as e:
             return jsonify({'error': str(e)}), 400
         
-        # Decode and save image file
+        # Raw image bytes for saving (already decoded by the frame)
         try:
-            # Remove data:image/jpeg;base64, prefix if present
-            if ',' in base64_image:
-                image_data_clean = base64_image.split(',')[1]
-            else:
-                image_data_clean = base64_image
-            
-            image_bytes = base64.b64decode(image_data_clean)
+            image_bytes = frame.image_bytes
         except Exception as e:
             return jsonify({'error': 'Dữ liệu ảnh không hợp lệ'}), 400
         
         # Create uploads directory if it doesn't exist
         import uuid
-        upload_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'uploads', 'faces')
+        upload_dir = UPLOAD_DIR
         os.makedirs(upload_dir, exist_ok=True)
         
         # Generate unique filename
@@ -439,7 +1011,7 @@ def upload_face_for_registration():
             f.write(image_bytes)
         
         # Serialize encoding
-        encoding_bytes = pickle.dumps(face_encoding)
+        encoding_bytes = serialize_template(face_encoding)
         
         # Save to database with image_path
         face_data = FaceData(
@@ -449,12 +1021,13 @@ def upload_face_for_registration():
         )
         
         db.session.add(face_data)
-        db.session.commit()
         
-        return jsonify({
+        response = jsonify({
             'message': 'Upload ảnh thành công',
             'face_coordinates': face_coordinates
-        }), 200
+        })
+        db.session.commit()
+        return response, 200
         
     except Exception as e:
         db.session.rollback()
@@ -0,0 +1,31 @@
+from flask import Blueprint, jsonify
+from sqlalchemy import text
+from src.models.user import db
+from src.utils.face_recognition import WARMUP_ENABLED
+from src.utils.inference_executor import inference_executor
+
+health_bp = Blueprint('health', __name__)
+
+@health_bp.route('/health', methods=['GET'])
+def liveness():
+    """Tiến trình còn hoạt động (không kiểm tra phụ thuộc)"""
+    return jsonify({'status': 'ok'}), 200
+
+@health_bp.route('/ready', methods=['GET'])
+def readiness():
+    """Sẵn sàng phục vụ: cơ sở dữ liệu truy cập được và (nếu bật FACE_WARMUP) mô hình đã được nạp"""
+    checks = {}
+    ready = True
+    
+    try:
+        db.session.execute(text('SELECT 1'))
+        checks['database'] = 'ok'
+    except Exception as e:
+        checks['database'] = str(e)
+        ready = False
+    
+    checks['face_models'] = inference_executor.warm_up_state
+    if WARMUP_ENABLED and checks['face_models'].get('status') != 'ready':
+        ready = False
+    
+    return jsonify({'ready': ready, 'checks': checks}), 200 if ready else 503
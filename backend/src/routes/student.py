@@ -159,9 +159,15 @@ def create_attendance():
         if 'check_in_time' not in data:
             return jsonify({'error': 'Thiếu thời gian điểm danh'}), 400
         
+        check_in_time = datetime.fromisoformat(data['check_in_time'])
+        
+        # Mỗi học sinh chỉ có một bản ghi điểm danh mỗi ngày
+        if Attendance.query.filter_by(user_id=user_id, attendance_date=check_in_time.date()).first():
+            return jsonify({'error': 'Đã có bản ghi điểm danh cho ngày này'}), 400
+        
         attendance_record = Attendance(
             user_id=user_id,
-            check_in_time=datetime.fromisoformat(data['check_in_time']),
+            check_in_time=check_in_time,
             status=data.get('status', 'present')  # Default to 'present'
         )
         
@@ -205,14 +211,18 @@ def submit_excuse_form():
         except ValueError:
             return jsonify({'error': 'Ngày không hợp lệ, định dạng: YYYY-MM-DD'}), 400
         
-        # Kiểm tra xem bản ghi điểm danh đã tồn tại chưa
+        # Kiểm tra xem bản ghi điểm danh của ngày này đã tồn tại chưa
         attendance_record = Attendance.query.filter_by(
             user_id=user_id,
-            check_in_time=attendance_date
+            attendance_date=attendance_date.date()
         ).first()
         
+        if attendance_record and attendance_record.status == 'present':
+            # Đã có mặt (điểm danh khuôn mặt hoặc minh chứng đã duyệt) -> không được ghi đè
+            return jsonify({'error': 'Ngày này đã được ghi nhận có mặt, không cần gửi minh chứng'}), 400
+        
         if attendance_record:
-            # Cập nhật bản ghi có sẵn
+            # Cập nhật bản ghi vắng mặt / minh chứng có sẵn
             attendance_record.excuse_reason = excuse_reason
             attendance_record.note = note
             attendance_record.teacher_approval = 'pending'
@@ -0,0 +1,201 @@
+import os
+import time
+import numpy as np
+
+# Approximate search is opt-in; below ANN_MIN_TEMPLATES an exhaustive scan is already cheap
+ANN_ENABLED = os.environ.get('FACE_ANN_ENABLED', '0') == '1'
+ANN_MIN_TEMPLATES = int(os.environ.get('FACE_ANN_MIN_TEMPLATES', '5000'))
+ANN_LISTS = int(os.environ.get('FACE_ANN_LISTS', '0'))  # 0 = sqrt(number of templates)
+ANN_PROBES = int(os.environ.get('FACE_ANN_PROBES', '8'))  # more probes = higher recall, slower
+
+_CHUNK_ROWS = 8192
+
+
+def _squared_distances(queries, centroids):
+    """Squared Euclidean distances between every query and every centroid"""
+    query_norms = np.einsum('ij,ij->i', queries, queries)
+    centroid_norms = np.einsum('ij,ij->i', centroids, centroids)
+    squared = query_norms[:, None] + centroid_norms[None, :] - 2.0 * (queries @ centroids.T)
+    return np.maximum(squared, 0.0)
+
+
+def _nearest_centroid(data, centroids):
+    """Index of the nearest centroid for every row, computed in bounded-size chunks"""
+    assignment = np.empty(len(data), dtype=np.int64)
+    for start in range(0, len(data), _CHUNK_ROWS):
+        chunk = data[start:start + _CHUNK_ROWS]
+        assignment[start:start + len(chunk)] = np.argmin(_squared_distances(chunk, centroids), axis=1)
+    return assignment
+
+
+def kmeans(data, n_clusters, n_iter=20, seed=0):
+    """Plain Lloyd's k-means; empty clusters are reseeded from random points"""
+    rng = np.random.default_rng(seed)
+    data = np.asarray(data, dtype=np.float32)
+    centroids = data[rng.choice(len(data), n_clusters, replace=False)].copy()
+
+    for _ in range(n_iter):
+        assignment = _nearest_centroid(data, centroids)
+
+        order = np.argsort(assignment, kind='stable')
+        counts = np.bincount(assignment, minlength=n_clusters)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        non_empty = counts > 0
+
+        sums = np.add.reduceat(data[order], starts[non_empty], axis=0)
+        new_centroids = centroids.copy()
+        new_centroids[non_empty] = sums / counts[non_empty, None]
+
+        empty = np.flatnonzero(~non_empty)
+        if len(empty):
+            new_centroids[empty] = data[rng.choice(len(data), len(empty), replace=False)]
+
+        if np.allclose(new_centroids, centroids, atol=1e-6):
+            centroids = new_centroids
+            break
+        centroids = new_centroids
+
+    return centroids
+
+
+class IVFIndex:
+    """Inverted-file index over face encodings with k-means coarse centroids
+
+    search() returns a shortlist of gallery rows from the n_probe nearest
+    lists; callers re-rank the shortlist exactly, so only recall is
+    approximate, never the reported score.
+    """
+
+    def __init__(self, centroids, list_rows, list_offsets, generation=0):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.list_rows = np.asarray(list_rows, dtype=np.int64)
+        self.list_offsets = np.asarray(list_offsets, dtype=np.int64)
+        self.generation = generation
+
+    def __len__(self):
+        return len(self.list_rows)
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, encodings, n_lists=None, n_iter=20, seed=0, generation=0):
+        """Cluster the encodings and bucket every row under its nearest centroid"""
+        encodings = np.asarray(encodings, dtype=np.float32)
+        count = len(encodings)
+        if count == 0:
+            raise ValueError("Cannot build an ANN index over an empty gallery")
+
+        n_lists = n_lists or ANN_LISTS or int(np.sqrt(count))
+        n_lists = max(1, min(n_lists, count))
+
+        centroids = kmeans(encodings, n_lists, n_iter=n_iter, seed=seed)
+        assignment = _nearest_centroid(encodings, centroids)
+
+        list_rows = np.argsort(assignment, kind='stable')
+        list_offsets = np.concatenate(([0], np.cumsum(np.bincount(assignment, minlength=n_lists))))
+
+        return cls(centroids, list_rows, list_offsets, generation=generation)
+
+    def with_rows(self, keep, added_encodings):
+        """Index for the gallery that kept rows keep (in order) and appended added_encodings
+
+        Kept rows are renumbered to their position in keep, removed rows leave
+        their lists and new rows join the list of their nearest centroid. The
+        centroids are not retrained; a rebuild does that.
+        """
+        added_encodings = np.asarray(added_encodings, dtype=np.float32).reshape(-1, self.centroids.shape[1])
+        new_rows = np.full(len(self.list_rows), -1, dtype=np.int64)
+        new_rows[keep] = np.arange(len(keep))
+
+        rows = new_rows[self.list_rows]
+        lists = np.repeat(np.arange(self.n_lists), np.diff(self.list_offsets))
+        kept = rows >= 0
+        rows = np.concatenate((rows[kept], len(keep) + np.arange(len(added_encodings))))
+        lists = np.concatenate((lists[kept], _nearest_centroid(added_encodings, self.centroids)))
+
+        order = np.argsort(lists, kind='stable')
+        list_offsets = np.concatenate(([0], np.cumsum(np.bincount(lists, minlength=self.n_lists))))
+        return IVFIndex(self.centroids, rows[order], list_offsets, generation=self.generation)
+
+    def search(self, query, n_probe=None):
+        """Gallery rows stored in the n_probe lists closest to the query"""
+        n_probe = max(1, min(n_probe or ANN_PROBES, self.n_lists))
+        query = np.atleast_2d(np.asarray(query, dtype=np.float32))
+
+        distances = _squared_distances(query, self.centroids)[0]
+        if n_probe < self.n_lists:
+            probes = np.argpartition(distances, n_probe - 1)[:n_probe]
+        else:
+            probes = np.arange(self.n_lists)
+
+        return np.concatenate([
+            self.list_rows[self.list_offsets[probe]:self.list_offsets[probe + 1]] for probe in probes
+        ])
+
+    def save(self, path):
+        """Persist the index next to the gallery snapshot (atomic replace)"""
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, centroids=self.centroids, list_rows=self.list_rows,
+                     list_offsets=self.list_offsets, generation=np.int64(self.generation))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, generation=None, count=None):
+        """Load a saved index; returns None if it is missing or built for another gallery"""
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                index = cls(data['centroids'], data['list_rows'], data['list_offsets'],
+                            generation=int(data['generation']))
+        except (OSError, KeyError, ValueError):
+            return None
+
+        if generation is not None and index.generation != generation:
+            return None
+        if count is not None and len(index) != count:
+            return None
+        return index
+
+
+def recall_report(gallery, queries, list_options=(None,), probe_options=(1, 2, 4, 8, 16, 32)):
+    """Compare ANN top-1 against the exhaustive top-1 for each setting
+
+    gallery is a GallerySnapshot; returns one dict per (n_lists, n_probe) with
+    recall@1, mean shortlist size and mean per-query latency in milliseconds.
+    """
+    queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+
+    started = time.perf_counter()
+    exact = [gallery.best_match(gallery.score(query)[0])[0] for query in queries]
+    exhaustive_ms = (time.perf_counter() - started) * 1000 / len(queries)
+
+    report = []
+    for n_lists in list_options:
+        index = IVFIndex.build(gallery.encodings, n_lists=n_lists)
+        for n_probe in probe_options:
+            if n_probe > index.n_lists:
+                continue
+
+            hits = 0
+            shortlist_total = 0
+            started = time.perf_counter()
+            for query, expected in zip(queries, exact):
+                rows = index.search(query, n_probe)
+                shortlist_total += len(rows)
+                best_row, _ = gallery.best_match(gallery.score(query, rows)[0])
+                found = int(rows[best_row]) if best_row >= 0 else -1
+                hits += found == expected
+            elapsed_ms = (time.perf_counter() - started) * 1000 / len(queries)
+
+            report.append({
+                'n_lists': index.n_lists,
+                'n_probe': n_probe,
+                'recall_at_1': hits / len(queries),
+                'mean_shortlist': shortlist_total / len(queries),
+                'ann_ms': elapsed_ms,
+                'exhaustive_ms': exhaustive_ms
+            })
+
+    return report
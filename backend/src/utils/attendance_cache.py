@@ -0,0 +1,154 @@
+import threading
+from datetime import datetime
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+from src.models.user import db, User, Attendance
+
+CHANGES_SESSION_KEY = 'checked_in_changes'
+
+
+def today_start():
+    """Local midnight; today's check-ins are the Attendance rows with attendance_date == today_start().date()"""
+    return datetime.combine(datetime.now().date(), datetime.min.time())
+
+
+class CheckedInCache:
+    """Students with an Attendance row for today, so duplicate check-ins need no query
+
+    Warmed from the database at startup and on first use after midnight, then
+    kept current from committed Attendance and User changes (check-ins,
+    excuse forms, teacher approvals, admin edits and deletions). Only
+    positive entries are trusted: a student missing here, e.g. one checked in
+    through another worker process, is still looked up in the database.
+    """
+
+    def __init__(self):
+        self._day = None
+        self._present = {}  # user_id -> full name (None until known)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def warm(self):
+        """Load today's checked-in students from the database"""
+        day = today_start().date()
+        rows = db.session.query(Attendance.user_id, User.full_name).join(
+            User, Attendance.user_id == User.id
+        ).filter(Attendance.attendance_date == day).all()
+        with self._lock:
+            self._day = day
+            self._present = {user_id: full_name for user_id, full_name in rows}
+        print(f"Checked-in cache warmed: {len(self._present)} students on {day}")
+
+    def lookup(self, user_ids):
+        """{user_id: full name or None} for those of user_ids known to be checked in today"""
+        self._roll_over()
+        with self._lock:
+            found = {user_id: self._present[user_id] for user_id in user_ids if user_id in self._present}
+            self.hits += len(found)
+            self.misses += len(user_ids) - len(found)
+        return found
+
+    def present_user_ids(self):
+        """User ids known to be checked in today"""
+        self._roll_over()
+        with self._lock:
+            return set(self._present)
+
+    def mark_present(self, user_id, full_name=None):
+        """Record a check-in found in (or just written to) the database"""
+        with self._lock:
+            if self._day == today_start().date() and (full_name is not None or user_id not in self._present):
+                self._present[user_id] = full_name
+
+    def forget(self, user_id):
+        """Drop a check-in that was assumed but never committed"""
+        with self._lock:
+            self._present.pop(user_id, None)
+
+    def apply(self, changes):
+        """Apply committed ('attendance' | 'user', op, user_id, attendance_date or full name) changes"""
+        with self._lock:
+            if self._day is None or self._day != today_start().date():
+                return  # rebuilt from the database on next use
+            for kind, op, user_id, value in changes:
+                if kind == 'user':
+                    if op == 'delete':
+                        self._present.pop(user_id, None)
+                    elif user_id in self._present:
+                        self._present[user_id] = value
+                elif op != 'delete' and value == self._day:
+                    self._present.setdefault(user_id, None)
+                else:
+                    # A row left today (or was deleted); the student may still have another one
+                    self._present.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'day': self._day.isoformat() if self._day else None,
+                'present': len(self._present),
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+    def _roll_over(self):
+        if self._day != today_start().date():
+            self.warm()
+
+
+# Changes are collected per session during flush and applied once the transaction commits
+def _session_changes(target):
+    session = object_session(target)
+    return session.info.setdefault(CHANGES_SESSION_KEY, []) if session is not None else None
+
+
+@event.listens_for(Attendance, 'after_insert')
+def _attendance_inserted(mapper, connection, target):
+    changes = _session_changes(target)
+    if changes is not None:
+        changes.append(('attendance', 'insert', target.user_id, target.attendance_date))
+
+
+@event.listens_for(Attendance, 'after_update')
+def _attendance_updated(mapper, connection, target):
+    # Approvals and excuse edits keep the row's day; only a moved row changes the set
+    changes = _session_changes(target)
+    if changes is not None and inspect(target).attrs.attendance_date.history.has_changes():
+        changes.append(('attendance', 'update', target.user_id, target.attendance_date))
+
+
+@event.listens_for(Attendance, 'after_delete')
+def _attendance_deleted(mapper, connection, target):
+    changes = _session_changes(target)
+    if changes is not None:
+        changes.append(('attendance', 'delete', target.user_id, None))
+
+
+@event.listens_for(User, 'after_update')
+def _user_updated(mapper, connection, target):
+    changes = _session_changes(target)
+    if changes is not None:
+        changes.append(('user', 'update', target.id, target.full_name))
+
+
+@event.listens_for(User, 'after_delete')
+def _user_deleted(mapper, connection, target):
+    changes = _session_changes(target)
+    if changes is not None:
+        changes.append(('user', 'delete', target.id, None))
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_committed_changes(session):
+    changes = session.info.pop(CHANGES_SESSION_KEY, None)
+    if changes:
+        checked_in_cache.apply(changes)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changes(session):
+    session.info.pop(CHANGES_SESSION_KEY, None)
+
+# Global instance
+checked_in_cache = CheckedInCache()
@@ -0,0 +1,288 @@
+import atexit
+import os
+import queue
+import signal
+import threading
+import time
+from datetime import datetime
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from src.models.user import db, User
+from src.utils.attendance_cache import checked_in_cache
+from src.utils.metrics import Histogram
+
+# Check-ins are queued and committed in grouped transactions: one commit (one SQLite fsync and
+# write-lock hold) per WRITE_BATCH_SIZE records or WRITE_FLUSH_MS, whichever comes first
+WRITE_BEHIND_ENABLED = os.environ.get('FACE_ATTENDANCE_WRITE_BEHIND', '1') == '1'
+WRITE_BATCH_SIZE = int(os.environ.get('FACE_ATTENDANCE_BATCH_SIZE', '64'))
+WRITE_FLUSH_MS = float(os.environ.get('FACE_ATTENDANCE_FLUSH_MS', '50'))
+# 'flush': a check-in is acknowledged once committed; 'enqueue': as soon as it is queued
+WRITE_DURABILITY = os.environ.get('FACE_ATTENDANCE_DURABILITY', 'flush')
+WRITE_ACK_TIMEOUT = float(os.environ.get('FACE_ATTENDANCE_ACK_TIMEOUT', '30'))  # seconds, 'flush' mode
+WRITE_SHUTDOWN_TIMEOUT = 10.0  # seconds to drain the queue on exit
+
+FLUSH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+FLUSH_MS_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250, 1000)
+
+
+class _PendingCheckIn:
+    """One queued Attendance row; attendance holds its to_dict() once committed"""
+
+    def __init__(self, attendance, user_name):
+        self.record = attendance
+        self.user_name = user_name
+        self.enqueued_at = time.perf_counter()
+        self.done = threading.Event()
+        self.attendance = None
+        self.error = None
+        self.duplicate = False  # the unique (user_id, attendance_date) row already existed
+
+
+class AttendanceWriter:
+    """Write-behind queue for check-in Attendance rows
+
+    A writer thread takes the first queued check-in, keeps collecting for up to
+    flush_ms (or until batch_size are queued) and commits the group in one
+    transaction. With durability='flush' submit() waits for that commit; with
+    'enqueue' it returns at once and the student is held in the checked-in
+    cache so a retry is still answered as a duplicate. A group that fails to
+    commit is retried row by row so one bad row does not drop the others.
+    The queue is drained on interpreter exit and on SIGTERM.
+    """
+
+    def __init__(self, batch_size=WRITE_BATCH_SIZE, flush_ms=WRITE_FLUSH_MS,
+                 durability=WRITE_DURABILITY, enabled=WRITE_BEHIND_ENABLED):
+        if durability not in ('flush', 'enqueue'):
+            raise ValueError(f"Unknown attendance durability '{durability}' (expected 'flush' or 'enqueue')")
+        self.batch_size = max(1, batch_size)
+        self.window = flush_ms / 1000.0
+        self.durability = durability
+        self.enabled = enabled
+        self.flush_sizes = Histogram(FLUSH_SIZE_BUCKETS)
+        self.flush_ms = Histogram(FLUSH_MS_BUCKETS)
+        self.written = 0
+        self.duplicates = 0
+        self.failed = 0
+        self._app = None
+        self._queue = queue.Queue()
+        self._writer = None
+        self._closed = False
+        self._lock = threading.Lock()
+        self._previous_sigterm = None
+
+    def init_app(self, app):
+        """Remember the app the writer thread commits in; drain the queue on exit and SIGTERM"""
+        self._app = app
+        atexit.register(self.shutdown)
+        # Signal handlers can only be installed from the main thread
+        if threading.current_thread() is threading.main_thread():
+            self._previous_sigterm = signal.signal(signal.SIGTERM, self._handle_sigterm)
+
+    def submit(self, records):
+        """Write [(Attendance, User)] check-ins; returns their to_dict(), provisional in 'enqueue' mode
+
+        The Attendance objects must be new and not added to any session. A row
+        that loses a race with another check-in of the same student and day
+        comes back as None. Raises other commit errors (or TimeoutError) in
+        'flush' mode.
+        """
+        if not records:
+            return []
+        if not self.enabled:
+            return self._write_now(records)
+
+        pending = []
+        for attendance, user in records:
+            # Timestamps are the recognition time, not the flush time
+            now = datetime.utcnow()
+            attendance.check_in_time = attendance.check_in_time or now
+            attendance.created_at = attendance.created_at or now
+            item = _PendingCheckIn(attendance, user.full_name)
+            item.attendance = _provisional_dict(attendance, user)
+            pending.append(item)
+
+        with self._lock:
+            # Items put before shutdown's sentinel are still drained by the writer thread
+            if self._closed:
+                return self._write_now(records)
+            self._ensure_writer()
+            for item in pending:
+                checked_in_cache.mark_present(item.record.user_id, item.user_name)
+                self._queue.put(item)
+
+        if self.durability == 'enqueue':
+            return [item.attendance for item in pending]
+
+        deadline = time.perf_counter() + WRITE_ACK_TIMEOUT + self.window
+        for item in pending:
+            if not item.done.wait(max(0.0, deadline - time.perf_counter())):
+                raise TimeoutError("Hết thời gian ghi điểm danh, vui lòng thử lại")
+            if item.error is not None:
+                raise item.error
+        return [None if item.duplicate else item.attendance for item in pending]
+
+    def flush(self, timeout=WRITE_SHUTDOWN_TIMEOUT):
+        """Block until everything queued so far is committed (or timeout seconds pass)"""
+        marker = _PendingCheckIn(None, None)
+        if self._writer is None or not self._writer.is_alive():
+            return True
+        self._queue.put(marker)
+        return marker.done.wait(timeout)
+
+    def shutdown(self):
+        """Stop accepting queued writes, commit what is queued and stop the writer thread"""
+        with self._lock:
+            self._closed = True
+            writer = self._writer
+        if writer is not None and writer.is_alive():
+            self._queue.put(None)
+            writer.join(WRITE_SHUTDOWN_TIMEOUT)
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'durability': self.durability,
+            'batch_size': self.batch_size,
+            'flush_ms': self.window * 1000,
+            'queued': self._queue.qsize(),
+            'written': self.written,
+            'duplicates': self.duplicates,
+            'failed': self.failed,
+            'flush_size': self.flush_sizes.to_dict(),
+            'flush_duration_ms': self.flush_ms.to_dict()
+        }
+
+    def _handle_sigterm(self, signum, frame):
+        self.shutdown()
+        previous = self._previous_sigterm
+        if callable(previous):
+            previous(signum, frame)
+        elif previous != signal.SIG_IGN:
+            raise SystemExit(128 + signum)
+
+    def _ensure_writer(self):
+        # Called with self._lock held; a forked worker process starts its own writer thread
+        if self._app is None:
+            self._app = current_app._get_current_object()
+        if self._writer is None or not self._writer.is_alive():
+            self._writer = threading.Thread(target=self._run, name='attendance-writer', daemon=True)
+            self._writer.start()
+
+    def _run(self):
+        stopping = False
+        while True:
+            try:
+                item = self._queue.get_nowait() if stopping else self._queue.get()
+            except queue.Empty:
+                return
+            deadline = (item.enqueued_at if item is not None else time.perf_counter()) + self.window
+            batch, markers = [], []
+            while True:
+                if item is None:
+                    stopping = True  # drain what is already queued, then stop
+                elif item.record is None:
+                    markers.append(item)  # flush(): commit now
+                else:
+                    batch.append(item)
+                if len(batch) >= self.batch_size or markers:
+                    break
+                try:
+                    if stopping:
+                        item = self._queue.get_nowait()
+                    else:
+                        item = self._queue.get(timeout=max(0.0, deadline - time.perf_counter()))
+                except queue.Empty:
+                    break
+
+            if batch:
+                with self._app.app_context():
+                    self._commit_batch(batch)
+            for marker in markers:
+                marker.done.set()
+
+    def _commit_batch(self, batch):
+        started = time.perf_counter()
+        try:
+            _commit([item.record for item in batch], batch)
+        except Exception as e:
+            db.session.rollback()
+            print(f"Attendance group commit of {len(batch)} failed ({e}); retrying row by row")
+            for item in batch:
+                try:
+                    item.record.id = None  # rolled back with the group insert
+                    _commit([item.record], [item])
+                except IntegrityError:
+                    db.session.rollback()
+                    self._duplicate(item)
+                except Exception as row_error:
+                    db.session.rollback()
+                    self._fail(item, row_error)
+        self.flush_sizes.observe(len(batch))
+        self.flush_ms.observe((time.perf_counter() - started) * 1000)
+        for item in batch:
+            if item.error is None and not item.duplicate:
+                self.written += 1
+            item.done.set()
+
+    def _duplicate(self, item):
+        # Another check-in of the same student and day committed first: the student
+        # is checked in, so the cache entry stays
+        print(f"Attendance for user {item.record.user_id} already exists for {item.record.attendance_date}")
+        self.duplicates += 1
+        item.duplicate = True
+
+    def _fail(self, item, error):
+        print(f"Attendance for user {item.record.user_id} was not saved: {error}")
+        self.failed += 1
+        item.error = error
+        # The student was never checked in, so a retry must not be answered as a duplicate
+        checked_in_cache.forget(item.record.user_id)
+
+    def _write_now(self, records):
+        """Synchronous path: commit in the caller's session, same outcomes as submit()"""
+        items = [_PendingCheckIn(attendance, user.full_name) for attendance, user in records]
+        self._commit_batch(items)
+        for item in items:
+            if item.error is not None:
+                raise item.error
+        for item in items:
+            checked_in_cache.mark_present(item.record.user_id, item.user_name)
+        return [None if item.duplicate else item.attendance for item in items]
+
+
+def _provisional_dict(attendance, user):
+    """to_dict() of a not yet committed row (no id)"""
+    return {
+        'id': None,
+        'user_id': attendance.user_id,
+        'user_name': user.full_name,
+        'student_id': user.student_id,
+        'check_in_time': attendance.check_in_time.isoformat() if attendance.check_in_time else None,
+        'status': attendance.status,
+        'confidence_score': attendance.confidence_score,
+        'note': attendance.note,
+        'excuse_reason': attendance.excuse_reason,
+        'teacher_approval': attendance.teacher_approval,
+        'teacher_comment': attendance.teacher_comment,
+        'approved_by': attendance.approved_by,
+        'approved_at': attendance.approved_at.isoformat() if attendance.approved_at else None,
+        'created_at': attendance.created_at.isoformat() if attendance.created_at else None,
+        'queued': True
+    }
+
+
+def _commit(attendances, items):
+    """Insert attendances in one transaction and store each row's to_dict() on its item"""
+    # Load the users first (and keep them referenced) so to_dict() finds them in the
+    # identity map instead of issuing one query per row
+    users = User.query.filter(User.id.in_({attendance.user_id for attendance in attendances})).all()
+    db.session.add_all(attendances)
+    db.session.flush()
+    dicts = [attendance.to_dict() for attendance in attendances]
+    db.session.commit()
+    for item, attendance_dict in zip(items, dicts):
+        item.attendance = attendance_dict
+        item.error = None
+
+# Global instance
+attendance_writer = AttendanceWriter()
@@ -0,0 +1,143 @@
+import copy
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+import cv2
+import numpy as np
+
+# Detection results are reused for byte-identical images (client retries) and, optionally,
+# for frames whose perceptual hash is within PHASH_MAX_DISTANCE bits (a static camera scene)
+DETECTION_CACHE_ENABLED = os.environ.get('FACE_DETECTION_CACHE', '1') == '1'
+DETECTION_CACHE_SIZE = int(os.environ.get('FACE_DETECTION_CACHE_SIZE', '256'))
+DETECTION_CACHE_TTL = float(os.environ.get('FACE_DETECTION_CACHE_TTL', '30'))  # seconds, exact matches
+PERCEPTUAL_CACHE_ENABLED = os.environ.get('FACE_PERCEPTUAL_CACHE', '1') == '1'
+PERCEPTUAL_CACHE_TTL = float(os.environ.get('FACE_PERCEPTUAL_CACHE_TTL', '1'))  # seconds, near-duplicates
+PHASH_MAX_DISTANCE = int(os.environ.get('FACE_PHASH_MAX_DISTANCE', '3'))
+PHASH_SIZE = 8  # difference hash of a 9x8 gray thumbnail = 64 bits
+
+
+def content_hash(image_bytes):
+    return hashlib.blake2b(image_bytes, digest_size=16).digest()
+
+
+def perceptual_hash(frame):
+    """64-bit difference hash of a tiny gray thumbnail (decoded at reduced JPEG scale)"""
+    def compute():
+        image, _ = frame.reduced_bgr(PHASH_SIZE * 8)
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        thumbnail = cv2.resize(gray, (PHASH_SIZE + 1, PHASH_SIZE), interpolation=cv2.INTER_AREA)
+        bits = (thumbnail[:, 1:] > thumbnail[:, :-1]).ravel()
+        return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+    return frame.cached('perceptual_hash', compute)
+
+
+class _Entry:
+    def __init__(self, result, size, phash, scope):
+        self.result = result
+        self.size = size
+        self.phash = phash
+        self.scope = scope
+        self.stored_at = time.monotonic()
+
+
+class DetectionCache:
+    """Bounded LRU/TTL cache of detection results, per detector
+
+    Entries are keyed by (detector, content hash) and shared by all clients.
+    With perceptual matching, a miss on the exact key falls back to the most
+    recently used entry of the same scope (one client's camera), detector and
+    image size whose hash differs by at most max_distance bits, as long as it
+    is younger than perceptual_ttl. Unscoped lookups only reuse exact matches.
+    """
+
+    def __init__(self, max_entries=DETECTION_CACHE_SIZE, ttl=DETECTION_CACHE_TTL,
+                 perceptual=PERCEPTUAL_CACHE_ENABLED, perceptual_ttl=PERCEPTUAL_CACHE_TTL,
+                 max_distance=PHASH_MAX_DISTANCE, enabled=DETECTION_CACHE_ENABLED):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.perceptual = perceptual
+        self.perceptual_ttl = perceptual_ttl
+        self.max_distance = max_distance
+        self.enabled = enabled
+        self.hits = 0
+        self.perceptual_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def detect(self, detector, frame, compute, scope=None, perceptual=True):
+        """Cached result of compute() (a detector call on frame); callers get their own copy
+
+        scope names the client the frame came from; pass perceptual=False when the
+        caller needs this frame's own boxes (e.g. a tracker re-seeding its templates).
+        """
+        if not self.enabled:
+            return compute()
+
+        near_match = self.perceptual and perceptual and scope is not None
+        try:
+            key = (detector, content_hash(frame.image_bytes))
+            phash = perceptual_hash(frame) if near_match else None
+            size = frame.size
+        except Exception:
+            # Undecodable images are not cached; the detector reports the error
+            return compute()
+
+        with self._lock:
+            entry = self._lookup(key, detector, size, phash, scope)
+            if entry is not None:
+                return copy.deepcopy(entry.result)
+            self.misses += 1
+
+        result = compute()
+        with self._lock:
+            self._entries[key] = _Entry(copy.deepcopy(result), size, phash, scope)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return result
+
+    def _lookup(self, key, detector, size, phash, scope):
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None:
+            if now - entry.stored_at <= self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            del self._entries[key]
+
+        if phash is None:
+            return None
+        # Most recently used first; only entries younger than perceptual_ttl can stand in for a new frame
+        for (entry_detector, _), entry in reversed(self._entries.items()):
+            if now - entry.stored_at > self.perceptual_ttl:
+                continue
+            if (entry_detector == detector and entry.scope == scope and entry.size == size and entry.phash is not None
+                    and bin(entry.phash ^ phash).count('1') <= self.max_distance):
+                self.perceptual_hits += 1
+                return entry
+        return None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.perceptual_hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'perceptual': self.perceptual,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'perceptual_hits': self.perceptual_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.perceptual_hits) / lookups if lookups else 0.0
+            }
+
+# Global instance
+detection_cache = DetectionCache()
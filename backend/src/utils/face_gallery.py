@@ -0,0 +1,629 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+import numpy as np
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session, object_session
+from src.models.user import db, FaceData
+from src.utils.face_template import load_encoding
+from src.utils.fallback_features import similarity_matrix
+from src.utils.ann_index import ANN_ENABLED, ANN_MIN_TEMPLATES, IVFIndex
+from src.utils.face_prototypes import PROTOTYPES_ENABLED, PROTOTYPE_MIN_TEMPLATES, PROTOTYPE_MAX_RATIO, PrototypeIndex
+from src.utils.gallery_snapshot import (
+    DELTA_ADD, DELTA_REMOVE, append_deltas, delta_log_size, map_snapshot, read_deltas, read_snapshot_generation,
+    reset_delta_log, snapshot_file_identity, snapshot_file_lock, write_snapshot
+)
+
+# Shared snapshot file mapped by every worker process; set to an empty string to keep the gallery per-process
+SNAPSHOT_PATH = os.environ.get(
+    'FACE_GALLERY_SNAPSHOT_PATH',
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database', 'face_gallery.snapshot')
+)
+
+# FaceData inserts/updates/deletes reach the gallery as deltas when their transaction commits.
+# With a shared snapshot, deltas go to its log and are folded into a new generation after
+# COMPACT_RECORDS records or at the next periodic check; the check also compares the
+# gallery with the face_data table and rebuilds it on drift.
+COMPACT_RECORDS = int(os.environ.get('FACE_GALLERY_COMPACT_RECORDS', '256'))
+CHECK_INTERVAL = float(os.environ.get('FACE_GALLERY_CHECK_INTERVAL', '300'))  # seconds, 0 disables
+DELTAS_SESSION_KEY = 'face_gallery_deltas'
+
+SCOPED_CACHE_SIZE = 64
+FACE_ENCODING_DIMENSION = 128  # dlib encodings; other widths are fallback LBP + HOG features
+
+
+class GallerySnapshot:
+    """Immutable matrix view of face encodings used for one recognition pass"""
+
+    def __init__(self, encodings, user_ids, face_ids, encoding_std=None, squared_norms=None, generation=0):
+        encodings = np.ascontiguousarray(encodings, dtype=np.float32)
+        self.encodings = encodings if encodings.ndim == 2 else encodings.reshape(len(face_ids), -1)
+        self.user_ids = np.asarray(user_ids, dtype=np.int64)
+        self.face_ids = np.asarray(face_ids, dtype=np.int64)
+        self.generation = generation
+
+        # Per-template statistics precomputed once so scoring is a single matrix pass
+        if encoding_std is None:
+            encoding_std = self.encodings.std(axis=1)
+        if squared_norms is None:
+            squared_norms = np.einsum('ij,ij->i', self.encodings, self.encodings)
+        self.encoding_std = encoding_std
+        self.squared_norms = squared_norms
+
+        # Optional IVF index used by match() for large galleries
+        self.ann_index = None
+        # Per-user prototypes, built on first use (False = not worth it for this snapshot)
+        self._prototype_index = None
+
+    def __len__(self):
+        return len(self.face_ids)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build a snapshot from (face_id, user_id, face_encoding) rows"""
+        encodings, user_ids, face_ids = [], [], []
+        dimension = None
+
+        for face_id, user_id, blob in rows:
+            try:
+                encoding = load_encoding(blob)
+            except Exception as e:
+                print(f"Error loading encoding for face {face_id}: {e}")
+                continue
+
+            if dimension is None:
+                dimension = len(encoding)
+            if len(encoding) != dimension:
+                print(f"Skipping face {face_id}: encoding has {len(encoding)} dims, expected {dimension}")
+                continue
+
+            encodings.append(encoding)
+            user_ids.append(user_id)
+            face_ids.append(face_id)
+
+        if not encodings:
+            return cls(np.empty((0, dimension or 128), dtype=np.float32), [], [])
+
+        return cls(np.vstack(encodings), user_ids, face_ids)
+
+    def with_deltas(self, records):
+        """New snapshot with (op, face_id, user_id, template) FaceData changes applied in order
+
+        The last record for a face id wins; an add replaces any row with that id.
+        """
+        latest = {}
+        for op, face_id, user_id, blob in records:
+            latest[int(face_id)] = (op, user_id, blob)
+
+        touched = np.fromiter(latest, dtype=np.int64, count=len(latest))
+        keep = np.flatnonzero(~np.isin(self.face_ids, touched))
+        added = GallerySnapshot.from_rows(
+            (face_id, user_id, blob) for face_id, (op, user_id, blob) in latest.items() if op == DELTA_ADD
+        )
+
+        dimension = self.encodings.shape[1]
+        if len(added) and len(keep) and added.encodings.shape[1] != dimension:
+            print(f"WARNING: dropping {len(added)} new faces from the gallery, they can never match: "
+                  f"encodings have {added.encodings.shape[1]} dims, the gallery has {dimension}")
+            added = GallerySnapshot.from_rows([])
+        if len(keep) == 0 and len(added):
+            added.generation = self.generation
+            return added
+        if len(added) == 0:
+            added = GallerySnapshot(np.empty((0, dimension), dtype=np.float32), [], [])
+
+        snapshot = GallerySnapshot(
+            np.vstack((self.encodings[keep], added.encodings)),
+            np.concatenate((self.user_ids[keep], added.user_ids)),
+            np.concatenate((self.face_ids[keep], added.face_ids)),
+            encoding_std=np.concatenate((self.encoding_std[keep], added.encoding_std)),
+            squared_norms=np.concatenate((self.squared_norms[keep], added.squared_norms)),
+            generation=self.generation
+        )
+        # The IVF lists follow the changed rows, so deltas never fall back to an exhaustive scan
+        if self.ann_index is not None:
+            snapshot.ann_index = self.ann_index.with_rows(keep, added.encodings)
+        return snapshot
+
+    def checksum(self):
+        """(templates, sum of face ids, sum of user ids), compared with the face_data table"""
+        return len(self), int(self.face_ids.sum()), int(self.user_ids.sum())
+
+    @classmethod
+    def from_encodings(cls, known_encodings):
+        """Build a snapshot from a plain list; face_ids hold the original list positions"""
+        return cls.from_rows((i, -1, encoding) for i, encoding in enumerate(known_encodings))
+
+    def score(self, test_encodings, rows=None):
+        """Weighted similarity of every test encoding against every template (queries x N)
+
+        With rows given, only those gallery rows are scored (queries x len(rows)).
+        """
+        queries = np.atleast_2d(np.asarray(test_encodings, dtype=np.float32))
+        encodings, encoding_std, squared_norms = self.encodings, self.encoding_std, self.squared_norms
+        if rows is not None:
+            encodings, encoding_std, squared_norms = encodings[rows], encoding_std[rows], squared_norms[rows]
+        if len(encodings) == 0:
+            return np.zeros((queries.shape[0], 0))
+        # A probe from the other engine (dlib vs fallback features) cannot match any template
+        if queries.shape[1] != encodings.shape[1]:
+            return np.zeros((queries.shape[0], len(encodings)))
+
+        # Galleries of LBP + HOG features (no dlib) use the fallback metric, still one matrix pass
+        if encodings.shape[1] != FACE_ENCODING_DIMENSION:
+            return similarity_matrix(queries, encodings, np.sqrt(squared_norms))
+
+        # Euclidean distance via ||q||^2 + ||k||^2 - 2 q.k, same metric as face_recognition.face_distance
+        query_norms = np.einsum('ij,ij->i', queries, queries)
+        squared = query_norms[:, None] + squared_norms[None, :] - 2.0 * (queries @ encodings.T)
+        distances = np.sqrt(np.maximum(squared, 0.0))
+        similarity = 1.0 - distances
+
+        # Same weighting as AdvancedFaceRecognition._apply_confidence_weighting
+        strength = queries.std(axis=1)[:, None] + encoding_std[None, :]
+        weights = np.clip(strength / 0.1, 0.8, 1.2)
+
+        return similarity * weights
+
+    def subset(self, user_ids):
+        """Snapshot restricted to the templates of the given users"""
+        rows = np.flatnonzero(np.isin(self.user_ids, np.fromiter(user_ids, dtype=np.int64)))
+        return GallerySnapshot(self.encodings[rows], self.user_ids[rows], self.face_ids[rows],
+                               encoding_std=self.encoding_std[rows], squared_norms=self.squared_norms[rows],
+                               generation=self.generation)
+
+    def prototype_index(self):
+        """PrototypeIndex for this snapshot, or None when the gallery is small or has ~1 template per user"""
+        if self._prototype_index is None:
+            self._prototype_index = False
+            if PROTOTYPES_ENABLED and len(self) >= PROTOTYPE_MIN_TEMPLATES:
+                index = PrototypeIndex.build(self)
+                if len(index) <= PROTOTYPE_MAX_RATIO * len(self):
+                    self._prototype_index = index
+        return self._prototype_index or None
+
+    def match_many(self, test_encodings):
+        """Best (row_index, score) for each of several encodings, one matrix pass when exhaustive"""
+        if len(test_encodings) == 0:
+            return []
+        if not self._comparable(test_encodings):
+            return [(-1, 0.0)] * len(test_encodings)
+        if self.ann_index is not None:
+            return [self.match(test_encoding) for test_encoding in test_encodings]
+        prototypes = self.prototype_index()
+        if prototypes is not None:
+            # Score the union of all shortlists once, then pick each probe's best among its own rows
+            shortlists = prototypes.shortlist(test_encodings)
+            rows = np.unique(np.concatenate(shortlists))
+            scores = self.score(test_encodings, rows)
+            results = []
+            for test_encoding, query_scores, candidates in zip(test_encodings, scores, shortlists):
+                best_row, best_score = self.best_match(query_scores[np.searchsorted(rows, candidates)])
+                if best_row >= 0:
+                    results.append((int(candidates[best_row]), best_score))
+                else:
+                    results.append(self.best_match(self.score(test_encoding)[0]))
+            return results
+        return [self.best_match(scores) for scores in self.score(test_encodings)]
+
+    def assign_unique(self, test_encodings, threshold):
+        """One-to-one face -> user assignment for several faces from the same photo
+
+        Scores are reduced to the best template per user, then pairs are taken
+        greedily from the highest score down so no user gets two faces. Returns
+        (user_id or None, score) per face, where score is the assigned score or,
+        for unassigned faces, their best score.
+        """
+        if len(test_encodings) == 0:
+            return []
+        if len(self) == 0 or not self._comparable(test_encodings):
+            return [(None, 0.0)] * len(test_encodings)
+
+        # With prototypes, only the shortlisted users of any face are scored exactly
+        rows = None
+        prototypes = self.prototype_index()
+        if prototypes is not None:
+            rows = np.unique(np.concatenate(prototypes.shortlist(test_encodings)))
+
+        scores = self.score(test_encodings, rows)
+        users, inverse = np.unique(self.user_ids if rows is None else self.user_ids[rows], return_inverse=True)
+        user_scores = np.full((scores.shape[0], len(users)), -np.inf, dtype=scores.dtype)
+        np.maximum.at(user_scores.T, inverse, scores.T)
+
+        results = [(None, max(0.0, float(best))) for best in user_scores.max(axis=1)]
+        faces, candidates = np.nonzero(user_scores >= threshold)
+        order = np.argsort(-user_scores[faces, candidates], kind='stable')
+
+        taken_faces, taken_users = set(), set()
+        for face, candidate in zip(faces[order], candidates[order]):
+            if face in taken_faces or candidate in taken_users:
+                continue
+            taken_faces.add(face)
+            taken_users.add(candidate)
+            results[face] = (int(users[candidate]), float(user_scores[face, candidate]))
+
+        return results
+
+    def match(self, test_encoding):
+        """Best (row_index, score) for one encoding, via the ANN or prototype shortlist when available"""
+        if not self._comparable(test_encoding):
+            return -1, 0.0
+        if self.ann_index is not None:
+            return self._match_rows(test_encoding, self.ann_index.search(test_encoding))
+        prototypes = self.prototype_index()
+        if prototypes is not None:
+            return self._match_rows(test_encoding, prototypes.shortlist([test_encoding])[0])
+        return self.best_match(self.score(test_encoding)[0])
+
+    def _comparable(self, test_encodings):
+        """False for probes of the other engine (dlib vs fallback widths), which match nothing"""
+        return np.atleast_2d(np.asarray(test_encodings)).shape[1] == self.encodings.shape[1]
+
+    def _match_rows(self, test_encoding, rows):
+        """Exact best match among shortlisted rows; falls back to every row if none of them scores"""
+        if len(rows):
+            best_row, best_score = self.best_match(self.score(test_encoding, rows)[0])
+            if best_row >= 0:
+                return int(rows[best_row]), best_score
+        return self.best_match(self.score(test_encoding)[0])
+
+    @staticmethod
+    def best_match(scores):
+        """Return (row_index, score) of the best positive score, or (-1, 0.0)"""
+        if len(scores) == 0:
+            return -1, 0.0
+        index = int(np.argmax(scores))
+        best_score = float(scores[index])
+        if best_score <= 0.0:
+            return -1, 0.0
+        return index, best_score
+
+
+class FaceGallery:
+    """Process-resident index of all enrolled face encodings, built once and kept up to date
+
+    When a snapshot path is configured the gallery is published to a
+    memory-mapped file shared by all worker processes. Each worker maps it
+    read-only and remaps whenever another worker publishes a new generation.
+    Committed FaceData changes are applied as deltas (see apply_deltas), so
+    enrolling a face never reloads the whole table.
+    """
+
+    def __init__(self, snapshot_path=SNAPSHOT_PATH):
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._file_identity = None
+        self.snapshot_path = snapshot_path or None
+
+        # Delta log position and records applied on top of the mapped generation
+        self._delta_offset = 0
+        self._delta_records = 0
+        self._stale = False
+
+        # Periodic compaction + consistency check against the database
+        self._last_check = time.monotonic()
+        self._accepted_drift = None
+        self.last_check = None
+
+        # Per-scope slices of the current snapshot (class, roster, explicit ids), LRU-bounded
+        self._scoped = OrderedDict()
+        self._scoped_source = None
+        self._scoped_lock = threading.Lock()
+
+    def snapshot(self):
+        """Return the current snapshot, loading it on first use or after another worker changed it"""
+        snapshot = self._snapshot
+        if self.snapshot_path is None:
+            if snapshot is None or self._stale:
+                with self._lock:
+                    if self._snapshot is None or self._stale:
+                        self._stale = False
+                        self._snapshot = self._load_from_database()
+                        self._attach_ann_index(self._snapshot)
+                        self._delta_records = 0
+                    snapshot = self._snapshot
+            self._maybe_check()
+            return snapshot
+
+        # A stat of the snapshot and of its delta log per request is enough to notice other workers
+        if (snapshot is not None and not self._stale
+                and snapshot_file_identity(self.snapshot_path) == self._file_identity
+                and delta_log_size(self.snapshot_path) == self._delta_offset):
+            self._maybe_check()
+            return snapshot
+
+        with self._lock:
+            identity = snapshot_file_identity(self.snapshot_path)
+            if self._stale or identity is None:
+                self._stale = False
+                self._publish()
+            elif self._snapshot is None or identity != self._file_identity:
+                try:
+                    self._map_file()
+                except (OSError, ValueError) as e:
+                    print(f"Cannot map face gallery snapshot, rebuilding: {e}")
+                    self._publish()
+            self._replay_deltas()
+            snapshot = self._snapshot
+        self._maybe_check()
+        return snapshot
+
+    def scoped(self, user_ids):
+        """Slice of the current snapshot containing only the given users' templates"""
+        snapshot = self.snapshot()
+        key = frozenset(int(user_id) for user_id in user_ids)
+
+        with self._scoped_lock:
+            # Slices belong to one snapshot; drop them all once a new one is loaded
+            if self._scoped_source is not snapshot:
+                self._scoped.clear()
+                self._scoped_source = snapshot
+            subset = self._scoped.get(key)
+            if subset is not None:
+                self._scoped.move_to_end(key)
+                return subset
+
+        subset = snapshot.subset(key)
+        with self._scoped_lock:
+            if self._scoped_source is snapshot:
+                self._scoped[key] = subset
+                while len(self._scoped) > SCOPED_CACHE_SIZE:
+                    self._scoped.popitem(last=False)
+        return subset
+
+    def invalidate(self):
+        """Full rebuild from the database; other workers pick up the new generation"""
+        with self._lock:
+            if self.snapshot_path is None:
+                self._snapshot = None
+            else:
+                self._publish()
+
+    def check_template(self, encoding):
+        """Raise ValueError when a new template cannot be compared with the enrolled ones
+
+        dlib encodings and fallback LBP + HOG features have different widths; a
+        face enrolled with the other engine would be dropped from the gallery.
+        """
+        snapshot = self.snapshot()
+        dimension = snapshot.encodings.shape[1]
+        if len(snapshot) and len(encoding) != dimension:
+            raise ValueError(
+                f"Ảnh khuôn mặt được mã hóa khác với dữ liệu hiện có ({len(encoding)} chiều, cần {dimension} chiều)"
+            )
+
+    def apply_deltas(self, records):
+        """Apply committed FaceData changes without reloading the table
+
+        records are (op, face_id, user_id, template) tuples in commit order. With
+        a shared snapshot they are appended to its delta log, which every worker
+        replays on its next snapshot() call. No SQL is issued (this runs after commit).
+        """
+        with self._lock:
+            try:
+                if self.snapshot_path is None:
+                    if self._snapshot is not None:
+                        self._snapshot = self._snapshot.with_deltas(records)
+                        self._delta_records += len(records)
+                        if self._delta_records >= COMPACT_RECORDS:
+                            self._reindex()
+                    return
+
+                with snapshot_file_lock(self.snapshot_path):
+                    identity = snapshot_file_identity(self.snapshot_path)
+                    if identity is None:
+                        # Nothing published yet; the first snapshot() loads these rows from the database
+                        return
+                    if self._snapshot is None or identity != self._file_identity:
+                        self._map_file()
+                    self._replay_deltas()
+                    append_deltas(self.snapshot_path, self._snapshot.generation, records)
+                    self._replay_deltas()
+                    if self._delta_records >= COMPACT_RECORDS:
+                        self._compact()
+            except Exception as e:
+                # Never fail the commit that triggered this; the next snapshot() rebuilds instead
+                print(f"Cannot apply face gallery deltas, rebuilding on next use: {e}")
+                self._stale = True
+
+    def compact(self):
+        """Fold pending delta records into a new snapshot generation (no database reload)
+
+        A per-process gallery has no file to publish; its ANN index is re-clustered instead.
+        """
+        if self.snapshot_path is None:
+            with self._lock:
+                if self._snapshot is not None and self._delta_records:
+                    self._reindex()
+            return
+        with self._lock:
+            try:
+                with snapshot_file_lock(self.snapshot_path):
+                    identity = snapshot_file_identity(self.snapshot_path)
+                    if identity is None:
+                        return
+                    if self._snapshot is None or identity != self._file_identity:
+                        self._map_file()
+                    self._replay_deltas()
+                    if self._delta_records:
+                        self._compact()
+            except (OSError, ValueError) as e:
+                print(f"Cannot compact face gallery snapshot: {e}")
+
+    def check(self):
+        """Compare the gallery with the face_data table; rebuilds it from the database on drift
+
+        Templates that cannot be loaded never reach the gallery, so a
+        difference that survives a fresh rebuild is accepted as their share.
+        """
+        expected = self._database_checksum()
+        actual = self.snapshot().checksum()
+        drift = tuple(e - a for e, a in zip(expected, actual))
+
+        if any(drift) and drift != self._accepted_drift:
+            print(f"Face gallery drift detected (database {expected}, gallery {actual}), rebuilding")
+            self.invalidate()
+            actual = self.snapshot().checksum()
+            drift = tuple(e - a for e, a in zip(expected, actual))
+            self._accepted_drift = drift if any(drift) else None
+
+        self.last_check = {
+            'consistent': not any(drift) or drift == self._accepted_drift,
+            'database': expected,
+            'gallery': actual,
+            'checked_at': datetime.utcnow().isoformat()
+        }
+        return self.last_check
+
+    def stats(self):
+        snapshot = self._snapshot
+        return {
+            'templates': len(snapshot) if snapshot is not None else None,
+            'generation': snapshot.generation if snapshot is not None else None,
+            'shared_snapshot': self.snapshot_path is not None,
+            'pending_delta_records': self._delta_records,
+            'last_check': self.last_check
+        }
+
+    def _maybe_check(self):
+        if CHECK_INTERVAL <= 0 or time.monotonic() - self._last_check < CHECK_INTERVAL:
+            return
+        self._last_check = time.monotonic()
+        try:
+            self.compact()
+            self.check()
+        except Exception as e:
+            print(f"Face gallery consistency check failed: {e}")
+
+    def _database_checksum(self):
+        count, id_sum, user_id_sum = db.session.query(
+            func.count(FaceData.id), func.coalesce(func.sum(FaceData.id), 0), func.coalesce(func.sum(FaceData.user_id), 0)
+        ).one()
+        return int(count), int(id_sum), int(user_id_sum)
+
+    def _replay_deltas(self):
+        """Apply delta records other workers (or this one) appended since the last read"""
+        if self._file_identity is None or self._snapshot is None:
+            return
+        result = read_deltas(self.snapshot_path, self._snapshot.generation, self._delta_offset)
+        if result is None:
+            # No log for this generation (yet); remember its size so the fast path stays quiet
+            self._delta_offset = delta_log_size(self.snapshot_path)
+            return
+        records, self._delta_offset = result
+        if records:
+            self._snapshot = self._snapshot.with_deltas(records)
+            self._delta_records += len(records)
+
+    def _compact(self):
+        """Publish the current in-memory gallery as the next generation (file lock held)"""
+        folded = self._delta_records
+        generation = read_snapshot_generation(self.snapshot_path) + 1
+        snapshot = self._snapshot
+        write_snapshot(self.snapshot_path, snapshot, generation)
+        reset_delta_log(self.snapshot_path, generation)
+        snapshot.generation = generation
+        self._attach_ann_index(snapshot)
+        self._map_file()
+        print(f"Face gallery compacted: {folded} delta records folded into generation {generation}")
+
+    def _reindex(self):
+        """Re-cluster the ANN index of a per-process gallery after deltas (lock held)"""
+        self._snapshot.ann_index = None
+        self._attach_ann_index(self._snapshot)
+        print(f"Face gallery re-indexed after {self._delta_records} delta records")
+        self._delta_records = 0
+
+    def _publish(self):
+        try:
+            with snapshot_file_lock(self.snapshot_path):
+                generation = read_snapshot_generation(self.snapshot_path) + 1
+                snapshot = self._load_from_database()
+                write_snapshot(self.snapshot_path, snapshot, generation)
+                reset_delta_log(self.snapshot_path, generation)
+                snapshot.generation = generation
+                self._attach_ann_index(snapshot)
+            self._map_file()
+        except OSError as e:
+            # Fall back to a private in-memory gallery if the snapshot file is unusable
+            print(f"Cannot publish face gallery snapshot: {e}")
+            self._snapshot = self._load_from_database()
+            self._attach_ann_index(self._snapshot)
+            self._file_identity = None
+
+    def _map_file(self):
+        arrays, generation, identity = map_snapshot(self.snapshot_path)
+        self._snapshot = GallerySnapshot(generation=generation, **arrays)
+        self._attach_ann_index(self._snapshot)
+        self._file_identity = identity
+        self._delta_offset = 0
+        self._delta_records = 0
+        print(f"Face gallery mapped: {len(self._snapshot)} templates, generation {generation}")
+
+    def _attach_ann_index(self, snapshot):
+        """Load (or build and persist) the IVF index for a large enough snapshot"""
+        if not ANN_ENABLED or len(snapshot) < ANN_MIN_TEMPLATES:
+            return
+
+        index_path = f"{self.snapshot_path}.ivf.npz" if self.snapshot_path else None
+        index = None
+        if index_path:
+            index = IVFIndex.load(index_path, generation=snapshot.generation, count=len(snapshot))
+
+        if index is None:
+            started = time.perf_counter()
+            index = IVFIndex.build(snapshot.encodings, generation=snapshot.generation)
+            print(f"ANN index built: {index.n_lists} lists in {time.perf_counter() - started:.2f}s")
+            if index_path:
+                try:
+                    index.save(index_path)
+                except OSError as e:
+                    print(f"Cannot save ANN index: {e}")
+
+        snapshot.ann_index = index
+
+    def _load_from_database(self):
+        # Only fetch the columns we need - no ORM objects, no image_path
+        rows = db.session.query(FaceData.id, FaceData.user_id, FaceData.face_encoding).all()
+        snapshot = GallerySnapshot.from_rows(rows)
+        print(f"Face gallery loaded: {len(snapshot)} templates")
+        return snapshot
+
+
+# FaceData changes are collected per session during flush and applied once the transaction commits
+def _session_deltas(target):
+    session = object_session(target)
+    return session.info.setdefault(DELTAS_SESSION_KEY, []) if session is not None else None
+
+
+@event.listens_for(FaceData, 'after_insert')
+@event.listens_for(FaceData, 'after_update')
+def _face_data_written(mapper, connection, target):
+    deltas = _session_deltas(target)
+    if deltas is not None:
+        deltas.append((DELTA_ADD, target.id, target.user_id, bytes(target.face_encoding)))
+
+
+@event.listens_for(FaceData, 'after_delete')
+def _face_data_deleted(mapper, connection, target):
+    deltas = _session_deltas(target)
+    if deltas is not None:
+        deltas.append((DELTA_REMOVE, target.id, target.user_id, b''))
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_committed_deltas(session):
+    deltas = session.info.pop(DELTAS_SESSION_KEY, None)
+    if deltas:
+        face_gallery.apply_deltas(deltas)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_deltas(session):
+    session.info.pop(DELTAS_SESSION_KEY, None)
+
+
+# Global instance
+face_gallery = FaceGallery()
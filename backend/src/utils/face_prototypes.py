@@ -0,0 +1,130 @@
+import os
+import time
+import numpy as np
+
+# Per-student prototypes: one normalized mean per user plus a few outlier exemplars.
+# Recognition scores the prototypes first and re-ranks only the shortlisted users' templates.
+# Like the ANN index this is approximate, so it is opt-in: check its recall on the real
+# gallery with `python ann_recall_report.py --prototypes` before setting FACE_PROTOTYPES=1.
+PROTOTYPES_ENABLED = os.environ.get('FACE_PROTOTYPES', '0') == '1'
+PROTOTYPE_MIN_TEMPLATES = int(os.environ.get('FACE_PROTOTYPE_MIN_TEMPLATES', '2000'))  # below: exhaustive scan
+PROTOTYPE_MAX_EXEMPLARS = int(os.environ.get('FACE_PROTOTYPE_EXEMPLARS', '2'))
+PROTOTYPE_OUTLIER_DISTANCE = float(os.environ.get('FACE_PROTOTYPE_OUTLIER_DISTANCE', '0.35'))
+PROTOTYPE_SHORTLIST = int(os.environ.get('FACE_PROTOTYPE_SHORTLIST', '3'))  # users re-ranked per probe
+PROTOTYPE_MAX_RATIO = 0.75  # not worth it unless prototypes are clearly fewer than templates
+
+
+def _unit_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+class PrototypeIndex:
+    """Prototype matrix over a gallery snapshot, plus each user's template rows
+
+    shortlist() returns candidate gallery rows (all templates of the best
+    scoring users); callers re-rank them exactly. The reported score is that
+    of a real template, but when the true best user is not shortlisted a
+    worse template (or none) is returned, so the search is approximate.
+    """
+
+    def __init__(self, prototypes, prototype_users, users, user_rows, user_offsets):
+        self.prototypes = prototypes  # GallerySnapshot of the prototype vectors
+        self.prototype_users = prototype_users  # index into users for each prototype
+        self.users = users
+        self.user_rows = user_rows
+        self.user_offsets = user_offsets
+
+    def __len__(self):
+        return len(self.prototypes)
+
+    @classmethod
+    def build(cls, snapshot, max_exemplars=PROTOTYPE_MAX_EXEMPLARS, outlier_distance=PROTOTYPE_OUTLIER_DISTANCE):
+        """Mean prototype per user, rescaled to the user's mean template norm, plus outlier exemplars
+
+        An exemplar is a template whose direction is more than outlier_distance
+        (unit-vector Euclidean distance) from its user's mean; at most
+        max_exemplars of the farthest ones are kept per user.
+        """
+        encodings = np.asarray(snapshot.encodings, dtype=np.float64)
+        users, inverse = np.unique(snapshot.user_ids, return_inverse=True)
+        counts = np.bincount(inverse, minlength=len(users))
+        user_rows = np.argsort(inverse, kind='stable')
+        user_offsets = np.concatenate(([0], np.cumsum(counts)))
+
+        sums = np.zeros((len(users), encodings.shape[1]))
+        np.add.at(sums, inverse, encodings)
+        means = sums / counts[:, None]
+        template_norms = np.sqrt(np.asarray(snapshot.squared_norms, dtype=np.float64))
+        mean_norms = np.bincount(inverse, weights=template_norms, minlength=len(users)) / counts
+        means = _unit_rows(means) * mean_norms[:, None]
+
+        distances = np.linalg.norm(_unit_rows(encodings) - _unit_rows(means)[inverse], axis=1)
+        order = np.lexsort((-distances, inverse))  # by user, farthest first
+        rank = np.arange(len(order)) - user_offsets[inverse[order]]
+        exemplar_rows = order[(rank < max_exemplars) & (distances[order] > outlier_distance)]
+
+        prototype_users = np.concatenate((np.arange(len(users)), inverse[exemplar_rows]))
+        prototypes = type(snapshot)(
+            np.vstack((means, encodings[exemplar_rows])),
+            users[prototype_users],
+            np.concatenate((np.full(len(users), -1), snapshot.face_ids[exemplar_rows]))
+        )
+        return cls(prototypes, prototype_users, users, user_rows, user_offsets)
+
+    def shortlist(self, test_encodings, n_users=PROTOTYPE_SHORTLIST):
+        """Gallery rows of the n_users best-scoring users, one array per test encoding"""
+        # The first len(users) prototypes are the means, in user order; exemplars follow
+        scores = self.prototypes.score(test_encodings)
+        user_count = len(self.users)
+        user_scores = scores[:, :user_count].copy()
+        if scores.shape[1] > user_count:
+            np.maximum.at(user_scores.T, self.prototype_users[user_count:], scores[:, user_count:].T)
+
+        n_users = max(1, min(n_users, user_count))
+        if n_users < user_count:
+            best_users = np.argpartition(-user_scores, n_users - 1, axis=1)[:, :n_users]
+        else:
+            best_users = np.broadcast_to(np.arange(user_count), user_scores.shape)
+
+        return [np.concatenate([
+            self.user_rows[self.user_offsets[user]:self.user_offsets[user + 1]] for user in candidates
+        ]) for candidates in best_users]
+
+
+def recall_report(gallery, queries, shortlist_options=(1, 2, 3, 5, 8)):
+    """Compare the prototype-shortlist top-1 against the exhaustive top-1 for each shortlist size
+
+    gallery is a GallerySnapshot; returns one dict per n_users with recall@1,
+    mean shortlist size and mean per-query latency in milliseconds.
+    """
+    queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+
+    started = time.perf_counter()
+    exact = [gallery.best_match(gallery.score(query)[0])[0] for query in queries]
+    exhaustive_ms = (time.perf_counter() - started) * 1000 / len(queries)
+
+    index = PrototypeIndex.build(gallery)
+    report = []
+    for n_users in shortlist_options:
+        hits = 0
+        shortlist_total = 0
+        started = time.perf_counter()
+        for query, expected in zip(queries, exact):
+            rows = index.shortlist(query, n_users)[0]
+            shortlist_total += len(rows)
+            best_row, _ = gallery.best_match(gallery.score(query, rows)[0])
+            found = int(rows[best_row]) if best_row >= 0 else -1
+            hits += found == expected
+        elapsed_ms = (time.perf_counter() - started) * 1000 / len(queries)
+
+        report.append({
+            'prototypes': len(index),
+            'n_users': n_users,
+            'recall_at_1': hits / len(queries),
+            'mean_shortlist': shortlist_total / len(queries),
+            'prototype_ms': elapsed_ms,
+            'exhaustive_ms': exhaustive_ms
+        })
+
+    return report
@@ -1,26 +1,219 @@
 import cv2
+import importlib
 import numpy as np
-import base64
 import os
-from PIL import Image
-import io
-import pickle
-import face_recognition
-from sklearn.metrics.pairwise import cosine_similarity
+import threading
+import time
+from src.utils.face_gallery import GallerySnapshot
+from src.utils.face_template import load_encoding
+from src.utils.frame_context import FrameContext, decode_base64_bytes, decode_image_bytes
+from src.utils import fallback_features
+from src.utils.fallback_features import FALLBACK_CROP_SIZE
+
+# Adaptive jitter: encode with 1 jitter first and only re-encode with more jitters
+# when the best score lands within AMBIGUITY_BAND of the dynamic threshold
+ADAPTIVE_JITTER_ENABLED = os.environ.get('FACE_ADAPTIVE_JITTER', '1') == '1'
+ADAPTIVE_AMBIGUITY_BAND = float(os.environ.get('FACE_AMBIGUITY_BAND', '0.08'))
+ADAPTIVE_MAX_JITTERS = int(os.environ.get('FACE_MAX_JITTERS', '3'))
+
+# Two-resolution pipeline: detect on a pyramid level at most this wide, encode on the
+# full-resolution face crop (plus a margin of this fraction of the face size)
+DETECTION_MAX_WIDTH = int(os.environ.get('FACE_DETECTION_MAX_WIDTH', '800'))
+REALTIME_DETECTION_MAX_WIDTH = 640
+GROUP_DETECTION_MAX_WIDTH = int(os.environ.get('FACE_GROUP_DETECTION_MAX_WIDTH', '1600'))
+ENCODING_CROP_MARGIN = 0.5
+
+# Detector cascade for encode_face_advanced: tiers run cheapest first until one finds a face;
+# a tier is skipped when its estimated cost no longer fits in the remaining per-request budget
+DETECTOR_CASCADE = [tier.strip() for tier in os.environ.get(
+    'FACE_DETECTOR_CASCADE', 'hog,haar,hog_upsampled,cnn').split(',') if tier.strip()]
+DETECTION_BUDGET_MS = float(os.environ.get('FACE_DETECTION_BUDGET_MS', '1500'))
+# Starting cost estimates (ms), refined from measured run times (exponential moving average)
+DETECTOR_COST_ESTIMATES_MS = {
+    'hog': 60.0,
+    'haar': 30.0,
+    'hog_upsampled': 250.0,
+    'cnn': float(os.environ.get('FACE_CNN_COST_MS', '4000'))
+}
+DETECTOR_COST_SMOOTHING = 0.2
+
+# Models are loaded on first use; FACE_WARMUP=1 loads them (and runs a dummy inference) at startup
+WARMUP_ENABLED = os.environ.get('FACE_WARMUP', '0') == '1'
+WARMUP_CNN = os.environ.get('FACE_WARMUP_CNN', '0') == '1'
+
+class _LazyModule:
+    """Stand-in for a heavy module that is imported on first attribute access"""
+    
+    def __init__(self, name):
+        self._name = name
+    
+    def __getattr__(self, attribute):
+        module = importlib.import_module(self._name)
+        return getattr(module, attribute)
+
+# face_recognition loads the dlib models on import, so CRUD-only processes never pay for it
+face_recognition = _LazyModule('face_recognition')
 
 class AdvancedFaceRecognition:
     def __init__(self):
-        # Load Haar Cascade detector (backup)
-        self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-        
-        # Use face_recognition library (đã bao gồm HOG + CNN detectors)
+        # Haar cascade and the face_recognition library are loaded lazily (see warm_up)
+        self._face_cascade = None
+        self._use_face_recognition = None
+        self._lock = threading.Lock()
+        self.warm_up_state = {'status': 'cold'}
+        self.detector_costs_ms = dict(DETECTOR_COST_ESTIMATES_MS)
+    
+    @property
+    def face_cascade(self):
+        """Haar Cascade detector (backup)"""
+        if self._face_cascade is None:
+            self._face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        return self._face_cascade
+    
+    @property
+    def use_face_recognition(self):
+        """Whether the face_recognition library (HOG + CNN detectors, dlib encoder) is available"""
+        if self._use_face_recognition is None:
+            with self._lock:
+                if self._use_face_recognition is None:
+                    try:
+                        importlib.import_module('face_recognition')
+                        self._use_face_recognition = True
+                        print("Face recognition library loaded successfully")
+                    except ImportError:
+                        self._use_face_recognition = False
+                        print("Warning: face_recognition library not installed. Using basic detection.")
+        return self._use_face_recognition
+    
+    @use_face_recognition.setter
+    def use_face_recognition(self, value):
+        self._use_face_recognition = value
+    
+    def warm_up(self, cnn=WARMUP_CNN):
+        """Load detectors and encoders and run one dummy inference so no request pays for it"""
+        self.warm_up_state = {'status': 'warming'}
+        started = time.perf_counter()
         try:
-            import face_recognition
-            self.use_face_recognition = True
-            print("Face recognition library loaded successfully")
-        except ImportError:
-            self.use_face_recognition = False
-            print("Warning: face_recognition library not installed. Using basic detection.")
+            self.face_cascade
+            if self.use_face_recognition:
+                blank = np.zeros((64, 64, 3), dtype=np.uint8)
+                face_recognition.face_locations(blank, model="hog")
+                if cnn:
+                    face_recognition.face_locations(blank, model="cnn")
+                for model in ("large", "small"):
+                    face_recognition.face_encodings(blank, [(8, 56, 56, 8)], num_jitters=1, model=model)
+            else:
+                fallback_features.extract_features(np.zeros((1,) + FALLBACK_CROP_SIZE, dtype=np.uint8))
+        except Exception as e:
+            self.warm_up_state = {'status': 'failed', 'error': str(e)}
+            print(f"Face model warm-up failed: {e}")
+            return self.warm_up_state
+        
+        self.warm_up_state = {'status': 'ready', 'seconds': round(time.perf_counter() - started, 3)}
+        print(f"Face models warmed up in {self.warm_up_state['seconds']}s (pid {os.getpid()})")
+        return self.warm_up_state
+    
+    def _frame(self, source):
+        """Wrap a base64 string, encoded image bytes or BGR array in a FrameContext (existing contexts pass through)"""
+        if isinstance(source, FrameContext):
+            return source
+        if isinstance(source, np.ndarray):
+            return FrameContext(image=source)
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            return FrameContext(image_bytes=source)
+        return FrameContext(base64_image=source)
+    
+    def _detection_level(self, frame, max_width, color="rgb", reduced_decode=False):
+        """Bounded-width pyramid level of the frame used for detection; returns (image, scale)
+        
+        With reduced_decode the level comes from a reduced-scale JPEG decode
+        instead of the full-resolution image (detection-only requests).
+        """
+        def compute():
+            if reduced_decode and not frame.decoded:
+                image, _ = frame.reduced_bgr(max_width)
+                if color == "rgb":
+                    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            else:
+                image = frame.rgb if color == "rgb" else frame.bgr
+            if image.shape[1] > max_width:
+                size = (max_width, max(1, round(image.shape[0] * max_width / image.shape[1])))
+                image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+            return image, image.shape[1] / frame.width
+        return frame.cached(('detection_level', max_width, color, reduced_decode), compute)
+    
+    @staticmethod
+    def _to_original_space(face_locations, scale, width, height):
+        """Map (top, right, bottom, left) boxes from a pyramid level back to full resolution
+        
+        Always plain ints: Haar boxes come back as np.int32, which jsonify cannot serialize.
+        """
+        if scale == 1.0:
+            return [(int(top), int(right), int(bottom), int(left)) for (top, right, bottom, left) in face_locations]
+        return [(
+            max(0, int(top / scale)),
+            min(width, int(right / scale)),
+            min(height, int(bottom / scale)),
+            max(0, int(left / scale))
+        ) for (top, right, bottom, left) in face_locations]
+    
+    @staticmethod
+    def _encoding_crop(image, face_locations, margin=ENCODING_CROP_MARGIN):
+        """Full-resolution crop around the faces plus margin, with boxes relative to the crop"""
+        height, width = image.shape[:2]
+        face_size = max(max(bottom - top, right - left) for (top, right, bottom, left) in face_locations)
+        pad = int(face_size * margin)
+        
+        crop_top = max(0, min(top for (top, _, _, _) in face_locations) - pad)
+        crop_left = max(0, min(left for (_, _, _, left) in face_locations) - pad)
+        crop_bottom = min(height, max(bottom for (_, _, bottom, _) in face_locations) + pad)
+        crop_right = min(width, max(right for (_, right, _, _) in face_locations) + pad)
+        
+        crop = np.ascontiguousarray(image[crop_top:crop_bottom, crop_left:crop_right])
+        relative = [(top - crop_top, right - crop_left, bottom - crop_top, left - crop_left)
+                    for (top, right, bottom, left) in face_locations]
+        return crop, relative
+    
+    def _face_locations(self, frame, model="hog", upsample=1, max_width=DETECTION_MAX_WIDTH, reduced_decode=False):
+        """Face locations detected on a downscaled level, in original-image coordinates (cached per frame)
+        
+        Without the face_recognition library the Haar cascade detects instead.
+        """
+        def compute():
+            if not self.use_face_recognition:
+                image, scale = self._detection_level(frame, max_width, color="bgr", reduced_decode=reduced_decode)
+                face_locations = [(y, x + w, y + h, x) for (x, y, w, h) in self.detect_faces(image)]
+            else:
+                image, scale = self._detection_level(frame, max_width, reduced_decode=reduced_decode)
+                face_locations = face_recognition.face_locations(image, number_of_times_to_upsample=upsample, model=model)
+            return self._to_original_space(face_locations, scale, frame.width, frame.height)
+        return frame.cached(('face_locations', model, upsample, max_width), compute)
+    
+    def _face_encodings(self, frame, face_locations, num_jitters, model):
+        """Face encodings computed on the full-resolution face crop (cached per frame and settings)
+        
+        Without the face_recognition library these are LBP + HOG fallback features.
+        """
+        def compute():
+            if not self.use_face_recognition:
+                return list(self._fallback_encodings([frame] * len(face_locations), face_locations))
+            crop, relative = self._encoding_crop(frame.rgb, face_locations)
+            return face_recognition.face_encodings(crop, relative, num_jitters=num_jitters, model=model)
+        return frame.cached(('face_encodings', tuple(face_locations), num_jitters, model), compute)
+    
+    @staticmethod
+    def _fallback_crop(image, face_location):
+        """Grayscale FALLBACK_CROP_SIZE crop of one (top, right, bottom, left) face in a BGR image"""
+        top, right, bottom, left = face_location
+        face_roi = image[max(0, top):bottom, max(0, left):right]
+        if face_roi.size == 0:
+            raise ValueError("Không thể tạo encoding từ khuôn mặt")
+        return cv2.resize(cv2.cvtColor(face_roi, cv2.COLOR_BGR2GRAY), FALLBACK_CROP_SIZE)
+    
+    def _fallback_encodings(self, frames, face_locations):
+        """LBP + HOG features of one face per (frame, location), extracted as one batch (N x features)"""
+        crops = [self._fallback_crop(frame.bgr, location) for frame, location in zip(frames, face_locations)]
+        return fallback_features.extract_features(np.stack(crops))
     
     def detect_faces(self, image):
         """Detect faces using Haar Cascade (fallback method)"""
@@ -50,15 +243,12 @@ class AdvancedFaceRecognition:
     def detect_faces_with_coordinates(self, base64_image):
         """Detect faces and return coordinates for drawing rectangles"""
         try:
-            # Decode image
-            image = self.decode_base64_image(base64_image)
-            original_height, original_width = image.shape[:2]
-            
-            # Convert BGR to RGB
-            rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            # Decode image (once per frame)
+            frame = self._frame(base64_image)
+            original_height, original_width = frame.height, frame.width
             
-            # Detect face locations
-            face_locations = face_recognition.face_locations(rgb_image, model="hog")
+            # Detect face locations; only boxes are needed, so decode the JPEG at reduced scale
+            face_locations = self._face_locations(frame, reduced_decode=True)
             
             print(f"Detected {len(face_locations)} faces in image {original_width}x{original_height}")  # Debug
             
@@ -88,51 +278,29 @@ class AdvancedFaceRecognition:
     def detect_faces_realtime_optimized(self, base64_image):
         """Detect faces optimized for real-time processing"""
         try:
-            # Decode image
-            image = self.decode_base64_image(base64_image)
-            
-            # Resize image for faster processing if it's too large
-            height, width = image.shape[:2]
-            if width > 640:
-                scale = 640 / width
-                new_width = int(width * scale)
-                new_height = int(height * scale)
-                image = cv2.resize(image, (new_width, new_height))
-                # Update scale factor for coordinates
-            else:
-                scale = 1.0
-            
-            # Convert BGR to RGB
-            rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            frame = self._frame(base64_image)
             
-            # Detect face locations using HOG (fastest method)
-            face_locations = face_recognition.face_locations(
-                rgb_image, 
-                model="hog",
-                number_of_times_to_upsample=0  # Don't upsample for speed
+            # Detect on a level at most 640px wide (decoded at reduced JPEG scale) using HOG
+            # without upsampling (fastest method); locations come back in original-image coordinates
+            face_locations = self._face_locations(
+                frame, upsample=0, max_width=REALTIME_DETECTION_MAX_WIDTH, reduced_decode=True
             )
             
             # Convert to coordinates format for frontend
             faces = []
             for (top, right, bottom, left) in face_locations:
-                # Scale coordinates back to original size if image was resized
-                scaled_left = int(left / scale)
-                scaled_top = int(top / scale)
-                scaled_width = int((right - left) / scale)
-                scaled_height = int((bottom - top) / scale)
-                
                 faces.append({
-                    'x': scaled_left,
-                    'y': scaled_top,
-                    'width': scaled_width,
-                    'height': scaled_height,
+                    'x': left,
+                    'y': top,
+                    'width': right - left,
+                    'height': bottom - top,
                     'confidence': 0.9  # HOG model doesn't return confidence, so we use a default
                 })
             
             return {
                 'faces': faces,
-                'image_width': int(width / scale) if scale != 1.0 else image.shape[1],
-                'image_height': int(height / scale) if scale != 1.0 else image.shape[0]
+                'image_width': frame.width,
+                'image_height': frame.height
             }
             
         except Exception as e:
@@ -155,7 +323,13 @@ class AdvancedFaceRecognition:
             
             return face_encodings[0]
         else:
-            # Fallback to basic methods
+            # Fallback to basic methods (vectorized LBP + HOG)
+            return self.extract_fallback_features([image])[0]
+    
+    def extract_fallback_features(self, images):
+        """LBP + HOG features for several single-face BGR images, extracted as one batch (N x features)"""
+        crops = []
+        for image in images:
             faces = self.detect_faces_advanced(image)
             
             if len(faces) == 0:
@@ -165,74 +339,24 @@ class AdvancedFaceRecognition:
                 raise ValueError("Multiple faces detected. Please ensure only one face is visible.")
             
             x, y, w, h = faces[0]
-            face_roi = image[y:y+h, x:x+w]
-            
-            # Basic feature extraction
-            face_gray = cv2.cvtColor(face_roi, cv2.COLOR_BGR2GRAY)
-            face_resized = cv2.resize(face_gray, (100, 100))
-            
-            # Extract LBP features
-            lbp_features = self.extract_lbp_features(face_resized)
-            
-            # Extract HOG features
-            hog_features = self.extract_hog_features(face_resized)
-            
-            # Combine features
-            combined_features = np.concatenate([lbp_features, hog_features])
-            
-            return combined_features
+            crops.append(self._fallback_crop(image, (y, x + w, y + h, x)))
+        
+        return fallback_features.extract_features(np.stack(crops))
     
     def extract_lbp_features(self, image):
         """Extract Local Binary Pattern features"""
-        lbp = np.zeros_like(image)
-        for i in range(1, image.shape[0]-1):
-            for j in range(1, image.shape[1]-1):
-                center = image[i, j]
-                binary_string = ''
-                
-                # 8 neighbors
-                neighbors = [
-                    image[i-1, j-1], image[i-1, j], image[i-1, j+1],
-                    image[i, j+1], image[i+1, j+1], image[i+1, j],
-                    image[i+1, j-1], image[i, j-1]
-                ]
-                
-                for neighbor in neighbors:
-                    binary_string += '1' if neighbor >= center else '0'
-                
-                lbp[i, j] = int(binary_string, 2)
-        
-        # Calculate histogram
-        hist, _ = np.histogram(lbp.ravel(), bins=256, range=(0, 256))
-        return hist / hist.sum()  # Normalize
+        return fallback_features.lbp_histograms(image)[0]
     
     def extract_hog_features(self, image):
         """Extract HOG features"""
-        from skimage.feature import hog
-        
-        features = hog(image, orientations=9, pixels_per_cell=(8, 8),
-                      cells_per_block=(2, 2), transform_sqrt=True, block_norm='L2-Hys')
-        return features
+        return fallback_features.hog_features(image)[0]
     
     def compare_faces_advanced(self, encoding1, encoding2):
         """Advanced face comparison with improved algorithm"""
         try:
             # Ensure both encodings are properly deserialized
-            if isinstance(encoding1, bytes):
-                features1 = pickle.loads(encoding1)
-            elif isinstance(encoding1, str):
-                # Handle string encoded data
-                features1 = pickle.loads(encoding1.encode('latin-1'))
-            else:
-                features1 = encoding1
-                
-            if isinstance(encoding2, bytes):
-                features2 = pickle.loads(encoding2)
-            elif isinstance(encoding2, str):
-                # Handle string encoded data
-                features2 = pickle.loads(encoding2.encode('latin-1'))
-            else:
-                features2 = encoding2
+            features1 = load_encoding(encoding1)
+            features2 = load_encoding(encoding2)
             
             # Convert to numpy arrays if they aren't already
             features1 = np.array(features1, dtype=np.float64)
@@ -254,127 +378,230 @@ class AdvancedFaceRecognition:
                 if features1.shape != features2.shape:
                     return 0.0
                 
-                # Normalize features for better comparison
-                features1 = features1 / np.linalg.norm(features1)
-                features2 = features2 / np.linalg.norm(features2)
-                
-                # Method 1: Cosine similarity
-                cosine_sim = np.dot(features1, features2)
-                
-                # Method 2: Euclidean distance (converted to similarity)
-                euclidean_dist = np.linalg.norm(features1 - features2)
-                euclidean_sim = 1 / (1 + euclidean_dist)
-                
-                # Weighted combination with emphasis on cosine similarity
-                final_similarity = (cosine_sim * 0.8 + euclidean_sim * 0.2)
-                
-                return max(0.0, min(1.0, final_similarity))
+                # Cosine similarity weighted with Euclidean distance on normalized features
+                return float(fallback_features.similarity_matrix(features1, features2)[0, 0])
             
         except Exception as e:
             print(f"Comparison error: {e}")
             return 0.0
     
     def recognize_face_advanced(self, base64_image, known_encodings, threshold=0.6):
-        """Advanced face recognition with multiple validation steps"""
+        """Advanced face recognition with multiple validation steps
+        
+        known_encodings may be a GallerySnapshot (match_index is a row of the
+        snapshot) or a list of stored encodings (match_index is a list position).
+        """
         try:
-            # Decode image and get face coordinates
-            image = self.decode_base64_image(base64_image)
-            
-            # Validate image quality first
-            if not self._validate_image_quality(image):
-                raise ValueError("Chất lượng ảnh không đủ tốt để nhận diện")
-            
-            # Convert BGR to RGB
-            rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-            
-            # Detect faces and get locations
-            face_locations = face_recognition.face_locations(rgb_image, model="hog")
-            
-            if len(face_locations) == 0:
-                raise ValueError("Không phát hiện được khuôn mặt trong ảnh")
-            elif len(face_locations) > 1:
-                # Choose the largest face
-                face_locations = [max(face_locations, key=lambda x: (x[2]-x[0])*(x[1]-x[3]))]
-            
-            # Extract face encoding
-            face_encodings = face_recognition.face_encodings(rgb_image, face_locations, num_jitters=3, model="large")
-            
-            if len(face_encodings) == 0:
-                raise ValueError("Không thể tạo encoding từ khuôn mặt")
-            
-            test_encoding = face_encodings[0]
-            
-            best_match_score = 0.0
-            best_match_index = -1
-            scores = []
-            
-            # Compare against all known encodings with weighted scoring
-            for i, known_encoding in enumerate(known_encodings):
-                try:
-                    # Ensure known_encoding is properly formatted
-                    if isinstance(known_encoding, bytes):
-                        known_encoding = pickle.loads(known_encoding)
-                    elif isinstance(known_encoding, str):
-                        known_encoding = pickle.loads(known_encoding.encode('latin-1'))
-                    
-                    # Convert to numpy array
-                    known_encoding = np.array(known_encoding, dtype=np.float64)
-                    test_encoding_array = np.array(test_encoding, dtype=np.float64)
-                    
-                    # Calculate similarity score
-                    face_distance = face_recognition.face_distance([known_encoding], test_encoding_array)[0]
-                    similarity_score = 1 - face_distance  # Convert distance to similarity
-                    
-                    # Apply confidence weighting
-                    weighted_score = self._apply_confidence_weighting(similarity_score, test_encoding_array, known_encoding)
-                    scores.append(weighted_score)
-                    
-                    if weighted_score > best_match_score:
-                        best_match_score = weighted_score
-                        best_match_index = i
-                        
-                except Exception as e:
-                    print(f"Error processing encoding {i}: {e}")
-                    scores.append(0.0)
+            _, face_coordinates, _, match_index, best_match_score, _ = self.recognize_adaptive(
+                base64_image, known_encodings, threshold
+            )
+            return match_index, best_match_score, face_coordinates
+                
+        except Exception as e:
+            raise ValueError(f"Face recognition failed: {str(e)}")
+    
+    def _probe_face_location(self, frame):
+        """Validate a recognition image and pick its largest face; returns (location, coordinates)"""
+        # Validate image quality first
+        if not self._validate_image_quality(frame):
+            raise ValueError("Chất lượng ảnh không đủ tốt để nhận diện")
+        
+        # Detect faces and get locations
+        face_locations = self._face_locations(frame)
+        
+        if len(face_locations) == 0:
+            raise ValueError("Không phát hiện được khuôn mặt trong ảnh")
+        
+        # Choose the largest face
+        face_location = max(face_locations, key=lambda x: (x[2]-x[0])*(x[1]-x[3]))
+        
+        # Get face coordinates for rectangle drawing
+        face_coordinates = {
+            'x': face_location[3],  # left
+            'y': face_location[0],  # top
+            'width': face_location[1] - face_location[3],  # right - left
+            'height': face_location[2] - face_location[0],  # bottom - top
+            'image_width': frame.width,
+            'image_height': frame.height
+        }
+        return face_location, face_coordinates
+    
+    def encode_probe_face(self, base64_image, num_jitters=ADAPTIVE_MAX_JITTERS):
+        """Encode the largest face of a recognition image; returns (encoding, coordinates, frame)"""
+        # Decode image once; base64_image may already be a FrameContext
+        frame = self._frame(base64_image)
+        face_location, face_coordinates = self._probe_face_location(frame)
+        
+        # Extract face encoding
+        face_encodings = self._face_encodings(frame, [face_location], num_jitters=num_jitters, model="large")
+        
+        if len(face_encodings) == 0:
+            raise ValueError("Không thể tạo encoding từ khuôn mặt")
+        
+        return face_encodings[0], face_coordinates, frame
+    
+    def encode_probe_faces(self, images, num_jitters=ADAPTIVE_MAX_JITTERS):
+        """Encode the largest face of several recognition images with one encoder call
+        
+        Returns one (encoding, coordinates, frame) tuple per image, or the
+        exception raised for that image, so one bad image never fails the rest.
+        """
+        frames = [self._frame(image) for image in images]
+        outcomes = [None] * len(frames)
+        
+        pending = []  # (position, frame, location, coordinates)
+        for position, frame in enumerate(frames):
+            try:
+                face_location, face_coordinates = self._probe_face_location(frame)
+                pending.append((position, frame, face_location, face_coordinates))
+            except Exception as e:
+                outcomes[position] = e
+        
+        if pending:
+            encodings = self._batch_face_encodings(
+                [item[1] for item in pending], [item[2] for item in pending], num_jitters, "large"
+            )
+            for (position, frame, face_location, face_coordinates), encoding in zip(pending, encodings):
+                if encoding is None:
+                    outcomes[position] = ValueError("Không thể tạo encoding từ khuôn mặt")
                     continue
+                # Same cache entry encode_probe_face would have produced
+                frame.prime({('face_encodings', (face_location,), num_jitters, "large"): [encoding]})
+                outcomes[position] = (encoding, face_coordinates, frame)
+        
+        return outcomes
+    
+    def _batch_face_encodings(self, frames, face_locations, num_jitters, model):
+        """One encoding per (frame, location), computed on the face crops in a single dlib batch
+        
+        Falls back to one face_encodings call per crop when the batch API is unavailable,
+        and to one batch of LBP + HOG features without the face_recognition library.
+        """
+        if not self.use_face_recognition:
+            return list(self._fallback_encodings(frames, face_locations))
+        
+        crops = [self._encoding_crop(frame.rgb, [location]) for frame, location in zip(frames, face_locations)]
+        
+        try:
+            import dlib
+            from face_recognition import api
+            batch_faces = []
+            for crop, relative in crops:
+                detections = dlib.full_object_detections()
+                for landmarks in api._raw_face_landmarks(crop, relative, model):
+                    detections.append(landmarks)
+                batch_faces.append(detections)
+            descriptors = api.face_encoder.compute_face_descriptor(
+                [crop for crop, _ in crops], batch_faces, num_jitters
+            )
+            return [np.array(faces[0]) if len(faces) else None for faces in descriptors]
+        except (ImportError, AttributeError, TypeError, RuntimeError):
+            encodings = []
+            for crop, relative in crops:
+                result = face_recognition.face_encodings(crop, relative, num_jitters=num_jitters, model=model)
+                encodings.append(result[0] if len(result) else None)
+            return encodings
+    
+    def recognize_probe(self, base64_image, known_encodings, threshold, num_jitters=ADAPTIVE_MAX_JITTERS, encoder=None):
+        """Encode the probe face and match it; returns (encoding, coordinates, frame, match_index, score)"""
+        test_encoding, face_coordinates, frame = (encoder or self).encode_probe_face(
+            self._frame(base64_image), num_jitters=num_jitters
+        )
+        match_index, score = self.match_encoding(test_encoding, known_encodings, threshold, frame)
+        return test_encoding, face_coordinates, frame, match_index, score
+    
+    def recognize_adaptive(self, base64_image, known_encodings, threshold, engine=None):
+        """Recognize with a 1-jitter encoding, escalating to more jitters only for ambiguous scores
+        
+        Returns (encoding, coordinates, frame, match_index, score, path) where path
+        records which route ran: {'path': 'fast' | 'escalated' | 'full', 'num_jitters': n}.
+        With FACE_ADAPTIVE_JITTER=0 every probe is encoded with the full jitter count.
+        engine provides recognize_probe (e.g. the micro-batcher); defaults to self.
+        """
+        engine = engine or self
+        frame = self._frame(base64_image)
+        first_jitters = 1 if ADAPTIVE_JITTER_ENABLED else ADAPTIVE_MAX_JITTERS
+        test_encoding, face_coordinates, frame, match_index, score = engine.recognize_probe(
+            frame, known_encodings, threshold, num_jitters=first_jitters
+        )
+        path = {'path': 'fast' if ADAPTIVE_JITTER_ENABLED else 'full', 'num_jitters': first_jitters}
+        
+        if ADAPTIVE_JITTER_ENABLED and self.is_ambiguous_score(score, frame, threshold):
+            # Detection is cached on the frame, so only the encoder runs again
+            test_encoding, face_coordinates, frame, match_index, score = engine.recognize_probe(
+                frame, known_encodings, threshold, num_jitters=ADAPTIVE_MAX_JITTERS
+            )
+            path = {'path': 'escalated', 'num_jitters': ADAPTIVE_MAX_JITTERS}
+        
+        print(f"Adaptive recognition: path={path['path']} jitters={path['num_jitters']} score={score:.3f}")
+        return test_encoding, face_coordinates, frame, match_index, score, path
+    
+    def is_ambiguous_score(self, score, frame, threshold):
+        """True when a 1-jitter score is too close to the dynamic threshold to trust"""
+        if ADAPTIVE_MAX_JITTERS <= 1:
+            return False
+        dynamic_threshold = self._calculate_dynamic_threshold(frame, threshold)
+        return abs(score - dynamic_threshold) <= ADAPTIVE_AMBIGUITY_BAND
+    
+    def encode_all_faces(self, base64_image):
+        """Detect and encode every face in one image (group photos); returns (encodings, coordinates, frame)"""
+        frame = self._frame(base64_image)
+        
+        # Group photos keep a larger detection level so small, distant faces are still found
+        face_locations = self._face_locations(frame, max_width=GROUP_DETECTION_MAX_WIDTH)
+        if len(face_locations) == 0:
+            raise ValueError("Không phát hiện được khuôn mặt trong ảnh")
+        
+        # All faces go through the encoder in a single call
+        face_encodings = self._face_encodings(frame, face_locations, num_jitters=1, model="large")
+        
+        face_coordinates = [{
+            'x': left,
+            'y': top,
+            'width': right - left,
+            'height': bottom - top,
+            'image_width': frame.width,
+            'image_height': frame.height
+        } for (top, right, bottom, left) in face_locations]
+        
+        return face_encodings, face_coordinates, frame
+    
+    def match_encoding(self, test_encoding, known_encodings, threshold, frame):
+        """Match a probe encoding against a gallery; returns (match_index or None, score)"""
+        return self.match_encodings([test_encoding], known_encodings, threshold, [frame])[0]
+    
+    def match_encodings(self, test_encodings, known_encodings, threshold, frames):
+        """Match several probe encodings in one matrix pass; returns [(match_index or None, score)]"""
+        # Score against the gallery in one vectorized pass (ANN shortlist if enabled)
+        if isinstance(known_encodings, GallerySnapshot):
+            gallery = known_encodings
+        else:
+            gallery = GallerySnapshot.from_encodings(known_encodings)
+        
+        results = []
+        for (best_match_index, best_match_score), frame in zip(gallery.match_many(test_encodings), frames):
+            # Plain lists are indexed by their original position
+            if best_match_index >= 0 and gallery is not known_encodings:
+                best_match_index = int(gallery.face_ids[best_match_index])
             
             # Dynamic threshold based on image quality and lighting
-            dynamic_threshold = self._calculate_dynamic_threshold(image, threshold)
-            
-            # Get face coordinates for rectangle drawing
-            face_location = face_locations[0]
-            face_coordinates = {
-                'x': face_location[3],  # left
-                'y': face_location[0],  # top
-                'width': face_location[1] - face_location[3],  # right - left
-                'height': face_location[2] - face_location[0],  # bottom - top
-                'image_width': rgb_image.shape[1],
-                'image_height': rgb_image.shape[0]
-            }
+            dynamic_threshold = self._calculate_dynamic_threshold(frame, threshold)
             
             if best_match_score >= dynamic_threshold:
-                return best_match_index, best_match_score, face_coordinates
+                results.append((best_match_index, best_match_score))
             else:
-                return None, best_match_score, face_coordinates
-                
-        except Exception as e:
-            raise ValueError(f"Face recognition failed: {str(e)}")
+                results.append((None, best_match_score))
+        
+        return results
     
     def _validate_image_quality(self, image):
         """Validate image quality for better recognition"""
-        # Check image sharpness (Laplacian variance)
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        variance = cv2.Laplacian(gray, cv2.CV_64F).var()
-        
-        # Check brightness
-        mean_brightness = np.mean(gray)
+        # Sharpness (Laplacian variance), brightness and contrast are computed once per frame
+        metrics = self._frame(image).quality_metrics
         
-        # Check contrast
-        contrast = gray.std()
-        
-        return (variance > 100 and  # Not too blurry
-                20 < mean_brightness < 200 and  # Not too dark/bright
-                contrast > 30)  # Sufficient contrast
+        return (metrics['sharpness'] > 100 and  # Not too blurry
+                20 < metrics['brightness'] < 200 and  # Not too dark/bright
+                metrics['contrast'] > 30)  # Sufficient contrast
 
     def _apply_confidence_weighting(self, similarity_score, test_encoding, known_encoding):
         """Apply confidence weighting based on encoding quality"""
@@ -386,10 +613,8 @@ class AdvancedFaceRecognition:
 
     def _calculate_dynamic_threshold(self, image, base_threshold):
         """Calculate dynamic threshold based on image conditions"""
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        
         # Adjust threshold based on lighting conditions
-        mean_brightness = np.mean(gray)
+        mean_brightness = self._frame(image).quality_metrics['brightness']
         if mean_brightness < 50:  # Dark image
             return base_threshold * 0.85
         elif mean_brightness > 200:  # Bright image
@@ -423,17 +648,17 @@ class AdvancedFaceRecognition:
         """Enhanced face encoding with preprocessing"""
         try:
             # Decode image
-            image = self.decode_base64_image(base64_image)
+            frame = self._frame(base64_image)
             
-            # Preprocess image
-            processed_image = self.preprocess_image(image)
+            # Preprocess only the downscaled detection level (cheap), not the full frame
+            level, scale = self._detection_level(frame, DETECTION_MAX_WIDTH, color="bgr")
+            processed_level = frame.cached('preprocessed_level', lambda: self.preprocess_image(level))
             
-            # Detect faces with multiple methods
-            face_locations = face_recognition.face_locations(processed_image, model="hog")
-            
-            if len(face_locations) == 0:
-                # Try with CNN model as fallback
-                face_locations = face_recognition.face_locations(processed_image, model="cnn")
+            # Detect faces with the time-budgeted detector cascade
+            face_locations, _ = frame.cached(
+                ('preprocessed_face_locations', 'cascade'),
+                lambda: self._detect_cascade(level, processed_level, scale, frame)
+            )
             
             if len(face_locations) == 0:
                 raise ValueError("Không phát hiện được khuôn mặt trong ảnh")
@@ -441,13 +666,21 @@ class AdvancedFaceRecognition:
                 # Choose the largest face
                 face_locations = [max(face_locations, key=lambda x: (x[2]-x[0])*(x[1]-x[3]))]
             
-            # Generate encoding with higher precision
-            face_encodings = face_recognition.face_encodings(
-                processed_image, 
-                face_locations, 
-                num_jitters=5,  # Increased for better accuracy
-                model="large"   # Use large model for better features
-            )
+            if self.use_face_recognition:
+                # Preprocess and encode the full-resolution face crop only
+                crop, relative_locations = self._encoding_crop(frame.bgr, face_locations)
+                processed_crop = self.preprocess_image(crop)
+                
+                # Generate encoding with higher precision
+                face_encodings = face_recognition.face_encodings(
+                    processed_crop,
+                    relative_locations,
+                    num_jitters=5,  # Increased for better accuracy
+                    model="large"   # Use large model for better features
+                )
+            else:
+                # No dlib: LBP + HOG fallback features of the face
+                face_encodings = self._fallback_encodings([frame], face_locations)
             
             if len(face_encodings) == 0:
                 raise ValueError("Không thể tạo encoding từ khuôn mặt")
@@ -462,8 +695,8 @@ class AdvancedFaceRecognition:
                 'y': face_location[0],  # top
                 'width': face_location[1] - face_location[3],  # right - left
                 'height': face_location[2] - face_location[0],  # bottom - top
-                'image_width': processed_image.shape[1],
-                'image_height': processed_image.shape[0]
+                'image_width': frame.width,
+                'image_height': frame.height
             }
             
             return encoding, face_coordinates
@@ -471,33 +704,74 @@ class AdvancedFaceRecognition:
         except Exception as e:
             raise ValueError(f"Lỗi khi encode khuôn mặt: {str(e)}")
     
-    def decode_base64_image(self, base64_string):
-        """Decode base64 image to OpenCV format"""
-        if ',' in base64_string:
-            base64_string = base64_string.split(',')[1]
+    def _run_detector_tier(self, tier, level, processed_level):
+        """(top, right, bottom, left) boxes found by one cascade tier on the detection level"""
+        if tier == 'hog':
+            return face_recognition.face_locations(processed_level, number_of_times_to_upsample=0, model="hog")
+        if tier == 'hog_upsampled':
+            return face_recognition.face_locations(processed_level, number_of_times_to_upsample=1, model="hog")
+        if tier == 'cnn':
+            return face_recognition.face_locations(processed_level, number_of_times_to_upsample=1, model="cnn")
+        if tier == 'haar':
+            # Haar runs on the unfiltered level, as detect_faces does; its np.int32 boxes become plain ints
+            return [(int(y), int(x + w), int(y + h), int(x)) for (x, y, w, h) in self.detect_faces(level)]
+        raise ValueError(f"Unknown detector tier: {tier}")
+    
+    def _detect_cascade(self, level, processed_level, scale, frame, budget_ms=DETECTION_BUDGET_MS):
+        """Run DETECTOR_CASCADE until a tier finds a face; returns (face_locations, report)
+        
+        The first tier always runs. Later tiers run only while their estimated
+        cost fits in what is left of budget_ms, so a face-less image costs at
+        most about the budget instead of a CPU CNN pass.
+        """
+        started = time.perf_counter()
+        timings, skipped = {}, []
+        report = {'tier': None, 'timings_ms': timings, 'skipped': skipped, 'budget_ms': budget_ms}
         
-        image_bytes = base64.b64decode(base64_string)
-        image = Image.open(io.BytesIO(image_bytes))
+        for tier in DETECTOR_CASCADE:
+            if tier != 'haar' and not self.use_face_recognition:
+                continue  # HOG and CNN tiers need the face_recognition library
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            if timings and elapsed_ms + self.detector_costs_ms.get(tier, 0.0) > budget_ms:
+                skipped.append(tier)
+                continue
+            
+            tier_started = time.perf_counter()
+            face_locations = self._run_detector_tier(tier, level, processed_level)
+            tier_ms = (time.perf_counter() - tier_started) * 1000
+            timings[tier] = round(tier_ms, 1)
+            estimate = self.detector_costs_ms.get(tier, tier_ms)
+            self.detector_costs_ms[tier] = estimate + DETECTOR_COST_SMOOTHING * (tier_ms - estimate)
+            
+            if len(face_locations) > 0:
+                report['tier'] = tier
+                return self._to_original_space(face_locations, scale, frame.width, frame.height), report
         
-        # Convert to OpenCV format
-        opencv_image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-        return opencv_image
+        if skipped:
+            print(f"Detector cascade found no face within {budget_ms:.0f}ms, skipped: {', '.join(skipped)}")
+        return [], report
+    
+    def detection_report(self, frame):
+        """Cascade tier and per-tier timings of the last encode_face_advanced on frame, or None"""
+        entry = frame.peek(('preprocessed_face_locations', 'cascade'))
+        return entry[1] if entry else None
+    
+    def decode_base64_image(self, base64_string):
+        """Decode base64 image to OpenCV format"""
+        return decode_image_bytes(decode_base64_bytes(base64_string))
     
     def encode_face_for_registration(self, base64_image):
         """Optimized face encoding for account registration - Fast version"""
         try:
             # Decode image
-            image = self.decode_base64_image(base64_image)
+            frame = self._frame(base64_image)
             
             # Simple validation
-            if image is None or image.size == 0:
+            if frame.bgr is None or frame.bgr.size == 0:
                 raise ValueError("Ảnh không hợp lệ")
             
-            # Convert BGR to RGB once
-            rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-            
             # Use HOG model only (much faster than CNN)
-            face_locations = face_recognition.face_locations(rgb_image, model="hog")
+            face_locations = self._face_locations(frame)
             
             if len(face_locations) == 0:
                 raise ValueError("Không phát hiện được khuôn mặt trong ảnh")
@@ -506,9 +780,9 @@ class AdvancedFaceRecognition:
                 face_locations = [max(face_locations, key=lambda x: (x[2]-x[0])*(x[1]-x[3]))]
             
             # Generate encoding with minimal jitters for speed
-            face_encodings = face_recognition.face_encodings(
-                rgb_image, 
-                face_locations, 
+            face_encodings = self._face_encodings(
+                frame,
+                face_locations,
                 num_jitters=1,  # Reduced from 5 to 1 for speed
                 model="small"   # Use small model for faster processing
             )
@@ -526,8 +800,8 @@ class AdvancedFaceRecognition:
                 'y': face_location[0],  # top
                 'width': face_location[1] - face_location[3],  # right - left
                 'height': face_location[2] - face_location[0],  # bottom - top
-                'image_width': rgb_image.shape[1],
-                'image_height': rgb_image.shape[0]
+                'image_width': frame.width,
+                'image_height': frame.height
             }
             
             return encoding, face_coordinates
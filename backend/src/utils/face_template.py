@@ -0,0 +1,112 @@
+import io
+import pickle
+import struct
+import numpy as np
+
+# Fixed-layout face template:
+#   magic (4s) | format version (B) | dtype code (B) | encoder version (H) | dimension (I)
+# followed by `dimension` little-endian float32 values.
+TEMPLATE_MAGIC = b'FTPL'
+TEMPLATE_FORMAT_VERSION = 1
+TEMPLATE_HEADER = struct.Struct('<4sBBHI')
+TEMPLATE_HEADER_SIZE = TEMPLATE_HEADER.size
+
+DTYPE_FLOAT32 = 1
+_DTYPES = {DTYPE_FLOAT32: np.dtype('<f4')}
+
+# Bump when the encoder model changes so old templates can be told apart
+ENCODER_VERSION = 1
+
+LEGACY_DIMENSION = 128
+
+
+class TemplateError(ValueError):
+    """Raised when a stored face template cannot be decoded"""
+
+
+def serialize_template(encoding, encoder_version=ENCODER_VERSION):
+    """Pack a face encoding into the binary template format"""
+    data = np.ascontiguousarray(np.asarray(encoding).ravel(), dtype='<f4')
+    header = TEMPLATE_HEADER.pack(TEMPLATE_MAGIC, TEMPLATE_FORMAT_VERSION,
+                                  DTYPE_FLOAT32, encoder_version, data.shape[0])
+    return header + data.tobytes()
+
+
+def is_template(blob):
+    """Check whether a stored blob already uses the binary template format"""
+    return isinstance(blob, (bytes, bytearray, memoryview)) and bytes(blob[:4]) == TEMPLATE_MAGIC
+
+
+def read_template_header(blob):
+    """Return (format_version, dtype, encoder_version, dimension) for a template blob"""
+    if len(blob) < TEMPLATE_HEADER_SIZE:
+        raise TemplateError("Template is shorter than its header")
+
+    magic, format_version, dtype_code, encoder_version, dimension = TEMPLATE_HEADER.unpack_from(blob)
+    if magic != TEMPLATE_MAGIC:
+        raise TemplateError("Not a face template")
+    if format_version != TEMPLATE_FORMAT_VERSION:
+        raise TemplateError(f"Unsupported template format version {format_version}")
+    if dtype_code not in _DTYPES:
+        raise TemplateError(f"Unsupported template dtype code {dtype_code}")
+
+    dtype = _DTYPES[dtype_code]
+    if len(blob) != TEMPLATE_HEADER_SIZE + dimension * dtype.itemsize:
+        raise TemplateError("Template length does not match its header")
+
+    return format_version, dtype, encoder_version, dimension
+
+
+def deserialize_template(blob):
+    """Zero-copy view of the encoding stored in a template blob"""
+    _, dtype, _, dimension = read_template_header(blob)
+    return np.frombuffer(blob, dtype=dtype, count=dimension, offset=TEMPLATE_HEADER_SIZE)
+
+
+class _EncodingUnpickler(pickle.Unpickler):
+    """Unpickler that only reconstructs numpy arrays, never arbitrary objects"""
+
+    _ALLOWED = {
+        ('numpy', 'ndarray'),
+        ('numpy', 'dtype'),
+        ('numpy.core.multiarray', '_reconstruct'),
+        ('numpy.core.multiarray', 'scalar'),
+        ('numpy._core.multiarray', '_reconstruct'),
+        ('numpy._core.multiarray', 'scalar'),
+    }
+
+    def find_class(self, module, name):
+        if (module, name) in self._ALLOWED:
+            return super().find_class(module, name)
+        raise TemplateError(f"Disallowed object in legacy face encoding: {module}.{name}")
+
+
+def load_legacy_encoding(blob):
+    """Decode a pre-template encoding (numpy pickle or raw float64 buffer)"""
+    if isinstance(blob, str):
+        blob = blob.encode('latin-1')
+    blob = bytes(blob)
+
+    # Raw ndarray buffers were written directly by older /face/upload code
+    if not blob.startswith(b'\x80') and len(blob) == LEGACY_DIMENSION * 8:
+        return np.frombuffer(blob, dtype='<f8')
+
+    try:
+        encoding = _EncodingUnpickler(io.BytesIO(blob)).load()
+    except TemplateError:
+        raise
+    except Exception as e:
+        raise TemplateError(f"Cannot decode legacy face encoding: {e}")
+
+    return np.asarray(encoding, dtype=np.float64).ravel()
+
+
+def load_encoding(blob):
+    """Decode any stored face encoding; templates are returned as zero-copy float32 views"""
+    if isinstance(blob, np.ndarray):
+        return blob.ravel()
+    if is_template(blob):
+        return deserialize_template(blob)
+    if isinstance(blob, (bytes, bytearray, memoryview, str)):
+        return load_legacy_encoding(blob)
+    return np.asarray(blob, dtype=np.float64).ravel()
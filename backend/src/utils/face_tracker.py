@@ -0,0 +1,144 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+import cv2
+
+# Full detection runs every TRACK_DETECT_EVERY frames or when template tracking falls below TRACK_MIN_CONFIDENCE
+TRACK_DETECT_EVERY = int(os.environ.get('FACE_TRACK_DETECT_EVERY', '10'))
+TRACK_MIN_CONFIDENCE = float(os.environ.get('FACE_TRACK_MIN_CONFIDENCE', '0.6'))
+TRACK_SESSION_TTL = float(os.environ.get('FACE_TRACK_SESSION_TTL', '60'))  # seconds without frames
+TRACK_MAX_SESSIONS = int(os.environ.get('FACE_TRACK_MAX_SESSIONS', '256'))
+TRACK_LEVEL_WIDTH = 320  # template matching runs on a gray level this wide
+TRACK_SEARCH_MARGIN = 0.5  # search window = face box grown by this fraction on every side
+
+
+class TrackingSession:
+    """Faces last seen by one live camera preview"""
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.faces = []  # [{'box': (x, y, w, h) in tracking-level pixels, 'template': gray patch}]
+        self.frames_since_detection = 0
+        self.last_seen = time.monotonic()
+        self.lock = threading.Lock()
+
+
+class FaceTracker:
+    """Per-client tracking sessions for /face/detect-realtime
+
+    Between full detections, each face box is propagated by normalized
+    template matching in a small window on a downscaled gray frame, which
+    costs a fraction of a millisecond instead of a HOG pass. Sessions are
+    kept in an LRU and dropped after TRACK_SESSION_TTL seconds of silence.
+    """
+
+    def __init__(self, max_sessions=TRACK_MAX_SESSIONS, ttl=TRACK_SESSION_TTL):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def session(self, session_id=None):
+        """Return the live session for session_id, or a new one if it is unknown or expired"""
+        now = time.monotonic()
+        with self._lock:
+            # Expire idle sessions (oldest first) and keep the LRU bounded
+            while self._sessions:
+                oldest = next(iter(self._sessions.values()))
+                if now - oldest.last_seen <= self.ttl and len(self._sessions) < self.max_sessions:
+                    break
+                self._sessions.popitem(last=False)
+
+            session = self._sessions.get(session_id) if session_id else None
+            if session is None:
+                session = TrackingSession(uuid.uuid4().hex)
+                self._sessions[session.session_id] = session
+            else:
+                self._sessions.move_to_end(session.session_id)
+            session.last_seen = now
+            return session
+
+    def close(self, session_id):
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def process(self, session, frame, detect):
+        """Faces for the next frame of a session; detect(frame) runs the full detector when needed
+
+        Returns the detector's result dict plus a 'tracking' entry with the mode used.
+        """
+        with session.lock:
+            level, scale = self._tracking_level(frame)
+
+            if session.faces and session.frames_since_detection < TRACK_DETECT_EVERY - 1:
+                tracked = [self._track(level, face) for face in session.faces]
+                confidence = min(score for _, score in tracked)
+                if confidence >= TRACK_MIN_CONFIDENCE:
+                    for face, (box, _) in zip(session.faces, tracked):
+                        face['box'] = box
+                    session.frames_since_detection += 1
+                    return {
+                        'faces': [self._to_original(box, score, scale, frame) for box, score in tracked],
+                        'image_width': frame.width,
+                        'image_height': frame.height,
+                        'tracking': {'mode': 'track', 'confidence': confidence}
+                    }
+
+            result = detect(frame)
+            session.faces = []
+            for face in result['faces']:
+                box = (int(face['x'] * scale), int(face['y'] * scale),
+                       max(1, int(face['width'] * scale)), max(1, int(face['height'] * scale)))
+                x, y, w, h = box
+                session.faces.append({'box': box, 'template': level[y:y + h, x:x + w].copy()})
+            session.frames_since_detection = 0
+            result['tracking'] = {'mode': 'detect', 'confidence': 1.0}
+            return result
+
+    @staticmethod
+    def _tracking_level(frame):
+        """Downscaled gray copy of the frame (cached per frame); returns (image, scale)"""
+        def compute():
+            # Decoded at reduced JPEG scale unless the full image is already available
+            image, _ = frame.reduced_bgr(TRACK_LEVEL_WIDTH)
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            if gray.shape[1] > TRACK_LEVEL_WIDTH:
+                size = (TRACK_LEVEL_WIDTH, max(1, round(gray.shape[0] * TRACK_LEVEL_WIDTH / gray.shape[1])))
+                gray = cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+            return gray, gray.shape[1] / frame.width
+        return frame.cached(('tracking_level', TRACK_LEVEL_WIDTH), compute)
+
+    @staticmethod
+    def _track(level, face):
+        """Best match of the face template near its last box; returns (box, confidence)"""
+        template = face['template']
+        x, y, w, h = face['box']
+        if template.shape[0] < 4 or template.shape[1] < 4:
+            return face['box'], 0.0
+
+        pad_x, pad_y = int(w * TRACK_SEARCH_MARGIN), int(h * TRACK_SEARCH_MARGIN)
+        left, top = max(0, x - pad_x), max(0, y - pad_y)
+        right, bottom = min(level.shape[1], x + w + pad_x), min(level.shape[0], y + h + pad_y)
+        window = level[top:bottom, left:right]
+        if window.shape[0] < template.shape[0] or window.shape[1] < template.shape[1]:
+            return face['box'], 0.0
+
+        scores = cv2.matchTemplate(window, template, cv2.TM_CCOEFF_NORMED)
+        _, confidence, _, (match_x, match_y) = cv2.minMaxLoc(scores)
+        return (left + match_x, top + match_y, template.shape[1], template.shape[0]), float(confidence)
+
+    @staticmethod
+    def _to_original(box, confidence, scale, frame):
+        x, y, w, h = box
+        return {
+            'x': min(frame.width, int(x / scale)),
+            'y': min(frame.height, int(y / scale)),
+            'width': int(w / scale),
+            'height': int(h / scale),
+            'confidence': round(max(0.0, confidence), 3)
+        }
+
+# Global instance
+face_tracker = FaceTracker()
@@ -0,0 +1,100 @@
+import numpy as np
+
+# Vectorized LBP + HOG features for deployments without dlib/face_recognition.
+# Every function takes a batch of equally sized grayscale crops (N, H, W); the
+# results match the former per-pixel LBP loop and skimage.feature.hog with
+# orientations=9, pixels_per_cell=(8, 8), cells_per_block=(2, 2),
+# transform_sqrt=True, block_norm='L2-Hys'.
+FALLBACK_CROP_SIZE = (100, 100)
+HOG_ORIENTATIONS = 9
+HOG_CELL = 8
+HOG_BLOCK = 2
+
+# LBP neighbours in bit order (most significant first), clockwise from top-left
+_LBP_OFFSETS = ((-1, -1), (-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1))
+
+
+def _as_batch(images):
+    images = np.asarray(images)
+    return images[None] if images.ndim == 2 else images
+
+
+def lbp_codes(images):
+    """8-neighbour LBP code of every interior pixel (border pixels stay 0)"""
+    images = _as_batch(images)
+    height, width = images.shape[1:]
+    center = images[:, 1:-1, 1:-1]
+    codes = np.zeros(images.shape, dtype=np.uint8)
+    interior = codes[:, 1:-1, 1:-1]
+    for bit, (dy, dx) in zip(range(7, -1, -1), _LBP_OFFSETS):
+        neighbour = images[:, 1 + dy:height - 1 + dy, 1 + dx:width - 1 + dx]
+        interior |= (neighbour >= center).astype(np.uint8) << bit
+    return codes
+
+
+def lbp_histograms(images):
+    """Normalized 256-bin LBP histogram per image (N x 256)"""
+    codes = lbp_codes(images).reshape(len(_as_batch(images)), -1).astype(np.int64)
+    count = len(codes)
+    offsets = np.arange(count, dtype=np.int64)[:, None] * 256
+    histograms = np.bincount((codes + offsets).ravel(), minlength=count * 256).reshape(count, 256)
+    return histograms / histograms.sum(axis=1, keepdims=True)
+
+
+def hog_features(images):
+    """HOG descriptor per image (N x features), one set of array operations for the whole batch"""
+    images = np.sqrt(_as_batch(images).astype(np.float64))
+    count, height, width = images.shape
+
+    # Central differences, zero on the image border
+    gradient_rows = np.zeros_like(images)
+    gradient_cols = np.zeros_like(images)
+    gradient_rows[:, 1:-1, :] = images[:, 2:, :] - images[:, :-2, :]
+    gradient_cols[:, :, 1:-1] = images[:, :, 2:] - images[:, :, :-2]
+
+    magnitude = np.hypot(gradient_cols, gradient_rows)
+    orientation = np.rad2deg(np.arctan2(gradient_rows, gradient_cols)) % 180
+    bins = np.minimum((orientation // (180 / HOG_ORIENTATIONS)).astype(np.int64), HOG_ORIENTATIONS - 1)
+
+    # Mean magnitude per (cell, orientation bin); pixels beyond the last full cell are ignored
+    cells_rows, cells_cols = height // HOG_CELL, width // HOG_CELL
+    magnitude = magnitude[:, :cells_rows * HOG_CELL, :cells_cols * HOG_CELL]
+    bins = bins[:, :cells_rows * HOG_CELL, :cells_cols * HOG_CELL]
+    cell_hist = np.empty((count, cells_rows, cells_cols, HOG_ORIENTATIONS))
+    for orientation_bin in range(HOG_ORIENTATIONS):
+        weighted = np.where(bins == orientation_bin, magnitude, 0.0)
+        cell_hist[..., orientation_bin] = weighted.reshape(
+            count, cells_rows, HOG_CELL, cells_cols, HOG_CELL
+        ).sum(axis=(2, 4)) / (HOG_CELL * HOG_CELL)
+
+    # Overlapping 2x2-cell blocks, L2-Hys normalized
+    blocks = np.lib.stride_tricks.sliding_window_view(cell_hist, (HOG_BLOCK, HOG_BLOCK), axis=(1, 2))
+    blocks = blocks.transpose(0, 1, 2, 4, 5, 3)
+    eps = 1e-5
+    blocks = blocks / np.sqrt(np.sum(blocks ** 2, axis=(3, 4, 5), keepdims=True) + eps ** 2)
+    blocks = np.minimum(blocks, 0.2)
+    blocks = blocks / np.sqrt(np.sum(blocks ** 2, axis=(3, 4, 5), keepdims=True) + eps ** 2)
+    return blocks.reshape(count, -1)
+
+
+def extract_features(face_crops):
+    """Combined LBP + HOG feature matrix for a batch of 100x100 grayscale face crops"""
+    face_crops = _as_batch(face_crops)
+    return np.hstack([lbp_histograms(face_crops), hog_features(face_crops)])
+
+
+def similarity_matrix(queries, templates, template_norms=None):
+    """Fallback similarity of every query against every template (queries x templates)
+
+    0.8 * cosine + 0.2 / (1 + euclidean distance) on L2-normalized features,
+    clipped to [0, 1]; the same score compare_faces_advanced gives one pair.
+    """
+    queries = np.atleast_2d(np.asarray(queries, dtype=np.float64))
+    templates = np.atleast_2d(np.asarray(templates, dtype=np.float64))
+    if template_norms is None:
+        template_norms = np.linalg.norm(templates, axis=1)
+
+    query_norms = np.linalg.norm(queries, axis=1)
+    cosine = (queries @ templates.T) / (query_norms[:, None] * np.asarray(template_norms)[None, :])
+    euclidean = np.sqrt(np.maximum(2.0 - 2.0 * cosine, 0.0))
+    return np.clip(cosine * 0.8 + (1.0 / (1.0 + euclidean)) * 0.2, 0.0, 1.0)
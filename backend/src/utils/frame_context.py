@@ -0,0 +1,172 @@
+import base64
+import io
+import cv2
+import numpy as np
+from PIL import Image
+
+# cv2.imdecode flags that let libjpeg decode at 1/2, 1/4 or 1/8 scale (DCT scaling)
+REDUCED_DECODE_FLAGS = {
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    2: cv2.IMREAD_REDUCED_COLOR_2
+}
+
+
+def decode_base64_bytes(base64_string):
+    """Strip an optional data URL prefix and base64-decode the image bytes"""
+    if ',' in base64_string:
+        base64_string = base64_string.split(',')[1]
+    return base64.b64decode(base64_string)
+
+
+def decode_image_bytes(image_bytes):
+    """Decode encoded image bytes (bytes, bytearray or memoryview) straight to an OpenCV BGR array"""
+    # np.frombuffer wraps the buffer without copying; EXIF orientation is ignored as before
+    buffer = np.frombuffer(image_bytes, dtype=np.uint8)
+    image = cv2.imdecode(buffer, cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION) if buffer.size else None
+    if image is None:
+        raise ValueError("Không thể giải mã ảnh")
+    return image
+
+
+def read_image_size(image_bytes):
+    """(width, height) from the image header, without decoding the pixels"""
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        return image.size
+
+
+def reduced_decode_factor(width, min_width):
+    """Largest JPEG scale denominator (8, 4, 2) that keeps the image at least min_width wide, or 1"""
+    for factor in sorted(REDUCED_DECODE_FLAGS, reverse=True):
+        if width // factor >= min_width:
+            return factor
+    return 1
+
+
+# Results that are cheap to pickle; decoded arrays are always rebuilt from the bytes
+_TRANSFERABLE_KEYS = {'quality_metrics', 'size'}
+_TRANSFERABLE_PREFIXES = {'face_locations', 'preprocessed_face_locations'}
+
+
+def _is_transferable(key):
+    if isinstance(key, tuple):
+        return key[0] in _TRANSFERABLE_PREFIXES
+    return key in _TRANSFERABLE_KEYS
+
+
+class FrameContext:
+    """Per-request analysis of one image
+
+    Decoded BGR/RGB/gray arrays, quality metrics and anything passed through
+    cached() (face locations, encodings, ...) are computed lazily and at most
+    once, so every route and recognizer method can share the same work.
+    """
+
+    def __init__(self, base64_image=None, image=None, image_bytes=None):
+        # image_bytes may be any buffer (bytes, bytearray, memoryview)
+        if base64_image is None and image is None and image_bytes is None:
+            raise ValueError("Ảnh không hợp lệ")
+        self._base64_image = base64_image
+        self._image_bytes = image_bytes
+        self._bgr = image
+        self._cache = {}
+
+    @property
+    def image_bytes(self):
+        """Raw encoded image bytes (e.g. for saving the upload to disk)"""
+        if self._image_bytes is None:
+            if self._base64_image is None:
+                ok, buffer = cv2.imencode('.jpg', self._bgr)
+                if not ok:
+                    raise ValueError("Không thể mã hóa ảnh")
+                self._image_bytes = buffer.tobytes()
+            else:
+                self._image_bytes = decode_base64_bytes(self._base64_image)
+        return self._image_bytes
+
+    @property
+    def bgr(self):
+        if self._bgr is None:
+            self._bgr = decode_image_bytes(self.image_bytes)
+        return self._bgr
+
+    @property
+    def rgb(self):
+        return self.cached('rgb', lambda: cv2.cvtColor(self.bgr, cv2.COLOR_BGR2RGB))
+
+    @property
+    def gray(self):
+        return self.cached('gray', lambda: cv2.cvtColor(self.bgr, cv2.COLOR_BGR2GRAY))
+
+    @property
+    def decoded(self):
+        """True once the full-resolution image has been decoded"""
+        return self._bgr is not None
+
+    @property
+    def size(self):
+        """(width, height) of the full image; read from the header if it is not decoded yet"""
+        if self._bgr is None:
+            try:
+                return self.cached('size', lambda: read_image_size(self.image_bytes))
+            except Exception:
+                pass
+        return self.bgr.shape[1], self.bgr.shape[0]
+
+    @property
+    def width(self):
+        return self.size[0]
+
+    @property
+    def height(self):
+        return self.size[1]
+
+    def reduced_bgr(self, min_width):
+        """BGR image decoded at the smallest JPEG scale still at least min_width wide; returns (image, scale)
+
+        Uses libjpeg's reduced decoding, so a 12 MP photo never has to be
+        decoded at full size just to find faces. Falls back to the full image
+        when it is already decoded or too small to reduce.
+        """
+        def compute():
+            width = self.width
+            factor = 1 if self.decoded else reduced_decode_factor(width, min_width)
+            if factor == 1:
+                return self.bgr, 1.0
+            buffer = np.frombuffer(self.image_bytes, dtype=np.uint8)
+            image = cv2.imdecode(buffer, REDUCED_DECODE_FLAGS[factor] | cv2.IMREAD_IGNORE_ORIENTATION)
+            if image is None:
+                return self.bgr, 1.0
+            return image, image.shape[1] / width
+        return self.cached(('reduced_bgr', min_width), compute)
+
+    @property
+    def quality_metrics(self):
+        """Sharpness (Laplacian variance), mean brightness and contrast of the gray frame"""
+        def compute():
+            gray = self.gray
+            return {
+                'sharpness': float(cv2.Laplacian(gray, cv2.CV_64F).var()),
+                'brightness': float(np.mean(gray)),
+                'contrast': float(gray.std())
+            }
+        return self.cached('quality_metrics', compute)
+
+    def export_cache(self):
+        """Small, picklable cache entries worth sending to another process"""
+        return {key: value for key, value in self._cache.items() if _is_transferable(key)}
+
+    def prime(self, entries):
+        """Seed the cache with entries computed elsewhere (e.g. in an inference worker)"""
+        for key, value in entries.items():
+            self._cache.setdefault(key, value)
+
+    def peek(self, key, default=None):
+        """Return the memoized value for key without computing it"""
+        return self._cache.get(key, default)
+
+    def cached(self, key, compute):
+        """Return the memoized value for key, computing it on first use"""
+        if key not in self._cache:
+            self._cache[key] = compute()
+        return self._cache[key]
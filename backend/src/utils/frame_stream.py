@@ -0,0 +1,114 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+STREAM_IDLE_TIMEOUT = float(os.environ.get('FACE_STREAM_IDLE_TIMEOUT', '30'))  # seconds without frames
+STREAM_MAX_STREAMS = int(os.environ.get('FACE_STREAM_MAX_STREAMS', '64'))
+STREAM_CONFIRM_FRAMES = int(os.environ.get('FACE_STREAM_CONFIRM_FRAMES', '3'))  # frames a face must persist
+STREAM_RETRY_FRAMES = int(os.environ.get('FACE_STREAM_RETRY_FRAMES', '15'))  # wait before retrying a miss
+STREAM_HEARTBEAT = 15.0  # seconds between SSE keep-alive comments
+
+
+class FrameStream:
+    """One live camera connection: a single latest-frame slot plus recognition state
+
+    Producers overwrite the slot, so a slow consumer always gets the newest
+    frame and stale ones are dropped instead of queueing (backpressure).
+    """
+
+    def __init__(self, stream_id, scope_user_ids=None, scope_name='global'):
+        self.stream_id = stream_id
+        self.scope_user_ids = scope_user_ids
+        self.scope_name = scope_name
+        self.frames_received = 0
+        self.frames_processed = 0
+        self.frames_dropped = 0
+        self.last_frame_at = time.monotonic()
+        self.closed = False
+        self.consumer_attached = False
+
+        # Recognition state, touched only by the event consumer
+        self.frame_number = 0
+        self.face_streak = 0
+        self.next_attempt = 0
+        self.recognized = False
+
+        self._slot = None
+        self._condition = threading.Condition()
+
+    def push(self, image_bytes):
+        """Offer a new frame; returns True if an unprocessed older frame was dropped"""
+        with self._condition:
+            dropped = self._slot is not None
+            if dropped:
+                self.frames_dropped += 1
+            self._slot = image_bytes
+            self.frames_received += 1
+            self.last_frame_at = time.monotonic()
+            self._condition.notify()
+            return dropped
+
+    def take(self, timeout):
+        """Wait up to timeout seconds for the newest frame; returns its bytes or None"""
+        with self._condition:
+            if self._slot is None and not self.closed:
+                self._condition.wait(timeout)
+            image_bytes, self._slot = self._slot, None
+            if image_bytes is not None:
+                self.frames_processed += 1
+            return image_bytes
+
+    def close(self):
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+    @property
+    def idle(self):
+        return time.monotonic() - self.last_frame_at > STREAM_IDLE_TIMEOUT
+
+    def stats(self):
+        return {
+            'frames_received': self.frames_received,
+            'frames_processed': self.frames_processed,
+            'frames_dropped': self.frames_dropped
+        }
+
+
+class FrameStreamRegistry:
+    """Open streams by id; idle streams and the least recently used beyond the cap are closed"""
+
+    def __init__(self, max_streams=STREAM_MAX_STREAMS):
+        self.max_streams = max_streams
+        self._streams = OrderedDict()
+        self._lock = threading.Lock()
+
+    def open(self, scope_user_ids=None, scope_name='global'):
+        with self._lock:
+            for stream_id in [key for key, stream in self._streams.items() if stream.idle]:
+                self._streams.pop(stream_id).close()
+            while len(self._streams) >= self.max_streams:
+                self._streams.popitem(last=False)[1].close()
+
+            stream = FrameStream(uuid.uuid4().hex, scope_user_ids, scope_name)
+            self._streams[stream.stream_id] = stream
+            return stream
+
+    def get(self, stream_id):
+        with self._lock:
+            stream = self._streams.get(stream_id)
+            if stream is not None:
+                self._streams.move_to_end(stream_id)
+            return stream
+
+    def close(self, stream_id):
+        with self._lock:
+            stream = self._streams.pop(stream_id, None)
+        if stream is not None:
+            stream.close()
+        return stream is not None
+
+# Global instance
+frame_streams = FrameStreamRegistry()
@@ -0,0 +1,182 @@
+import fcntl
+import mmap
+import os
+import struct
+from contextlib import contextmanager
+import numpy as np
+
+# Snapshot file layout (all little-endian, every section naturally aligned):
+#   header (64 bytes): magic | format version | dimension | count | generation
+#   user_ids int64[count] | face_ids int64[count]
+#   encodings float32[count, dimension] | encoding_std float32[count] | squared_norms float32[count]
+SNAPSHOT_MAGIC = b'FGALSNAP'
+SNAPSHOT_FORMAT_VERSION = 1
+SNAPSHOT_HEADER = struct.Struct('<8sIIQQ')
+SNAPSHOT_HEADER_SIZE = 64
+
+# Delta log ("<snapshot>.delta"): FaceData changes committed since the snapshot was published
+#   header: magic | base generation
+#   records: op (B) | face_id (q) | user_id (q) | template length (I) | template bytes
+DELTA_MAGIC = b'FGALDLOG'
+DELTA_HEADER = struct.Struct('<8sQ')
+DELTA_RECORD = struct.Struct('<BqqI')
+DELTA_ADD = 1
+DELTA_REMOVE = 2
+
+
+def snapshot_file_identity(path):
+    """Cheap identity of the snapshot file; changes whenever a new snapshot is published"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+@contextmanager
+def snapshot_file_lock(path):
+    """Exclusive cross-process lock held while rebuilding and publishing a snapshot"""
+    with open(f"{path}.lock", 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def read_snapshot_generation(path):
+    """Return the generation stored in the snapshot header, or 0 if there is none"""
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(SNAPSHOT_HEADER.size)
+    except FileNotFoundError:
+        return 0
+
+    if len(header) < SNAPSHOT_HEADER.size:
+        return 0
+    magic, version, _, _, generation = SNAPSHOT_HEADER.unpack(header)
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_FORMAT_VERSION:
+        return 0
+    return generation
+
+
+def write_snapshot(path, snapshot, generation):
+    """Write a gallery snapshot and atomically replace the published file"""
+    count = len(snapshot)
+    dimension = snapshot.encodings.shape[1]
+    header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_FORMAT_VERSION, dimension, count, generation)
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(header.ljust(SNAPSHOT_HEADER_SIZE, b'\0'))
+        f.write(np.ascontiguousarray(snapshot.user_ids, dtype='<i8').tobytes())
+        f.write(np.ascontiguousarray(snapshot.face_ids, dtype='<i8').tobytes())
+        f.write(np.ascontiguousarray(snapshot.encodings, dtype='<f4').tobytes())
+        f.write(np.ascontiguousarray(snapshot.encoding_std, dtype='<f4').tobytes())
+        f.write(np.ascontiguousarray(snapshot.squared_norms, dtype='<f4').tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+
+    # Readers that already mapped the old file keep using it until they notice the new inode
+    os.replace(tmp_path, path)
+
+
+def map_snapshot(path):
+    """Map a snapshot file read-only; returns (arrays, generation, identity)
+
+    The arrays are zero-copy views into a shared mapping, so every worker
+    process reading the same file shares one copy of the gallery in memory.
+    """
+    with open(path, 'rb') as f:
+        stat = os.fstat(f.fileno())
+        identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, version, dimension, count, generation = SNAPSHOT_HEADER.unpack_from(buffer)
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_FORMAT_VERSION:
+        raise ValueError(f"Invalid gallery snapshot file: {path}")
+
+    expected_size = SNAPSHOT_HEADER_SIZE + count * 16 + count * (dimension + 2) * 4
+    if len(buffer) != expected_size:
+        raise ValueError(f"Truncated gallery snapshot file: {path}")
+
+    offset = SNAPSHOT_HEADER_SIZE
+    arrays = {}
+    for name, dtype, length in (('user_ids', '<i8', count),
+                                ('face_ids', '<i8', count),
+                                ('encodings', '<f4', count * dimension),
+                                ('encoding_std', '<f4', count),
+                                ('squared_norms', '<f4', count)):
+        arrays[name] = np.frombuffer(buffer, dtype=dtype, count=length, offset=offset)
+        offset += length * np.dtype(dtype).itemsize
+
+    arrays['encodings'] = arrays['encodings'].reshape(count, dimension)
+    return arrays, generation, identity
+
+
+def delta_log_path(path):
+    return f"{path}.delta"
+
+
+def delta_log_size(path):
+    """Size of the delta log in bytes, or None if there is none"""
+    try:
+        return os.stat(delta_log_path(path)).st_size
+    except FileNotFoundError:
+        return None
+
+
+def reset_delta_log(path, generation):
+    """Start an empty delta log for a newly published snapshot generation (atomic replace)"""
+    log_path = delta_log_path(path)
+    tmp_path = f"{log_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(DELTA_HEADER.pack(DELTA_MAGIC, generation))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, log_path)
+
+
+def append_deltas(path, generation, records):
+    """Append (op, face_id, user_id, template) records to the delta log of the given generation
+
+    Callers hold snapshot_file_lock. Raises ValueError if the log belongs to another generation.
+    """
+    with open(delta_log_path(path), 'r+b') as f:
+        header = f.read(DELTA_HEADER.size)
+        if len(header) < DELTA_HEADER.size or DELTA_HEADER.unpack(header) != (DELTA_MAGIC, generation):
+            raise ValueError(f"Delta log does not belong to snapshot generation {generation}")
+        f.seek(0, os.SEEK_END)
+        f.write(b''.join(
+            DELTA_RECORD.pack(op, face_id, user_id, len(template)) + bytes(template)
+            for op, face_id, user_id, template in records
+        ))
+        f.flush()
+
+
+def read_deltas(path, generation, offset=0):
+    """Complete records after offset in the delta log of the given generation
+
+    Returns (records, next_offset), or None if the log is missing or belongs
+    to another generation. A record still being written is left for the next read.
+    """
+    try:
+        with open(delta_log_path(path), 'rb') as f:
+            header = f.read(DELTA_HEADER.size)
+            if len(header) < DELTA_HEADER.size or DELTA_HEADER.unpack(header) != (DELTA_MAGIC, generation):
+                return None
+            offset = max(offset, DELTA_HEADER.size)
+            f.seek(offset)
+            data = f.read()
+    except FileNotFoundError:
+        return None
+
+    records, position = [], 0
+    while position + DELTA_RECORD.size <= len(data):
+        op, face_id, user_id, length = DELTA_RECORD.unpack_from(data, position)
+        end = position + DELTA_RECORD.size + length
+        if end > len(data):
+            break
+        records.append((op, face_id, user_id, data[position + DELTA_RECORD.size:end]))
+        position = end
+    return records, offset + position
@@ -0,0 +1,233 @@
+import atexit
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from src.utils.frame_context import FrameContext
+
+# Number of inference worker processes; 0 keeps detection/encoding in the request thread
+INFERENCE_WORKERS = int(os.environ.get('FACE_INFERENCE_WORKERS', '0'))
+INFERENCE_TIMEOUT = float(os.environ.get('FACE_INFERENCE_TIMEOUT', '30'))  # seconds per call
+
+
+class InferenceTimeoutError(RuntimeError):
+    """Raised when a detection/encoding call does not finish within its timeout"""
+
+
+class _FramePayload:
+    """Picklable stand-in for a FrameContext: encoded bytes plus small cached results"""
+
+    def __init__(self, frame):
+        # Buffers such as memoryview cannot be pickled
+        self.image_bytes = bytes(frame.image_bytes)
+        self.cache = frame.export_cache()
+
+    def to_frame(self):
+        frame = FrameContext(image_bytes=self.image_bytes)
+        frame.prime(self.cache)
+        return frame
+
+
+class _FrameRef:
+    """Marks where the worker returned one of the frames it was given"""
+
+    def __init__(self, position):
+        self.position = position
+
+
+def _warm_up_worker():
+    """Load the recognizer and run both dlib models once so the first request is not slow"""
+    from src.utils.face_recognition import face_recognizer
+    face_recognizer.warm_up()
+
+
+def _worker_pid():
+    return os.getpid()
+
+
+def _run_in_worker(method_name, args, kwargs):
+    """Call a face_recognizer method inside a worker process"""
+    from src.utils.face_recognition import face_recognizer
+
+    frames = []
+    def unpack(value):
+        if isinstance(value, _FramePayload):
+            frames.append(value.to_frame())
+            return frames[-1]
+        return value
+
+    args = _map_nested(unpack, args)
+    kwargs = {key: _map_nested(unpack, value) for key, value in kwargs.items()}
+    result = getattr(face_recognizer, method_name)(*args, **kwargs)
+
+    # Frames go back as references; only what the worker learned about them is returned
+    positions = {id(frame): position for position, frame in enumerate(frames)}
+    def pack(value):
+        if isinstance(value, FrameContext) and id(value) in positions:
+            return _FrameRef(positions[id(value)])
+        return value
+
+    return _map_nested(pack, result), [frame.export_cache() for frame in frames]
+
+
+def _map_nested(function, value):
+    """Apply function to every leaf of nested lists/tuples (frames may sit inside result tuples)"""
+    if isinstance(value, (list, tuple)):
+        return type(value)(_map_nested(function, item) for item in value)
+    return function(value)
+
+
+class InferenceCall:
+    """Handle for a submitted detection/encoding call"""
+
+    def __init__(self, frames, future=None, value=None, error=None):
+        self._frames = frames
+        self._future = future
+        self._value = value
+        self._error = error
+
+    def result(self, timeout=None):
+        """Wait for the call; raises InferenceTimeoutError after timeout seconds"""
+        if self._future is None:
+            if self._error is not None:
+                raise self._error
+            return self._value
+
+        try:
+            result, caches = self._future.result(timeout=timeout or INFERENCE_TIMEOUT)
+        except FutureTimeoutError:
+            # A running call cannot be interrupted; the worker finishes it and moves on
+            self._future.cancel()
+            raise InferenceTimeoutError("Hết thời gian xử lý nhận diện khuôn mặt, vui lòng thử lại")
+        except BrokenProcessPool:
+            inference_executor.reset()
+            raise RuntimeError("Tiến trình nhận diện khuôn mặt bị dừng đột ngột, vui lòng thử lại")
+
+        # Keep the caller's frames and teach them the worker's detections and quality metrics
+        for frame, cache in zip(self._frames, caches):
+            frame.prime(cache)
+
+        def unpack(value):
+            return self._frames[value.position] if isinstance(value, _FrameRef) else value
+
+        return _map_nested(unpack, result)
+
+
+class _RecognizerProxy:
+    """face_recognizer look-alike whose methods run through the executor"""
+
+    def __init__(self, executor):
+        self._executor = executor
+
+    def __getattr__(self, method_name):
+        def call(*args, **kwargs):
+            return self._executor.call(method_name, *args, **kwargs)
+        return call
+
+
+class InferenceExecutor:
+    """Runs face_recognizer detection/encoding in a pool of warmed worker processes
+
+    Each worker builds its own recognizer (dlib models are loaded once per
+    worker, not per request). Images travel as encoded bytes, and matching
+    stays in the web process against the shared gallery snapshot. With
+    FACE_INFERENCE_WORKERS=0 calls run inline, so callers never need to care.
+    """
+
+    def __init__(self, workers=INFERENCE_WORKERS):
+        self.workers = workers
+        self.recognizer = _RecognizerProxy(self)
+        self._pool = None
+        self._lock = threading.Lock()
+        self._warm_up_state = {'status': 'cold'}
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                # spawn: dlib and Flask's threads do not survive fork() reliably
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_warm_up_worker
+                )
+            return self._pool
+
+    def submit(self, method_name, *args, **kwargs):
+        """Start face_recognizer.<method_name>(*args, **kwargs); returns an InferenceCall"""
+        if self.workers <= 0:
+            from src.utils.face_recognition import face_recognizer
+            try:
+                return InferenceCall([], value=getattr(face_recognizer, method_name)(*args, **kwargs))
+            except Exception as e:
+                return InferenceCall([], error=e)
+
+        frames = []
+        def pack(value):
+            if isinstance(value, FrameContext):
+                frames.append(value)
+                return _FramePayload(value)
+            return value
+
+        args = _map_nested(pack, args)
+        kwargs = {key: _map_nested(pack, value) for key, value in kwargs.items()}
+        try:
+            future = self._get_pool().submit(_run_in_worker, method_name, args, kwargs)
+        except BrokenProcessPool:
+            self.reset()
+            future = self._get_pool().submit(_run_in_worker, method_name, args, kwargs)
+        return InferenceCall(frames, future=future)
+
+    @property
+    def warm_up_state(self):
+        """Model warm-up status of whoever runs inference (the workers, or this process inline)"""
+        if self.workers <= 0:
+            from src.utils.face_recognition import face_recognizer
+            return face_recognizer.warm_up_state
+        return self._warm_up_state
+
+    def warm_up(self):
+        """Start (and warm) every worker, or warm the inline recognizer; blocks until done"""
+        if self.workers <= 0:
+            from src.utils.face_recognition import face_recognizer
+            return face_recognizer.warm_up()
+
+        self._warm_up_state = {'status': 'warming'}
+        started = time.perf_counter()
+        try:
+            # Concurrent no-op tasks make the pool start all workers; each runs the warm-up initializer first
+            pool = self._get_pool()
+            futures = [pool.submit(_worker_pid) for _ in range(self.workers)]
+            pids = {future.result() for future in futures}
+        except Exception as e:
+            self._warm_up_state = {'status': 'failed', 'error': str(e)}
+            return self._warm_up_state
+
+        self._warm_up_state = {
+            'status': 'ready',
+            'seconds': round(time.perf_counter() - started, 3),
+            'workers': len(pids)
+        }
+        return self._warm_up_state
+
+    def call(self, method_name, *args, timeout=None, **kwargs):
+        """Run face_recognizer.<method_name> and wait for the result"""
+        return self.submit(method_name, *args, **kwargs).result(timeout=timeout)
+
+    def reset(self):
+        """Drop a broken pool; the next call starts fresh workers"""
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+# Global instance
+inference_executor = InferenceExecutor()
+atexit.register(inference_executor.shutdown)
@@ -0,0 +1,29 @@
+import threading
+
+
+class Histogram:
+    """Thread-safe fixed-bucket histogram (count per upper bound, plus +Inf)"""
+
+    def __init__(self, bounds):
+        self.bounds = tuple(bounds)
+        self._counts = [0] * (len(self.bounds) + 1)
+        self._total = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        bucket = next((i for i, bound in enumerate(self.bounds) if value <= bound), len(self.bounds))
+        with self._lock:
+            self._counts[bucket] += 1
+            self._total += value
+
+    def to_dict(self):
+        with self._lock:
+            counts = list(self._counts)
+            total = self._total
+        count = sum(counts)
+        return {
+            'buckets': [{'le': bound, 'count': c} for bound, c in zip(self.bounds + ('+Inf',), counts)],
+            'count': count,
+            'sum': total,
+            'mean': total / count if count else 0.0
+        }
@@ -0,0 +1,149 @@
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from src.utils.face_recognition import face_recognizer
+from src.utils.inference_executor import inference_executor, InferenceTimeoutError, INFERENCE_TIMEOUT, INFERENCE_WORKERS
+from src.utils.metrics import Histogram
+
+# Probes arriving within BATCH_WINDOW_MS of the first one share one encoder call and one gallery pass.
+# Off by default without inference workers: batches would then run one at a time on a single thread,
+# serializing every recognition in the web process behind it (plus the collection window).
+BATCHING_ENABLED = os.environ.get('FACE_MICRO_BATCHING', '1' if INFERENCE_WORKERS > 0 else '0') == '1'
+BATCH_WINDOW_MS = float(os.environ.get('FACE_BATCH_WINDOW_MS', '10'))
+BATCH_MAX_FACES = int(os.environ.get('FACE_BATCH_MAX_FACES', '16'))
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+QUEUE_WAIT_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 250, 1000)
+
+
+class _PendingProbe:
+    """One request waiting for its batched encoding and match"""
+
+    def __init__(self, frame, known_encodings, threshold, num_jitters):
+        self.frame = frame
+        self.known_encodings = known_encodings
+        self.threshold = threshold
+        self.num_jitters = num_jitters
+        self.enqueued_at = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MicroBatcher:
+    """Collects concurrent recognition probes into small batches
+
+    A dispatcher thread waits for the first probe, keeps collecting for up to
+    window_ms (or until max_faces probes are queued), then encodes the whole
+    batch with one encoder call and matches each gallery once. Pass it as
+    recognize_adaptive(engine=...) in place of the recognizer.
+    """
+
+    def __init__(self, window_ms=BATCH_WINDOW_MS, max_faces=BATCH_MAX_FACES, enabled=BATCHING_ENABLED):
+        self.window = window_ms / 1000.0
+        self.max_faces = max(1, max_faces)
+        self.enabled = enabled
+        self.batch_sizes = Histogram(BATCH_SIZE_BUCKETS)
+        self.queue_wait_ms = Histogram(QUEUE_WAIT_BUCKETS_MS)
+        self._queue = queue.Queue()
+        self._dispatcher = None
+        self._lock = threading.Lock()
+        # Several batches can be in flight when there are several inference workers
+        self._runner = ThreadPoolExecutor(max_workers=max(1, INFERENCE_WORKERS), thread_name_prefix='face-batch')
+
+    def recognize_probe(self, frame, known_encodings, threshold, num_jitters):
+        """Same contract as AdvancedFaceRecognition.recognize_probe, served from a shared batch"""
+        if not self.enabled:
+            return face_recognizer.recognize_probe(
+                frame, known_encodings, threshold, num_jitters=num_jitters, encoder=inference_executor.recognizer
+            )
+
+        self._ensure_dispatcher()
+        probe = _PendingProbe(face_recognizer._frame(frame), known_encodings, threshold, num_jitters)
+        self._queue.put(probe)
+
+        if not probe.done.wait(INFERENCE_TIMEOUT + self.window):
+            raise InferenceTimeoutError("Hết thời gian xử lý nhận diện khuôn mặt, vui lòng thử lại")
+        if probe.error is not None:
+            raise probe.error
+        return probe.result
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'window_ms': self.window * 1000,
+            'max_faces': self.max_faces,
+            'queued': self._queue.qsize(),
+            'batch_size': self.batch_sizes.to_dict(),
+            'queue_wait_ms': self.queue_wait_ms.to_dict()
+        }
+
+    def _ensure_dispatcher(self):
+        with self._lock:
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(target=self._dispatch, name='face-batcher', daemon=True)
+                self._dispatcher.start()
+
+    def _dispatch(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = batch[0].enqueued_at + self.window
+            while len(batch) < self.max_faces:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._runner.submit(self._run_batch, batch)
+
+    def _run_batch(self, batch):
+        started = time.perf_counter()
+        self.batch_sizes.observe(len(batch))
+        for probe in batch:
+            self.queue_wait_ms.observe((started - probe.enqueued_at) * 1000)
+
+        try:
+            # Escalated (more jitters) probes cannot share an encoder call with 1-jitter ones
+            by_jitters = defaultdict(list)
+            for probe in batch:
+                by_jitters[probe.num_jitters].append(probe)
+
+            encoded = []
+            for num_jitters, probes in by_jitters.items():
+                outcomes = inference_executor.call(
+                    'encode_probe_faces', [probe.frame for probe in probes], num_jitters=num_jitters
+                )
+                for probe, outcome in zip(probes, outcomes):
+                    if isinstance(outcome, Exception):
+                        probe.error = outcome
+                        probe.done.set()
+                    else:
+                        encoded.append((probe, outcome))
+
+            # One matrix comparison per distinct gallery (global snapshot or a scoped slice)
+            by_gallery = defaultdict(list)
+            for probe, outcome in encoded:
+                by_gallery[(id(probe.known_encodings), probe.threshold)].append((probe, outcome))
+
+            for group in by_gallery.values():
+                first_probe = group[0][0]
+                matches = face_recognizer.match_encodings(
+                    [outcome[0] for _, outcome in group], first_probe.known_encodings,
+                    first_probe.threshold, [outcome[2] for _, outcome in group]
+                )
+                for (probe, (test_encoding, face_coordinates, frame)), (match_index, score) in zip(group, matches):
+                    probe.result = (test_encoding, face_coordinates, frame, match_index, score)
+                    probe.done.set()
+        except Exception as e:
+            for probe in batch:
+                if not probe.done.is_set():
+                    probe.error = e
+                    probe.done.set()
+
+# Global instance
+face_batcher = MicroBatcher()
@@ -0,0 +1,77 @@
+import os
+from flask import request
+from src.utils.frame_context import FrameContext
+
+# Saved face images; FACE_UPLOAD_DIR points scratch/test runs away from the real uploads folder
+UPLOAD_DIR = os.environ.get(
+    'FACE_UPLOAD_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'uploads', 'faces')
+)
+
+# Image bodies can be sent as JSON base64 (legacy), multipart/form-data files or raw bytes
+# (application/octet-stream or image/*); the other fields then come from the form or query string.
+FORM_MIMETYPES = ('multipart/form-data', 'application/x-www-form-urlencoded')
+LIST_FIELDS = ('user_ids',)
+
+
+def _is_raw_body():
+    return request.mimetype == 'application/octet-stream' or request.mimetype.startswith('image/')
+
+
+def _form_value(value):
+    lowered = value.strip().lower()
+    if lowered in ('true', 'false'):
+        return lowered == 'true'
+    return value
+
+
+def request_payload():
+    """Non-image request fields as a dict, whichever body format the client used"""
+    if request.is_json:
+        return request.get_json(silent=True) or {}
+
+    source = request.form if request.mimetype in FORM_MIMETYPES else request.args
+    data = {key: _form_value(value) for key, value in source.items()}
+    for field in LIST_FIELDS:
+        values = source.getlist(field)
+        if values:
+            # user_ids=1&user_ids=2 or user_ids=1,2
+            data[field] = [item.strip() for value in values for item in value.split(',') if item.strip()]
+    return data
+
+
+def request_frame(data, field='image'):
+    """FrameContext for the request image, or None if the request has none
+
+    Uploaded files and raw bodies are wrapped as bytes and decoded once with
+    cv2.imdecode; there is no base64 round-trip.
+    """
+    if request.mimetype in FORM_MIMETYPES:
+        upload = request.files.get(field)
+        image_bytes = upload.read() if upload else b''
+        return FrameContext(image_bytes=image_bytes) if image_bytes else None
+
+    if _is_raw_body():
+        image_bytes = request.get_data(cache=False)
+        return FrameContext(image_bytes=image_bytes) if image_bytes else None
+
+    image_data = data.get(field)
+    return FrameContext(base64_image=image_data) if image_data else None
+
+
+def request_frames(data, field='images'):
+    """FrameContexts for a multi-image request (multipart files or a JSON list of base64 images)
+
+    Returns None if the field is missing or is not a list.
+    """
+    if request.mimetype in FORM_MIMETYPES:
+        uploads = [upload for upload in request.files.getlist(field) if upload]
+        if not uploads:
+            return None
+        return [FrameContext(image_bytes=upload.read()) for upload in uploads]
+
+    images = data.get(field)
+    if not images or not isinstance(images, list):
+        return None
+    # Bad entries fail individually when they are decoded
+    return [FrameContext(base64_image=image_data or '') for image_data in images]
@@ -6,6 +6,8 @@ echo "Starting application initialization..."
 # Run database migration
 echo "Running database migration..."
 python migrations/add_excuse_form_fields.py
+python migrations/convert_face_encodings_to_templates.py
+python migrations/add_attendance_indexes.py
 
 # Start the main application
 echo "Starting Flask application..."